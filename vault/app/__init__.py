@@ -8,6 +8,9 @@ from loguru import logger
 
 from .blueprints import register_blueprints
 from .response import register_global_error_handlers
+from .metrics import register_metrics
+from .profiling import register_profiling
+from .database import get_connection_stats, register_database_settings
 
 def load_env():
     """
@@ -84,8 +87,15 @@ def create_app(config_class=None) -> Flask:
     # 可选：让 vault.config 再读取“动态值型”变量（不想写入类里）
     # vault.config['SOME_RUNTIME_FLAG'] = os.getenv('SOME_RUNTIME_FLAG', 'off')
 
+    # 数据库 SQL 日志和语句计时，需在各蓝图第一次使用数据库之前设置
+    register_database_settings(flask_app)
+
     # 全局错误处理，对所有blueprint都生效
     register_global_error_handlers(flask_app)
+    # 请求指标和 /metrics，对所有blueprint都生效
+    register_metrics(flask_app)
+    # 按请求的采样分析，PROFILING_ENABLED 时才生效
+    register_profiling(flask_app)
 
     register_blueprints(flask_app)
 
@@ -93,6 +103,11 @@ def create_app(config_class=None) -> Flask:
     def healthz():
         return {"status": "ok", "env": flask_app.config.get("ENV")}, 200
 
+    @flask_app.get("/health/db")
+    def health_db():
+        # 当前 worker 各数据库连接池的状态
+        return get_connection_stats(), 200
+
     return flask_app
 
 if __name__ == '__main__':
@@ -1,20 +1,41 @@
-from flask import send_from_directory, current_app, Blueprint, request, jsonify
+from flask import current_app, Blueprint, Response, request, jsonify
 from werkzeug.utils import secure_filename
+import json
+import mimetypes
 import os
 import uuid
-from sqlalchemy import func, or_
-from PIL import Image as PILImage
-
-from .image_db import db_manager, Image, ImageType
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from loguru import logger
+
+from .image_db import db_manager, Image, ImageType, ThumbnailJob, UploadSession
 from .image_db_helper import ImageDBHelper
-from .image_db_utils import allowed_file, calculate_fileobject_md5
-from ...utils import get_value_from_request_params, get_value_from_request_params_without_error
+from .content_index import content_index
+from .similarity_index import similarity_index
+from .image_cache import image_meta_cache
+from .image_type_registry import image_type_registry, bump_version
+from . import chunked_upload
+from . import image_stats
+from . import image_search
+from .image_db_utils import allowed_file
+from .image_ingest import UploadIngest
+from .thumbnail_jobs import enqueue_thumbnail_job
+from .variant_cache import get_variant_cache
+from .image_serving import send_image_file, not_modified
+from .image_serializer import json_success
+from .image_transcode import send_negotiated, transcode_image_files, transcode_settings
+from ...database import after_commit
+from ...utils import get_param, get_value_from_request_params, get_value_from_request_params_without_error
 from ...response import (
     ApiResponse,
     register_global_error_handlers,
     ValidationException,
     ResourceNotFoundException,
     BusinessRuleException,
+    ConflictException,
     ErrorCodes
 )
 
@@ -25,22 +46,159 @@ image_bp = Blueprint('image', __name__, url_prefix='/image')
 # 全局错误处理，对所有blueprint都生效
 register_global_error_handlers(image_bp)
 
-def check_image_duplicate(image_md5):
-    """检查文件是否重复"""
+def _ingest_upload(file, folder_path):
+    """
+    把上传文件写入其类型目录下的临时文件，同时得到全文件哈希（在线程池中执行，不依赖请求上下文）
+    Returns:
+        tuple: (ingest, error)
+    """
+    ingest = UploadIngest(file)
+    try:
+        ingest.save_to_temp(folder_path)
+    except Exception as e:
+        return ingest, e
+    return ingest, None
+
+def _create_thumbnail(ingest, filepath, thumbnail_dir, thumbnail_size, transcode=(None, None)):
+    """
+    解码原图生成缩略图，返回 (width, height, phash)，尺寸优先使用图片头中的值
+    transcode 为 (formats, quality)，指定格式时同时生成 WebP/AVIF 兄弟文件
+    """
+    width, height, phash = ingest.width, ingest.height, None
+    try:
+        decoded_width, decoded_height, thumbnail_path, phash = ImageDBHelper.decode_image(filepath, thumbnail_dir, thumbnail_size)
+        width, height = width or decoded_width, height or decoded_height
+    except Exception as e:
+        logger.error(f"Failed to create thumbnail: {e}")
+        return width, height, phash
+    transcode_formats, transcode_quality = transcode
+    if transcode_formats:
+        transcode_image_files(filepath, thumbnail_path, transcode_formats, transcode_quality)
+    return width, height, phash
+
+def _reuse_duplicate(ingest, duplicate_image):
+    """
+    相同内容已存在：丢弃本次写入的临时文件，直接返回已有记录；
+    若已有记录已被软删除则恢复它（文件已被清理时用本次上传的内容补回）
+    """
+    if not duplicate_image.is_deleted:
+        ingest.discard()
+        return duplicate_image
+
+    filepath = os.path.join(current_app.config['IMAGE_UPLOAD_FOLDER'], duplicate_image.folder_name, duplicate_image.uuid_filename)
+    file_restored = not os.path.exists(filepath)
+    ingest.commit(filepath)
+    thumbnail_async = current_app.config['THUMBNAIL_ASYNC']
+    phash = None
+    if file_restored and not thumbnail_async:
+        # 文件已被 storage_gc 清理，缩略图和兄弟文件也一并不在了，与新上传一样同步重新生成
+        _, _, phash = _create_thumbnail(ingest, filepath, current_app.config['IMAGE_UPLOAD_FOLDER'],
+                                        current_app.config['THUMBNAIL_SIZE'], transcode_settings(current_app.config))
     with db_manager.session_scope() as session:
-        existing_image = session.query(Image).filter_by(md5_hash=image_md5).first()
-        return existing_image or None
+        image = session.get(Image, duplicate_image.id)
+        image.is_deleted = False
+        image.deleted_at = None
+        image_stats.record_restore(session, image)
+        if file_restored and thumbnail_async:
+            enqueue_thumbnail_job(session, image)
+        elif phash:
+            image.phash = phash
+            image.thumbnail_status = ThumbnailJob.STATUS_DONE
+        after_commit(session, lambda: image_meta_cache.invalidate_image(image))
+    return image
+
+def _add_images(session, images):
+    """
+    注册表返回的 ImageType 是游离对象，请求会话中可能已有同一类型的实例（如查重时加载的图片），
+    先合并到会话再关联，避免同一主键出现两个实例
+    """
+    for image in images:
+        image.image_type = session.merge(image.image_type, load=False)
+    session.add_all(images)
+
+def _insert_uploaded_image(image, filepath, thumbnail_async):
+    """
+    写入单条图片记录（与缩略图任务同一事务）。
+    并发上传相同内容时由 (file_size, content_hash) 唯一索引兜底，返回已存在的记录
+    Returns:
+        tuple: (image, is_duplicate)
+    """
+    try:
+        with db_manager.session_scope() as session:
+            _add_images(session, [image])
+            if thumbnail_async:
+                enqueue_thumbnail_job(session, image)
+            image_search.index_image(session, image)
+            image_stats.record_uploads(session, [image])
+            after_commit(session, lambda: _index_uploaded_images([image]))
+    except IntegrityError:
+        existing = ImageDBHelper.find_by_content(image.file_size, image.content_hash, use_index=False)
+        if existing is None:
+            raise
+        existing_path = os.path.join(current_app.config['IMAGE_UPLOAD_FOLDER'], existing.folder_name, existing.uuid_filename)
+        if existing_path != filepath and os.path.exists(filepath):
+            os.remove(filepath)
+        return existing, True
+    return image, False
+
+def _index_uploaded_images(images):
+    """事务提交之后把新图片加入本进程的查重和相似图片索引，并清除元数据缓存中同名的旧条目"""
+    for image in images:
+        content_index.add(image.file_size, image.content_hash)
+        similarity_index.add(image.id, image.phash)
+        image_meta_cache.invalidate_image(image)
+
+def _store_new_upload(ingest, image_type, original_filename, mime_type, tags, description, phash=None):
+    """
+    查重之后的新内容：把临时文件移动到以内容哈希命名的最终路径，同步缩略图模式下生成缩略图，然后写入数据库
+    写入失败时删除已移动的文件并抛出异常
+    Returns:
+        tuple: (image, is_duplicate)
+    """
+    folder_path = os.path.join(current_app.config['IMAGE_UPLOAD_FOLDER'], f"{image_type.type_id}_{image_type.type_name}")
+    # 存储文件名由内容哈希派生，相同内容只存一份
+    uuid_filename = ingest.content_filename(original_filename)
+    filepath = ingest.commit(os.path.join(folder_path, uuid_filename))
+
+    # 图片尺寸优先取自图片头
+    width, height = ingest.width, ingest.height
+
+    thumbnail_async = current_app.config['THUMBNAIL_ASYNC']
+    if not thumbnail_async:
+        # 创建缩略图，只解码一次原图，尺寸与缩略图共用同一解码结果
+        width, height, phash = _create_thumbnail(ingest, filepath, current_app.config['IMAGE_UPLOAD_FOLDER'],
+                                                 current_app.config['THUMBNAIL_SIZE'],
+                                                 transcode_settings(current_app.config))
+
+    # 保存到数据库
+    image = Image(
+        type_id=image_type.type_id,
+        image_type=image_type,
+        tags=tags,
+        uuid_filename=uuid_filename,
+        original_filename=original_filename,
+        file_size=ingest.file_size,
+        md5_hash=ingest.head_md5,
+        content_hash=ingest.content_hash,
+        mime_type=mime_type,
+        width=width,
+        height=height,
+        phash=phash,
+        description=description  # 可选描述
+    )
+
+    try:
+        return _insert_uploaded_image(image, filepath, thumbnail_async)
+    except Exception:
+        # 删除已上传的文件
+        if filepath and os.path.exists(filepath):
+            os.remove(filepath)
+        raise
 
 # 查询image type对象
 def inquiry_image_type(type_id, type_name):
-    with db_manager.session_scope() as session:
-        image_type = session.query(ImageType).filter(
-            or_(
-                ImageType.type_id == type_id,
-                ImageType.type_name == type_name
-            )
-        ).first()
-    return image_type
+    """按 type_id 或 type_name 查找图片类型，取自进程内的类型注册表，不访问数据库"""
+    return image_type_registry.get(type_id=type_id, type_name=type_name)
 
 @image_bp.route('/health', methods=['GET'])
 def api_health():
@@ -78,71 +236,162 @@ def upload_image():
     if not file or not allowed_file(file.filename, current_app.config['ALLOWED_EXTENSIONS']):
         raise ResourceNotFoundException(resource_type="不允许的文件类型", resource_id=ErrorCodes.INVALID_PARAMETER)
 
-    filepath = None
-    # 生成唯一文件名
-    ext = os.path.splitext(secure_filename(file.filename))[1]
-    uuid_filename = f"{uuid.uuid4().hex}{ext}"
-    filepath = os.path.join(current_app.config['IMAGE_UPLOAD_FOLDER'], folder_name, uuid_filename)
-    thumbnail_dir = current_app.config['IMAGE_UPLOAD_FOLDER']
-    # print(f'Generated UUID filepath: {filepath}')
-    small_check_md5 = calculate_fileobject_md5(file, chunk_size=512 * 1024)
+    folder_path = os.path.join(current_app.config['IMAGE_UPLOAD_FOLDER'], folder_name)
 
-    # print(f'Calculated MD5 (first 64KB)- {file.filename} : {small_check_md5}')
+    # 单次遍历上传流：读取前512KB计算MD5并嗅探图片头，写入临时文件时计算全文件 SHA-256
+    ingest = UploadIngest(file)
+    try:
+        ingest.save_to_temp(folder_path)
+    except Exception as e:
+        current_app.logger.error(f"Cannot save file: {e}")
+        return jsonify({'error': 'Upload failed', 'message': str(e)}), 500
 
-    # 检查重复
-    duplicate_image = check_image_duplicate(small_check_md5)
+    # 按全文件内容检查重复
+    duplicate_image = ImageDBHelper.find_by_content(ingest.file_size, ingest.content_hash)
     if duplicate_image:
+        duplicate_image = _reuse_duplicate(ingest, duplicate_image)
         return ApiResponse.success(message="Duplicate image found", data=duplicate_image.to_dict())
 
+    # 可选：拒绝近似重复的图片（如重新编码过的同一张海报），按感知哈希的汉明距离判断
+    phash = None
+    if get_param('reject_near_duplicate', False, type_=bool):
+        try:
+            phash = ImageDBHelper.calculate_image_phash(ingest.temp_path, current_app.config['THUMBNAIL_SIZE'])
+        except Exception as e:
+            current_app.logger.warning(f"Cannot calculate perceptual hash: {e}")
+        if phash:
+            distance = get_param('near_duplicate_distance', current_app.config['NEAR_DUPLICATE_DISTANCE'], type_=int)
+            similar_images = ImageDBHelper.find_similar_images(phash, distance, limit=5)
+            if similar_images:
+                ingest.discard()
+                similar_ids = [similar_image.id for similar_image, _ in similar_images]
+                raise BusinessRuleException(error_code=ErrorCodes.RESOURCE_CONFLICT, message=f"存在近似重复的图片: {similar_ids}")
+
     try:
-        # 保存原图
-        file.save(filepath)
+        image, is_duplicate = _store_new_upload(ingest, image_type, file.filename, file.content_type, tags,
+                                                request.form.get('description'), phash)
     except Exception as e:
-        current_app.logger.warning(f"Cannot save file: {e}")
+        current_app.logger.error(f"Upload failed: {e}")
+        return jsonify({'error': 'Upload failed', 'message': str(e)}), 500
+
+    if is_duplicate:
+        return ApiResponse.success(message="Duplicate image found", data=image.to_dict())
+    return ApiResponse.success(data=image.to_dict(), message="Image uploaded successfully")
+
+# 分块上传接口，协议见 chunked_upload
+@image_bp.route('/uploads', methods=['POST'])
+def create_upload_session():
+    """创建分块上传会话，参数 filename、size（总字节数）、type_id 或 type_name，可选 tags、description"""
+    filename, error = get_value_from_request_params(request, 'filename')
+    if error:
+        raise ValidationException(message="filename参数没有传", error_code=ErrorCodes.MISSING_PARAMETER)
+    if not allowed_file(filename, current_app.config['ALLOWED_EXTENSIONS']):
+        raise ValidationException(message="不允许的文件类型", error_code=ErrorCodes.INVALID_PARAMETER)
+    try:
+        total_size = int(get_value_from_request_params_without_error(request, 'size'))
+    except (TypeError, ValueError):
+        raise ValidationException(message="size参数需要是文件的总字节数", error_code=ErrorCodes.INVALID_PARAMETER)
+    max_size = current_app.config['CHUNKED_UPLOAD_MAX_SIZE']
+    if not 0 < total_size <= max_size:
+        raise ValidationException(message=f"文件大小需要在 1 到 {max_size} 字节之间", error_code=ErrorCodes.INVALID_PARAMETER)
 
-    # 获取图片信息
-    file_size = os.path.getsize(filepath)
-    # small_check_md5 = calculate_partial_md5_flexible(filepath, 512 * 1024)  # 前64KB
-    width, height = None, None
+    type_id, error1 = get_value_from_request_params(request, 'type_id')
+    type_name, error2 = get_value_from_request_params(request, 'type_name')
+    if error1 and error2:
+        raise ValidationException(message="type_id参数没有传", error_code=ErrorCodes.MISSING_PARAMETER)
+    image_type = inquiry_image_type(type_id=type_id, type_name=type_name)
+    if not image_type:
+        raise ResourceNotFoundException(resource_type="图片类型不存在", resource_id=ErrorCodes.RESOURCE_NOT_FOUND)
 
+    upload = chunked_upload.create_session(
+        current_app.config, image_type.type_id, filename, total_size,
+        mime_type=mimetypes.guess_type(filename)[0],
+        tags=get_value_from_request_params_without_error(request, 'tags') or None,
+        description=get_value_from_request_params_without_error(request, 'description')
+    )
+    data = upload.to_dict()
+    data['chunk_size'] = current_app.config['CHUNKED_UPLOAD_CHUNK_SIZE']
+    return ApiResponse.success(data=data, message="Upload session created")
+
+def _get_upload_session(upload_id):
+    upload = chunked_upload.get_session(upload_id, current_app.config)
+    if upload is None:
+        raise ResourceNotFoundException(resource_type="上传会话不存在或已过期", resource_id=ErrorCodes.RESOURCE_NOT_FOUND)
+    return upload
+
+@image_bp.route('/uploads/<upload_id>', methods=['GET'])
+def get_upload_session(upload_id):
+    """查询分块上传会话，offset 为已接收的字节数，续传时从这里开始"""
+    return ApiResponse.success(data=_get_upload_session(upload_id).to_dict())
+
+@image_bp.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """上传一个分块，请求体为原始字节，需带 Content-Range: bytes start-end/total"""
+    chunk_length = request.content_length or 0
+    if chunk_length > current_app.config['CHUNKED_UPLOAD_CHUNK_SIZE']:
+        raise ValidationException(message=f"分块不能超过 {current_app.config['CHUNKED_UPLOAD_CHUNK_SIZE']} 字节",
+                                  error_code=ErrorCodes.INVALID_PARAMETER)
     try:
-        with PILImage.open(filepath) as img:
-            width, height = img.size
-    except Exception as e:
-        current_app.logger.warning(f"Cannot get image dimensions: {e}")
-
-    # 创建缩略图
+        start, end, total = chunked_upload.parse_content_range(request.headers.get('Content-Range'), chunk_length)
+        upload = chunked_upload.append_chunk(current_app.config, upload_id, request.stream, start, end, total)
+    except chunked_upload.UploadOffsetError as e:
+        raise BusinessRuleException(error_code=ErrorCodes.RESOURCE_CONFLICT, message=str(e))
+    except ValueError as e:
+        raise ValidationException(message=str(e), error_code=ErrorCodes.INVALID_PARAMETER)
+    if upload is None:
+        raise ResourceNotFoundException(resource_type="上传会话不存在或已过期", resource_id=ErrorCodes.RESOURCE_NOT_FOUND)
+    return ApiResponse.success(data=upload.to_dict())
+
+@image_bp.route('/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_upload(upload_id):
+    """字节收齐后完成上传：查重、生成缩略图并写入数据库，返回与 /image/upload 相同的结果"""
+    _get_upload_session(upload_id)
+    # 并发的 finalize（如客户端超时后重试）只有一个能领取会话，其余的返回领取方的结果
+    claimed, upload = chunked_upload.claim_for_finalize(upload_id)
+    if not claimed:
+        return _finalized_upload_response(upload)
     try:
-        ImageDBHelper.create_thumbnail(filepath, thumbnail_dir, current_app.config['THUMBNAIL_SIZE'])
-    except Exception as e:
-        current_app.logger.error(f"Failed to create thumbnail: {e}")
+        return _finalize_claimed_upload(upload)
+    except Exception:
+        chunked_upload.release_claim(upload_id)
+        raise
+
+def _finalized_upload_response(upload):
+    """没有领取到会话时：已完成的返回对应的图片，仍在由其它请求处理的返回 409"""
+    if upload is None:
+        raise ResourceNotFoundException(resource_type="上传会话不存在或已过期", resource_id=ErrorCodes.RESOURCE_NOT_FOUND)
+    if upload.status == UploadSession.STATUS_FINALIZED:
+        # 重复的 finalize（如客户端没有收到上一次的响应）
+        image = ImageDBHelper.find_images_by_keys(Image.id, [upload.image_id]).get(upload.image_id)
+        return ApiResponse.success(data=image, message="Image uploaded successfully")
+    raise ConflictException(message="上传会话正在由另一个请求完成，请稍后重试")
+
+def _finalize_claimed_upload(upload):
+    if upload.received != upload.total_size:
+        raise BusinessRuleException(error_code=ErrorCodes.RESOURCE_CONFLICT,
+                                    message=f"上传未完成，已接收 {upload.received}/{upload.total_size} 字节")
+    image_type = inquiry_image_type(type_id=upload.type_id, type_name=None)
+    if not image_type:
+        raise ResourceNotFoundException(resource_type="图片类型不存在", resource_id=ErrorCodes.RESOURCE_NOT_FOUND)
 
-    # 保存到数据库
-    image = Image(
-        type_id=type_id,
-        tags=tags,
-        uuid_filename=uuid_filename,
-        original_filename=file.filename,
-        file_size=file_size,
-        md5_hash=small_check_md5,
-        mime_type=file.content_type,
-        width=width,
-        height=height,
-        description=request.form.get('description')  # 可选描述
-    )
+    ingest = chunked_upload.open_completed(current_app.config, upload)
+    duplicate_image = ImageDBHelper.find_by_content(ingest.file_size, ingest.content_hash)
+    if duplicate_image:
+        image = _reuse_duplicate(ingest, duplicate_image)
+        chunked_upload.mark_finalized(upload.upload_id, image.id)
+        return ApiResponse.success(message="Duplicate image found", data=image.to_dict())
 
-    with db_manager.session_scope() as session:
-        try:
-            session.add(image)
-            session.commit()
-            return ApiResponse.success(data=image.to_dict(), message="Image uploaded successfully")
-        except Exception as e:
-            session.rollback()
-            # 删除已上传的文件
-            if filepath and os.path.exists(filepath):
-                os.remove(filepath)
-            current_app.logger.error(f"Upload failed: {e}")
-            return jsonify({'error': 'Upload failed', 'message': str(e)}), 500
+    try:
+        image, is_duplicate = _store_new_upload(ingest, image_type, upload.original_filename, upload.mime_type,
+                                                upload.tags, upload.description)
+    except Exception as e:
+        current_app.logger.error(f"Upload failed: {e}")
+        chunked_upload.release_claim(upload.upload_id)
+        return jsonify({'error': 'Upload failed', 'message': str(e)}), 500
+    chunked_upload.mark_finalized(upload.upload_id, image.id)
+    if is_duplicate:
+        return ApiResponse.success(message="Duplicate image found", data=image.to_dict())
+    return ApiResponse.success(data=image.to_dict(), message="Image uploaded successfully")
 
 # 多图片上传接口
 @image_bp.route('/multiple_upload', methods=['POST'])
@@ -161,13 +410,7 @@ def upload_multiple_images():
     type_name, error2 = get_value_from_request_params(request, 'type_name')
     if error1 and error2:
         raise ValidationException(message="type_id参数没有传", error_code=ErrorCodes.MISSING_PARAMETER)
-    with db_manager.session_scope() as session:
-        image_type = session.query(ImageType).filter(
-            or_(
-                ImageType.type_id == type_id,
-                ImageType.type_name == type_name
-            )
-        ).first()
+    image_type = inquiry_image_type(type_id=type_id, type_name=type_name)
 
     if not image_type:
         raise ResourceNotFoundException(resource_type="图片类型不存在", resource_id=ErrorCodes.RESOURCE_NOT_FOUND)
@@ -175,144 +418,215 @@ def upload_multiple_images():
     folder_name = f"{image_type.type_id}_{image_type.type_name}"
 
     tags = get_value_from_request_params_without_error(request, 'tags') or None
-    results = []
-    for file in files:
+    description = request.form.get('description')
+    thumbnail_async = current_app.config['THUMBNAIL_ASYNC']
+    thumbnail_dir = current_app.config['IMAGE_UPLOAD_FOLDER']
+    thumbnail_size = current_app.config['THUMBNAIL_SIZE']
+
+    # 第一步：校验文件，结果按上传顺序占位
+    results = [None] * len(files)
+    candidates = []  # [(index, file, file_size)]
+    for index, file in enumerate(files):
         if not file or not allowed_file(file.filename, current_app.config['ALLOWED_EXTENSIONS']):
-            results.append({'filename': file.filename, 'error': 'File type not allowed'})
+            results[index] = {'filename': file.filename, 'error': 'File type not allowed'}
             continue
         file.seek(0, os.SEEK_END)
         file_size = file.tell()
         file.seek(0)
         if file_size > MAX_FILE_SIZE:
-            results.append({'filename': file.filename, 'error': f'File size exceeds {MAX_FILE_SIZE // (1024*1024)}MB'})
-            continue
-        filepath = None
-
-        ext = os.path.splitext(secure_filename(file.filename))[1]
-        uuid_filename = f"{uuid.uuid4().hex}{ext}"
-        filepath = os.path.join(current_app.config['IMAGE_UPLOAD_FOLDER'], folder_name, uuid_filename)
-        thumbnail_dir = current_app.config['IMAGE_UPLOAD_FOLDER']
-        small_check_md5 = calculate_fileobject_md5(file, chunk_size=512 * 1024)
-        duplicate_image = check_image_duplicate(small_check_md5)
-        if duplicate_image:
-            results.append({
-                'filename': file.filename,
-                'success': True,
-                'message': 'Duplicate image found',
-                'data': duplicate_image.to_dict()
-            })
+            results[index] = {'filename': file.filename, 'error': f'File size exceeds {MAX_FILE_SIZE // (1024*1024)}MB'}
             continue
-        try:
-            # 保存原图
-            file.save(filepath)
-        except Exception as e:
-            current_app.logger.warning(f"Cannot save file: {e}")
-        # file_size 已在前面获取
-        width, height = None, None
-        try:
-            with PILImage.open(filepath) as img:
-                width, height = img.size
-        except Exception as e:
-            current_app.logger.warning(f"Cannot get image dimensions: {e}")
-        try:
-            ImageDBHelper.create_thumbnail(filepath, thumbnail_dir, current_app.config['THUMBNAIL_SIZE'])
-        except Exception as e:
-            current_app.logger.error(f"Failed to create thumbnail: {e}")
+        candidates.append((index, file, file_size))
+
+    folder_path = os.path.join(current_app.config['IMAGE_UPLOAD_FOLDER'], folder_name)
+    max_workers = max(1, min(len(candidates), current_app.config['UPLOAD_BATCH_WORKERS']))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # 第二步：并发写入临时文件并计算全文件哈希，一次 IN 查询完成整批查重
+        ingested = list(executor.map(lambda candidate: _ingest_upload(candidate[1], folder_path), candidates))
+        duplicates = ImageDBHelper.find_images_by_content(
+            [(ingest.file_size, ingest.content_hash) for ingest, error in ingested if error is None]
+        )
+
+        pending = []  # [(index, file, ingest, filepath, uuid_filename)]
+        batch_content_index = {}  # 同一批次内重复的文件指向第一次出现的位置
+        for (index, file, _), (ingest, error) in zip(candidates, ingested):
+            if error is not None:
+                current_app.logger.error(f"Cannot save file: {error}")
+                results[index] = {'filename': file.filename, 'error': 'Upload failed', 'message': str(error)}
+                continue
+            content_key = (ingest.file_size, ingest.content_hash)
+            duplicate_image = duplicates.get(content_key)
+            if duplicate_image:
+                results[index] = {
+                    'filename': file.filename,
+                    'success': True,
+                    'message': 'Duplicate image found',
+                    'data': _reuse_duplicate(ingest, duplicate_image).to_dict()
+                }
+                continue
+            if content_key in batch_content_index:
+                ingest.discard()
+                results[index] = batch_content_index[content_key]
+                continue
+            batch_content_index[content_key] = index
+            uuid_filename = ingest.content_filename(file.filename)
+            filepath = ingest.commit(os.path.join(folder_path, uuid_filename))
+            pending.append((index, file, ingest, filepath, uuid_filename))
+
+        # 第三步：同步缩略图模式下并发解码生成缩略图
+        if thumbnail_async:
+            dimensions = [(ingest.width, ingest.height, None) for _, _, ingest, _, _ in pending]
+        else:
+            transcode = transcode_settings(current_app.config)
+            dimensions = list(executor.map(
+                lambda item: _create_thumbnail(item[2], item[3], thumbnail_dir, thumbnail_size, transcode),
+                pending
+            ))
+
+    # 第四步：所有新图片在同一个事务中写入数据库
+    new_images = []  # [(index, filename, image, filepath)]
+    for (index, file, ingest, filepath, uuid_filename), (width, height, phash) in zip(pending, dimensions):
         image = Image(
-            type_id=type_id,
+            type_id=image_type.type_id,
+            image_type=image_type,
             tags=tags,
             uuid_filename=uuid_filename,
             original_filename=file.filename,
-            file_size=file_size,
-            md5_hash=small_check_md5,
+            file_size=ingest.file_size,
+            md5_hash=ingest.head_md5,
+            content_hash=ingest.content_hash,
             mime_type=file.content_type,
             width=width,
             height=height,
-            description=request.form.get('description')
+            phash=phash,
+            description=description
         )
-        with db_manager.session_scope() as session:
-            try:
-                session.add(image)
-                session.commit()
-                results.append({
-                    'filename': file.filename,
+        new_images.append((index, file.filename, image, filepath))
+
+    if new_images:
+        try:
+            with db_manager.session_scope() as session:
+                _add_images(session, [image for _, _, image, _ in new_images])
+                session.flush()
+                for _, _, image, _ in new_images:
+                    if thumbnail_async:
+                        enqueue_thumbnail_job(session, image)
+                    image_search.index_image(session, image)
+                image_stats.record_uploads(session, [image for _, _, image, _ in new_images])
+                after_commit(session, lambda: _index_uploaded_images([image for _, _, image, _ in new_images]))
+            for index, filename, image, _ in new_images:
+                results[index] = {
+                    'filename': filename,
                     'success': True,
                     'data': image.to_dict()
-                })
-            except Exception as e:
-                session.rollback()
-                if filepath and os.path.exists(filepath):
-                    os.remove(filepath)
-                current_app.logger.error(f"Upload failed: {e}")
-                results.append({'filename': file.filename, 'error': 'Upload failed', 'message': str(e)})
+                }
+        except Exception as e:
+            # 整批写入失败（如并发上传了相同内容），逐条写入以定位具体文件
+            current_app.logger.warning(f"Batch insert failed, retrying one by one: {e}")
+            for index, filename, image, filepath in new_images:
+                image = Image(image_type=image_type, **{column.name: getattr(image, column.name)
+                                                        for column in Image.__table__.columns if column.name != 'id'})
+                try:
+                    image, is_duplicate = _insert_uploaded_image(image, filepath, thumbnail_async)
+                    results[index] = {'filename': filename, 'success': True, 'data': image.to_dict()}
+                    if is_duplicate:
+                        results[index]['message'] = 'Duplicate image found'
+                except Exception as e:
+                    if filepath and os.path.exists(filepath):
+                        os.remove(filepath)
+                    current_app.logger.error(f"Upload failed: {e}")
+                    results[index] = {'filename': filename, 'error': 'Upload failed', 'message': str(e)}
+
+    # 同一批次内的重复文件，复用第一次出现的结果
+    for index, result in enumerate(results):
+        if isinstance(result, int):
+            first = results[result]
+            results[index] = {
+                'filename': files[index].filename,
+                'success': first.get('success', False),
+                'message': 'Duplicate image found',
+                'data': first.get('data')
+            }
     return ApiResponse.success(data=results, message="Multiple image upload processed")
 
 @image_bp.route('/', methods=['GET'])
 def get_image_list_by_id():
-    # 分页获取图片列表
+    # 分页获取图片列表：默认使用游标分页（cursor），传 page 时使用原来的页码分页
     type_id, error1 = get_value_from_request_params(request, 'type_id')
     type_name, error2 = get_value_from_request_params(request, 'type_name')
     keywords = get_value_from_request_params_without_error(request, 'keywords')
-    page = get_value_from_request_params_without_error(request, 'page')
-    page_size = get_value_from_request_params_without_error(request, 'page_size')
+    page = get_param('page', None, type_=int)
+    page_size = get_param('page_size', ImageDBHelper.IMAGE_PAGE_SIZE, type_=int)
+    page_size = max(1, min(page_size, 500))
+    cursor = get_param('cursor', None, type_=str)
+    include_total = get_param('include_total', False, type_=bool)
+    output_format = get_param('format', None, type_=str)
 
     if error1 and error2:
         raise ValidationException(message="type_id参数没有传", error_code=ErrorCodes.MISSING_PARAMETER)
-    with db_manager.session_scope() as session:
-        image_type = session.query(ImageType).filter(
-            or_(
-                ImageType.type_id == type_id,
-                ImageType.type_name == type_name
-            )
-        ).first()
-    result = ImageDBHelper.get_image_list(page=page, page_size=page_size, type_id=image_type.type_id,
-                                          search_keyword=keywords)
-    return ApiResponse.success(data=result)
+    image_type = inquiry_image_type(type_id=type_id, type_name=type_name)
+    if not image_type:
+        raise ResourceNotFoundException(resource_type="Image type not found", resource_id=ErrorCodes.RESOURCE_NOT_FOUND)
+
+    if page is not None:
+        result = ImageDBHelper.get_image_list(page=page, page_size=page_size, type_id=image_type.type_id,
+                                              search_keyword=keywords, output_format=output_format)
+        return json_success(data=result)
+
+    try:
+        result = ImageDBHelper.get_image_page(cursor=cursor, page_size=page_size, type_id=image_type.type_id,
+                                              search_keyword=keywords, include_total=include_total,
+                                              output_format=output_format)
+    except ValueError as e:
+        raise ValidationException(message=str(e), error_code=ErrorCodes.INVALID_PARAMETER)
+    return json_success(data=result)
 
 @image_bp.route('/<path:filepath>', methods=['GET'])
 def get_image(filepath):
     """通过UUID文件名获取图片"""
-    # 检查数据库中是否存在且未删除
-    # 提取文件名
+    # 提取文件名，经元数据缓存解析为磁盘上的位置，磁盘上文件不存在时发送阶段返回 404
     filename = os.path.basename(filepath)
-    file_on_disk_name = filename
-    with db_manager.session_scope() as session:
-        image = session.query(Image).filter_by(
-            uuid_filename=filename,
-            is_deleted=False
-        ).first()
-
-        if image is None:
-            # 尝试通过原始文件名查找-不推荐，可能有重复
-            image = session.query(Image).filter_by(
-                original_filename=filename,
-                is_deleted=False
-            ).first()
-            file_on_disk_name = image.uuid_filename if image else None
-
-    if not image:
+    meta = image_meta_cache.resolve(filename)
+    if meta is None or meta.is_deleted:
         raise ResourceNotFoundException(resource_type="Image not found", resource_id=ErrorCodes.RESOURCE_NOT_FOUND)
 
-    folder_name = '0_others'
-    if image.image_type:
-        folder_name = f"{image.image_type.type_id}_{image.image_type.type_name}"
-    file_on_disk_name = os.path.join(folder_name, file_on_disk_name)
-    filepath = os.path.join(current_app.config['IMAGE_UPLOAD_FOLDER'], file_on_disk_name)
-    if not os.path.exists(filepath):
-        raise ResourceNotFoundException(resource_type="File not found on disk", resource_id=ErrorCodes.RESOURCE_NOT_FOUND)
-
-    return send_from_directory(current_app.config['IMAGE_UPLOAD_FOLDER'], file_on_disk_name)
+    file_on_disk_name = os.path.join(meta.folder_name, meta.uuid_filename)
+    return send_negotiated(current_app.config['IMAGE_UPLOAD_FOLDER'], file_on_disk_name, current_app.config,
+                           meta=meta, immutable=filename == meta.uuid_filename)
 
 @image_bp.route('/thumbnails/<filename>', methods=['GET'])
 def get_thumbnail(filename):
     """获取缩略图"""
+    meta = image_meta_cache.resolve(filename)
+    if meta is None or meta.is_deleted or filename != meta.uuid_filename:
+        raise ResourceNotFoundException(resource_type="Thumbnail not found", resource_id=ErrorCodes.RESOURCE_NOT_FOUND)
+
     thumbnail_dir = os.path.join(current_app.config['IMAGE_UPLOAD_FOLDER'], 'thumbnails')
-    thumbnail_path = os.path.join(thumbnail_dir, filename)
+    return send_negotiated(thumbnail_dir, filename, current_app.config, meta=meta, variant='thumb', immutable=True)
 
-    if not os.path.exists(thumbnail_path):
-        raise ResourceNotFoundException(resource_type="Thumbnail not found", resource_id=ErrorCodes.RESOURCE_NOT_FOUND)
+@image_bp.route('/thumbnails/<int:width>x<int:height>/<filename>', methods=['GET'])
+def get_thumbnail_variant(width, height, filename):
+    """获取指定尺寸的缩略图变体，不存在时由原图按需生成"""
+    if (width, height) not in {tuple(size) for size in current_app.config['THUMBNAIL_VARIANT_SIZES']}:
+        raise ValidationException(f"不支持的缩略图尺寸: {width}x{height}")
+
+    meta = image_meta_cache.resolve(filename)
+    if meta is None or meta.is_deleted or filename != meta.uuid_filename:
+        raise ResourceNotFoundException(resource_type="Image not found", resource_id=ErrorCodes.RESOURCE_NOT_FOUND)
+
+    representation = f"{width}x{height}"
+    response = not_modified(meta, [representation], immutable=True)
+    if response:
+        return response
 
-    return send_from_directory(thumbnail_dir, filename)
+    source_path = os.path.join(current_app.config['IMAGE_UPLOAD_FOLDER'], meta.folder_name, meta.uuid_filename)
+    variant_cache = get_variant_cache(current_app.config)
+    if not os.path.exists(variant_cache.variant_path(width, height, filename)) and not os.path.exists(source_path):
+        raise ResourceNotFoundException(resource_type="File not found on disk", resource_id=ErrorCodes.RESOURCE_NOT_FOUND)
+
+    variant_path = variant_cache.get_or_create(width, height, filename, source_path)
+    return send_image_file(os.path.dirname(variant_path), filename, current_app.config,
+                           meta=meta, representation=representation, immutable=True)
 
 def get_images_for_typeid(req):
     type_id, error1 = get_value_from_request_params(req, 'type_id')
@@ -323,13 +637,7 @@ def get_images_for_typeid(req):
 
     if error1 and error2:
         raise ValidationException(message="type_id参数没有传", error_code=ErrorCodes.MISSING_PARAMETER)
-    with db_manager.session_scope() as session:
-        image_type = session.query(ImageType).filter(
-            or_(
-                ImageType.type_id == type_id,
-                ImageType.type_name == type_name
-            )
-        ).first()
+    image_type = inquiry_image_type(type_id=type_id, type_name=type_name)
     result = ImageDBHelper.get_image_list(page=page, page_size=page_size, type_id=image_type.type_id, search_keyword=keywords)
     return result
 
@@ -338,20 +646,21 @@ def get_images_for_typeid(req):
 def download_image(image_id):
     """下载图片，使用原始文件名"""
     with db_manager.session_scope() as session:
-        image = session.query(Image).filter_by(
+        image = session.query(Image).options(joinedload(Image.image_type)).filter_by(
             id=image_id,
             is_deleted=False
         ).first()
+    if not image:
+        raise ResourceNotFoundException(resource_type="Image not found", resource_id=ErrorCodes.RESOURCE_NOT_FOUND)
 
-    filepath = os.path.join(current_app.config['IMAGE_UPLOAD_FOLDER'], image.uuid_filename)
-    if not os.path.exists(filepath):
-        return jsonify({'error': 'File not found on disk'}), 404
-
-    return send_from_directory(
+    return send_image_file(
         current_app.config['IMAGE_UPLOAD_FOLDER'],
-        image.uuid_filename,
+        os.path.join(image.folder_name, image.uuid_filename),
+        current_app.config,
         as_attachment=True,
-        download_name=image.original_filename
+        download_name=image.original_filename,
+        meta=image,
+        immutable=True
     )
 
 
@@ -363,24 +672,18 @@ def delete_image(image_id):
             id=image_id,
             is_deleted=False
         ).first()
+        if not image:
+            raise ResourceNotFoundException(resource_type="Image not found", resource_id=ErrorCodes.RESOURCE_NOT_FOUND)
 
         try:
             # 软删除（推荐）
             image.is_deleted = True
+            image.deleted_at = datetime.now()
+            image_stats.record_delete(session, image)
             session.commit()
+            image_meta_cache.invalidate_image(image)
 
-            # 如果需要物理删除文件，取消下面的注释
-            # filepath = os.path.join(current_app.config['IMAGE_UPLOAD_FOLDER'], image.uuid_filename)
-            # if os.path.exists(filepath):
-            #     os.remove(filepath)
-            #
-            # thumbnail_path = os.path.join(
-            #     current_app.config['IMAGE_UPLOAD_FOLDER'],
-            #     'thumbnails',
-            #     image.uuid_filename
-            # )
-            # if os.path.exists(thumbnail_path):
-            #     os.remove(thumbnail_path)
+            # 文件在保留期后由 storage_gc 物理删除，保留期内重新上传相同内容可以恢复
 
             return jsonify({
                 'success': True,
@@ -405,35 +708,21 @@ def list_images():
         # 筛选参数
         search = request.args.get('search', '')
 
-        # 构建查询
-        query = Image.query.filter_by(is_deleted=False)
-
-        if search:
-            query = query.filter(
-                or_(
-                    Image.original_filename.contains(search),
-                    Image.description.contains(search)
-                )
-            )
-
-        # 排序并分页
-        pagination = query.order_by(Image.upload_time.desc()).paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        # 关键词走全文索引，结果按相关度排序；没有关键词时按上传顺序倒序
+        result = image_search.search_images(keyword=search, page=page, page_size=per_page)
+        pagination = result['pagination']
 
         return jsonify({
             'success': True,
             'data': {
-                'images': [img.to_dict() for img in pagination.items],
+                'images': result['data'],
                 'pagination': {
-                    'page': page,
+                    'page': pagination['current_page'],
                     'per_page': per_page,
-                    'total': pagination.total,
-                    'pages': pagination.pages,
-                    'has_next': pagination.has_next,
-                    'has_prev': pagination.has_prev
+                    'total': pagination['total'],
+                    'pages': pagination['pages'],
+                    'has_next': pagination['has_next'],
+                    'has_prev': pagination['has_prev']
                 }
             }
         }), 200
@@ -443,36 +732,142 @@ def list_images():
         return jsonify({'error': 'Failed to list images', 'message': str(e)}), 500
 
 
+@image_bp.route('/search', methods=['GET'])
+def search_images():
+    """
+    关键词 + 标签搜索
+    参数: q 关键词（前缀匹配，多个词须同时出现），tags 逗号分隔的标签（须同时带有），type_id，page，page_size
+    返回按相关度排序的结果、命中结果的标签分面统计和分页信息
+    """
+    keyword = get_param('q', '', type_=str)
+    tags = get_param('tags', '', type_=str)
+    type_id = get_param('type_id', None, type_=int)
+    page = get_param('page', 1, type_=int)
+    page_size = max(1, min(get_param('page_size', 20, type_=int), 100))
+    if not keyword and not tags:
+        raise ValidationException(message="q 和 tags 参数至少需要一个", error_code=ErrorCodes.MISSING_PARAMETER)
+
+    result = image_search.search_images(keyword=keyword, tags=tags, type_id=type_id, page=page, page_size=page_size)
+    return ApiResponse.success(data=result)
+
+
 @image_bp.route('/<int:image_id>/info', methods=['GET'])
 def get_image_info(image_id):
     """获取图片详细信息"""
     with db_manager.session_scope() as session:
-        image = session.query(Image).filter_by(
+        image = session.query(Image).options(joinedload(Image.image_type)).filter_by(
             id=image_id,
             is_deleted=False
         ).first()
+    if not image:
+        raise ResourceNotFoundException(resource_type="Image not found", resource_id=ErrorCodes.RESOURCE_NOT_FOUND)
     return jsonify({
         'success': True,
         'data': image.to_dict()
     }), 200
 
 
+def _batch_keys(name, item_type):
+    """读取批量接口 JSON 请求体中的 name 列表并校验类型和数量"""
+    data = request.get_json(silent=True) or {}
+    keys = data.get(name)
+    if not isinstance(keys, list) or not keys:
+        raise ValidationException(message=f"请求体需要非空的 {name} 列表", error_code=ErrorCodes.MISSING_PARAMETER)
+    max_items = current_app.config['IMAGE_BATCH_MAX_ITEMS']
+    if len(keys) > max_items:
+        raise ValidationException(message=f"{name} 最多 {max_items} 个", error_code=ErrorCodes.INVALID_PARAMETER)
+    if not all(isinstance(key, item_type) and not isinstance(key, bool) for key in keys):
+        raise ValidationException(message=f"{name} 的元素类型错误", error_code=ErrorCodes.INVALID_PARAMETER)
+    return keys
+
+def _stream_json_array(keys, found):
+    """按请求顺序逐条输出 JSON 数组，不存在或已删除的位置为 null"""
+    def generate():
+        yield '['
+        for index, key in enumerate(keys):
+            yield (',' if index else '') + json.dumps(found.get(key), ensure_ascii=False)
+        yield ']'
+    return Response(generate(), mimetype='application/json')
+
+@image_bp.route('/batch/info', methods=['POST'])
+def batch_image_info():
+    """批量获取图片信息，请求体 {"ids": [1, 2, ...]}，返回与 ids 顺序一致的数组"""
+    ids = _batch_keys('ids', int)
+    return _stream_json_array(ids, ImageDBHelper.find_images_by_keys(Image.id, ids))
+
+@image_bp.route('/batch/resolve', methods=['POST'])
+def batch_resolve_images():
+    """按 UUID 文件名批量获取图片信息，请求体 {"filenames": [...]}，返回与 filenames 顺序一致的数组"""
+    filenames = _batch_keys('filenames', str)
+    return _stream_json_array(filenames, ImageDBHelper.find_images_by_keys(Image.uuid_filename, filenames))
+
+
+@image_bp.route('/exists', methods=['POST'])
+def check_images_exist():
+    """
+    上传前按内容批量查重，请求体 {"items": [{"size": 文件大小, "sha256": 全文件 SHA-256}, ...]}
+    返回与 items 顺序一致的数组，已存在且未删除的图片为其信息，否则为 null
+    """
+    items = _batch_keys('items', dict)
+    keys = []
+    for item in items:
+        size, content_hash = item.get('size'), item.get('sha256')
+        if not isinstance(size, int) or not isinstance(content_hash, str) or len(content_hash) != 64:
+            raise ValidationException(message="items 的元素需要 size 和 sha256", error_code=ErrorCodes.INVALID_PARAMETER)
+        keys.append((size, content_hash.lower()))
+    found = {key: image.to_dict() for key, image in ImageDBHelper.find_images_by_content(keys).items()
+             if not image.is_deleted}
+    return _stream_json_array(keys, found)
+
+@image_bp.route('/<int:image_id>/similar', methods=['GET'])
+def get_similar_images(image_id):
+    """查找与指定图片近似重复的图片（基于感知哈希的汉明距离）"""
+    distance = get_param('distance', current_app.config['NEAR_DUPLICATE_DISTANCE'], type_=int)
+    distance = max(0, min(distance, current_app.config['SIMILAR_IMAGES_MAX_DISTANCE']))
+    limit = get_param('limit', 20, type_=int)
+
+    with db_manager.session_scope() as session:
+        image = session.query(Image).filter_by(
+            id=image_id,
+            is_deleted=False
+        ).first()
+    if not image:
+        raise ResourceNotFoundException(resource_type="Image not found", resource_id=ErrorCodes.RESOURCE_NOT_FOUND)
+    if not image.phash:
+        raise BusinessRuleException(message="该图片的感知哈希尚未生成，请等待缩略图处理完成")
+
+    similar_images = ImageDBHelper.find_similar_images(image.phash, distance, limit=limit, exclude_id=image.id)
+    return ApiResponse.success(data=[
+        dict(similar_image.to_dict(), distance=similar_distance)
+        for similar_image, similar_distance in similar_images
+    ])
+
+
 @image_bp.route('/<int:image_id>', methods=['PUT', 'PATCH'])
 def update_image_info(image_id):
-    """更新图片信息（如描述）"""
+    """更新图片信息（描述、标签）"""
     with db_manager.session_scope() as session:
-        image = session.query(Image).filter_by(
+        image = session.query(Image).options(joinedload(Image.image_type)).filter_by(
             id=image_id,
             is_deleted=False
         ).first()
+        if not image:
+            raise ResourceNotFoundException(resource_type="Image not found", resource_id=ErrorCodes.RESOURCE_NOT_FOUND)
 
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
 
         if 'description' in data:
             image.description = data['description']
+        if 'tags' in data:
+            tags = data['tags']
+            image.tags = ','.join(tags) if isinstance(tags, list) else tags
 
         try:
+            # 描述和标签变化后同步搜索索引
+            image_search.index_image(session, image)
             session.commit()
+            # updated_at 已变化，缓存中的 Last-Modified 需要失效
+            image_meta_cache.invalidate_image(image)
             return jsonify({
                 'success': True,
                 'data': image.to_dict()
@@ -484,20 +879,18 @@ def update_image_info(image_id):
 
 @image_bp.route('/stats', methods=['GET'])
 def get_stats():
-    """获取图片服务统计信息"""
+    """获取图片服务统计信息，读取按类型物化的统计表"""
     try:
-        total_images = Image.query.filter_by(is_deleted=False).count()
-        with db_manager.session_scope() as session:
-            total_size = session.query(
-                func.sum(Image.file_size)
-            ).filter_by(is_deleted=False).scalar() or 0
-
+        stats = image_stats.get_all_stats()
         return jsonify({
             'success': True,
             'data': {
-                'total_images': total_images,
-                'total_size': total_size,
-                'total_size_human': Image._format_size(total_size)
+                'total_images': stats['active_count'],
+                'total_size': stats['active_bytes'],
+                'total_size_human': Image._format_size(stats['active_bytes']),
+                'deleted_images': stats['deleted_count'],
+                'latest_upload': stats['latest_upload'],
+                'types': stats['types']
             }
         }), 200
     except Exception as e:
@@ -515,8 +908,7 @@ def get_image_types():
         raise ValidationException(message="获取AuthenticationCode失败", error_code=ErrorCodes.PERMISSION_DENIED)
     if auth_code != current_app.config.get('IMAGE_SERVICE_AUTH_CODE'):
         raise ValidationException(message="获取AuthenticationCode失败", error_code=ErrorCodes.PERMISSION_DENIED)
-    with db_manager.session_scope() as session:
-        image_types = session.query(ImageType).all()
+    image_types = image_type_registry.all()
     types_list = [{
         'type_id': img_type.type_id,
         'type_name': img_type.type_name,
@@ -537,7 +929,7 @@ def create_image_types():
 
 
     type_id, error1 = get_value_from_request_params(request, 'type_id')
-    if error:
+    if error1:
         raise ValidationException(message="type_id参数没有传", error_code=ErrorCodes.MISSING_PARAMETER)
 
     type_name, error2 = get_value_from_request_params(request, 'type_name')
@@ -550,43 +942,37 @@ def create_image_types():
 
     description = get_value_from_request_params_without_error(request, 'description')
 
-    with db_manager.session_scope() as session:
-        existing_type = session.query(ImageType).filter(
-            or_(
-                ImageType.type_id == type_id
-            )
-        ).first()
-    if existing_type:
-        return jsonify({'error': 'Image type with same ID or name already exists'}), 400
-
     try:
-        new_type = ImageType(
-            type_id=type_id,
-            type_name=type_name,
-            description=description
-        )
-        session.add(new_type)
-        session.commit()
-
-        # 创建相应的目录
-        directory = os.path.join(current_app.config['IMAGE_UPLOAD_FOLDER'], f"{new_type.type_id}_{new_type.type_name}")
-        os.makedirs(directory, exist_ok=True)
-
-        return ApiResponse.success(data={
-            'type_id': new_type.type_id,
-            'type_name': new_type.type_name,
-            'description': new_type.description
-        }, message="图片类型创建成功", code=200)
-
+        with db_manager.session_scope() as session:
+            existing_type = session.query(ImageType).filter(ImageType.type_id == type_id).first()
+            if existing_type:
+                return jsonify({'error': 'Image type with same ID or name already exists'}), 400
+
+            new_type = ImageType(
+                type_id=type_id,
+                type_name=type_name,
+                description=description
+            )
+            session.add(new_type)
+            bump_version(session)
     except Exception as e:
-        session.rollback()
         current_app.logger.error(f"Create image type failed: {e}")
         return jsonify({'error': 'Create image type failed', 'message': str(e)}), 500
+    image_type_registry.reload()
+
+    # 创建相应的目录
+    directory = os.path.join(current_app.config['IMAGE_UPLOAD_FOLDER'], f"{new_type.type_id}_{new_type.type_name}")
+    os.makedirs(directory, exist_ok=True)
+
+    return ApiResponse.success(data={
+        'type_id': new_type.type_id,
+        'type_name': new_type.type_name,
+        'description': new_type.description
+    }, message="图片类型创建成功", code=200)
 
 @image_bp.route('/types/<int:type_id>', methods=['GET'])
 def get_image_types_with_id(type_id):
-    with db_manager.session_scope() as session:
-        image_type = session.query(ImageType).filter_by(type_id=type_id).first()
+    image_type = image_type_registry.get(type_id=type_id)
     if not image_type:
         msg = f"图片类型 type_id: {type_id} 不存在"
         raise ResourceNotFoundException(resource_type=msg, resource_id=ErrorCodes.RESOURCE_NOT_FOUND)
@@ -630,29 +1016,31 @@ def update_image_type(type_id):
             raise ResourceNotFoundException(resource_type=msg, resource_id=ErrorCodes.RESOURCE_NOT_FOUND)
 
         related_images_count = session.query(Image).filter(Image.type_id == image_type.type_id).count()
-    if related_images_count > 0:
-        raise BusinessRuleException(message="无法更新该图片类型，存在关联的图片，因安全的问题请联系管理员处理关联的图片-只支持修改type_name及tags", error_code=ErrorCodes.BUSINESS_RULE_VIOLATION)
+        if related_images_count > 0:
+            raise BusinessRuleException(message="无法更新该图片类型，存在关联的图片，因安全的问题请联系管理员处理关联的图片-只支持修改type_name及tags", error_code=ErrorCodes.BUSINESS_RULE_VIOLATION)
 
-    # 删除原有目录并创建新目录
-    old_directory = os.path.join(current_app.config['IMAGE_UPLOAD_FOLDER'], f"{image_type.type_id}_{image_type.type_name}")
-    new_directory = os.path.join(current_app.config['IMAGE_UPLOAD_FOLDER'], f"{image_type.type_id}_{type_name}")
-    try:
-        if os.path.exists(old_directory):
-            os.rename(old_directory, new_directory) # 重命名目录
-        else:
-            os.makedirs(new_directory, exist_ok=True)
-    except Exception as e:
-        current_app.logger.error(f"Failed to rename/create directory: {e}")
-        raise BusinessRuleException(message="更新图片类型失败，无法重命名目录", error_code=ErrorCodes.BUSINESS_RULE_VIOLATION)
+        # 删除原有目录并创建新目录
+        old_directory = os.path.join(current_app.config['IMAGE_UPLOAD_FOLDER'], f"{image_type.type_id}_{image_type.type_name}")
+        new_directory = os.path.join(current_app.config['IMAGE_UPLOAD_FOLDER'], f"{image_type.type_id}_{type_name}")
+        try:
+            if os.path.exists(old_directory):
+                os.rename(old_directory, new_directory) # 重命名目录
+            else:
+                os.makedirs(new_directory, exist_ok=True)
+        except Exception as e:
+            current_app.logger.error(f"Failed to rename/create directory: {e}")
+            raise BusinessRuleException(message="更新图片类型失败，无法重命名目录", error_code=ErrorCodes.BUSINESS_RULE_VIOLATION)
 
-    # 更新允许的字段
-    if type_name:
-        image_type.type_name = type_name
-    if description:
-        image_type.description = description
+        # 更新允许的字段
+        if type_name:
+            image_type.type_name = type_name
+        if description:
+            image_type.description = description
+        bump_version(session)
 
-    session.commit()
-    session.refresh(image_type)
+    image_type_registry.reload()
+    # 目录名随类型名变化，已缓存的文件位置全部失效
+    image_meta_cache.clear()
 
     return ApiResponse.success(data={
         'type_id': image_type.type_id,
@@ -686,7 +1074,10 @@ def delete_image_type(type_id):
             if os.path.exists(directory):
                 os.rmdir(directory)
             session.delete(image_type)
+            bump_version(session)
             session.commit()
+            image_type_registry.reload()
+            image_meta_cache.clear()
             return  ApiResponse.success(message="图片类型删除成功")
         except Exception as e:
             session.rollback()
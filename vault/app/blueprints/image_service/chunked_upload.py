@@ -0,0 +1,262 @@
+"""
+分块、可续传的上传
+1. POST /image/uploads 创建会话，返回 upload_id
+2. PUT /image/uploads/<upload_id> 携带 Content-Range: bytes start-end/total，按顺序把字节追加到临时文件
+   重发已接收过的范围是安全的，已有的部分会被跳过；中断后 GET 会话得到 offset，从 offset 继续
+3. POST /image/uploads/<upload_id>/finalize 收齐后走与普通上传相同的查重、缩略图和入库流程
+   finalize 先用条件 UPDATE 领取会话，并发的重复 finalize 返回领取方生成的图片
+
+会话状态保存在 upload_sessions 表中，任何 worker 都可以处理后续的请求；写入时锁定会话行，同一会话的并发 PUT 串行执行。
+全文件 SHA-256 在接收过程中增量计算，哈希状态只能保存在处理请求的进程内（hashlib 的状态无法序列化）。
+分块落在不同 worker 上时，每个 worker 只从临时文件补算自己缺少的那一段（_catch_up），
+finalize 不再从头读取整个文件；从未见过该会话的 worker 需要读取已接收的前缀，
+因此 CHUNKED_UPLOAD_MAX_SIZE 要保证一次读取能在 gunicorn 的超时内完成。
+
+清理过期会话（在项目根目录下，可放入 cron）:
+    python -m app.blueprints.image_service.chunked_upload gc
+"""
+import hashlib
+import os
+import re
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from loguru import logger
+
+from .image_db import db_manager, UploadSession
+from .image_cache import TTLCache
+from .image_ingest import UploadIngest
+
+UPLOAD_DIR_NAME = 'uploads'
+COPY_CHUNK_SIZE = 64 * 1024
+GC_INTERVAL = 600  # 秒，创建会话时顺带清理的最小间隔
+
+_CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+# upload_id -> (已计算到的偏移量, sha256 对象)
+_hashers = TTLCache(max_size=1000, ttl=24 * 3600)
+_last_gc = 0
+
+
+class UploadOffsetError(ValueError):
+    """分块的起始位置超过已接收的字节数，客户端应先查询会话的 offset"""
+
+    def __init__(self, offset):
+        self.offset = offset
+        super().__init__(f"分块不连续，已接收 {offset} 字节")
+
+
+def upload_dir(config):
+    return os.path.join(config['IMAGE_UPLOAD_FOLDER'], UPLOAD_DIR_NAME)
+
+
+def temp_path(config, upload_id):
+    # 与 UploadIngest 的临时文件同一后缀，存储清理任务按修改时间清理遗留的 .part 文件
+    return os.path.join(upload_dir(config), f"{upload_id}{UploadIngest.TEMP_SUFFIX}")
+
+
+def parse_content_range(header, chunk_length):
+    """
+    解析 Content-Range: bytes start-end/total
+    Returns:
+        tuple: (start, end, total)，end 为包含在内的最后一个字节
+    """
+    match = _CONTENT_RANGE.match((header or '').strip())
+    if not match:
+        raise ValueError("需要 Content-Range: bytes start-end/total")
+    start, end, total = (int(value) for value in match.groups())
+    if start > end or end >= total:
+        raise ValueError(f"无效的 Content-Range: {header}")
+    if end - start + 1 != chunk_length:
+        raise ValueError(f"Content-Range 长度与请求体长度 {chunk_length} 不一致")
+    return start, end, total
+
+
+def create_session(config, type_id, filename, total_size, mime_type=None, tags=None, description=None):
+    upload_id = uuid.uuid4().hex
+    os.makedirs(upload_dir(config), exist_ok=True)
+    open(temp_path(config, upload_id), 'wb').close()
+    with db_manager.session_scope() as session:
+        upload = UploadSession(upload_id=upload_id, type_id=type_id, original_filename=filename,
+                               mime_type=mime_type, total_size=total_size, received=0,
+                               tags=tags, description=description, status=UploadSession.STATUS_ACTIVE)
+        session.add(upload)
+    _hashers.set(upload_id, (0, hashlib.sha256()))
+    _maybe_gc(config)
+    return upload
+
+
+def get_session(upload_id, config):
+    """返回未过期的会话，不存在或已过期时返回 None"""
+    with db_manager.session_scope() as session:
+        upload = session.get(UploadSession, upload_id)
+    if upload is None or _expired(upload, config):
+        return None
+    return upload
+
+
+def _expired(upload, config):
+    return upload.status == UploadSession.STATUS_ACTIVE and \
+        upload.updated_at < datetime.now() - timedelta(seconds=config['CHUNKED_UPLOAD_SESSION_TTL'])
+
+
+def append_chunk(config, upload_id, stream, start, end, total):
+    """
+    把 [start, end] 追加到临时文件，已接收过的部分跳过
+    Returns:
+        UploadSession: 更新后的会话；会话不存在或已结束时返回 None
+    """
+    with db_manager.session_scope() as session:
+        # 锁定会话行，同一会话的并发 PUT 串行执行；请求会话中已有该对象时用加锁读到的值覆盖
+        upload = session.query(UploadSession).filter_by(upload_id=upload_id) \
+            .with_for_update().populate_existing().first()
+        if upload is None or upload.status != UploadSession.STATUS_ACTIVE or _expired(upload, config):
+            return None
+        if total != upload.total_size:
+            raise ValueError(f"Content-Range 的总长度应为 {upload.total_size}")
+        received = upload.received
+        if start > received:
+            raise UploadOffsetError(received)
+        if end < received:
+            return upload  # 整块都已接收过（客户端重试）
+
+        skip = received - start
+        path = temp_path(config, upload_id)
+        with open(path, 'r+b') as f:
+            # 丢弃崩溃时可能写了一半的数据
+            f.truncate(received)
+            # 之前的分块由其它 worker 接收时，从临时文件补算本进程缺少的部分；
+            # 复制一份，写入失败时不污染缓存的状态
+            hasher = _catch_up(f, upload_id, received)
+            f.seek(received)
+            while True:
+                chunk = stream.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if skip:
+                    dropped = min(skip, len(chunk))
+                    chunk, skip = chunk[dropped:], skip - dropped
+                f.write(chunk)
+                hasher.update(chunk)
+            written = f.tell()
+        if written != end + 1:
+            raise ValueError(f"请求体不完整，只收到 {written - received} 字节")
+
+        upload.received = written
+        upload.updated_at = datetime.now()
+        _hashers.set(upload_id, (written, hasher))
+    return upload
+
+
+def _catch_up(f, upload_id, until):
+    """
+    返回覆盖临时文件前 until 字节的 sha256 对象（缓存状态的副本），只读取本进程还没有计算过的部分
+    已接收的前缀不会再改变（写入前只截断到 received），缓存的状态对应的字节始终有效
+    """
+    offset, hasher = _hashers.get(upload_id, (None, None))
+    if hasher is None or offset > until:
+        offset, hasher = 0, hashlib.sha256()
+    else:
+        hasher = hasher.copy()
+    if offset < until:
+        f.seek(offset)
+        remaining = until - offset
+        while remaining:
+            chunk = f.read(min(COPY_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ValueError(f"临时文件不完整，应有 {until} 字节")
+            hasher.update(chunk)
+            remaining -= len(chunk)
+    return hasher
+
+
+def open_completed(config, upload):
+    """
+    会话的字节已收齐时，返回指向临时文件的 UploadIngest
+    全文件哈希使用增量计算的结果，最后几块落在其它 worker 上时只补算缺少的部分
+    """
+    path = temp_path(config, upload.upload_id)
+    with open(path, 'rb') as f:
+        hasher = _catch_up(f, upload.upload_id, upload.total_size)
+    _hashers.set(upload.upload_id, (upload.total_size, hasher))
+    return UploadIngest.from_file(path, content_hash=hasher.hexdigest())
+
+
+def claim_for_finalize(upload_id):
+    """
+    用条件 UPDATE 把会话从 active 改为 finalizing，同一会话的并发 finalize 只有一个能领取成功
+    领取写在调用方的事务中：MariaDB 上另一个请求的 UPDATE 等待行锁，领取方提交后它看到的是 finalized，
+    领取方回滚后状态仍是 active，由它重新领取
+    Returns:
+        tuple: (是否领取成功, 加锁读取到的最新会话，会话已被清理时为 None)
+    """
+    with db_manager.session_scope() as session:
+        claimed = session.query(UploadSession) \
+            .filter_by(upload_id=upload_id, status=UploadSession.STATUS_ACTIVE) \
+            .update({UploadSession.status: UploadSession.STATUS_FINALIZING,
+                     UploadSession.updated_at: datetime.now()}, synchronize_session=False)
+        # 加锁读取最新提交的版本，不使用本事务开始时的快照
+        upload = session.query(UploadSession).filter_by(upload_id=upload_id) \
+            .with_for_update().populate_existing().first()
+    return bool(claimed), upload
+
+
+def release_claim(upload_id):
+    """finalize 失败时把会话恢复为 active，客户端可以重试"""
+    with db_manager.session_scope() as session:
+        session.query(UploadSession) \
+            .filter_by(upload_id=upload_id, status=UploadSession.STATUS_FINALIZING) \
+            .update({UploadSession.status: UploadSession.STATUS_ACTIVE,
+                     UploadSession.updated_at: datetime.now()}, synchronize_session=False)
+
+
+def mark_finalized(upload_id, image_id):
+    with db_manager.session_scope() as session:
+        session.query(UploadSession).filter_by(upload_id=upload_id).update({
+            UploadSession.status: UploadSession.STATUS_FINALIZED,
+            UploadSession.image_id: image_id,
+            UploadSession.updated_at: datetime.now()
+        })
+    _hashers.pop(upload_id)
+
+
+def gc_upload_sessions(config):
+    """删除超过有效期的会话及其临时文件，返回删除的会话数"""
+    cutoff = datetime.now() - timedelta(seconds=config['CHUNKED_UPLOAD_SESSION_TTL'])
+    with db_manager.session_scope() as session:
+        stale = [upload_id for upload_id, in session.query(UploadSession.upload_id)
+                 .filter(UploadSession.updated_at < cutoff)]
+        if stale:
+            session.query(UploadSession) \
+                .filter(UploadSession.upload_id.in_(stale)) \
+                .delete(synchronize_session=False)
+    for upload_id in stale:
+        path = temp_path(config, upload_id)
+        if os.path.exists(path):
+            os.remove(path)
+        _hashers.pop(upload_id)
+    if stale:
+        logger.info(f"清理过期的分块上传会话 {len(stale)} 个")
+    return len(stale)
+
+
+def _maybe_gc(config):
+    global _last_gc
+    if time.monotonic() - _last_gc < GC_INTERVAL:
+        return
+    _last_gc = time.monotonic()
+    try:
+        gc_upload_sessions(config)
+    except Exception as e:
+        logger.warning(f"清理分块上传会话失败: {e}")
+
+
+if __name__ == "__main__":
+    # 要在项目根目录下运行此脚本
+    from app import create_app
+    from app.blueprints.image_service import chunked_upload
+
+    flask_app = create_app()
+    if len(sys.argv) > 1 and sys.argv[1] == 'gc':
+        chunked_upload.gc_upload_sessions(flask_app.config)
@@ -0,0 +1,100 @@
+"""
+内容寻址查重索引
+数据库中 (file_size, content_hash) 上有唯一索引，这里在它前面放一个进程内布隆过滤器：
+布隆过滤器判定"一定不存在"的新内容不再访问数据库，只有"可能存在"时才查询。
+其它 worker 新写入的内容会按 REFRESH_INTERVAL 增量同步；同步前的漏判由数据库唯一索引兜底。
+"""
+import math
+import os
+import threading
+import time
+
+from loguru import logger
+
+from .image_db import db_manager, Image
+
+
+class BloomFilter:
+    """基于 bytearray 的布隆过滤器，位置由内容哈希本身派生（双重哈希）"""
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, file_size, content_hash):
+        # content_hash 本身是均匀分布的 SHA-256，直接切片作为两个基础哈希
+        h1 = int(content_hash[:16], 16)
+        h2 = (int(content_hash[16:32], 16) ^ file_size) | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, file_size, content_hash):
+        for position in self._positions(file_size, content_hash):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def contains(self, file_size, content_hash):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(file_size, content_hash))
+
+
+class ContentIndex:
+    """每个 worker 进程一份，首次使用时从数据库加载"""
+    CAPACITY = int(os.getenv("CONTENT_INDEX_CAPACITY", 1_000_000))
+    ERROR_RATE = 0.01
+    REFRESH_INTERVAL = 60  # 秒，增量同步其它进程写入的内容
+
+    def __init__(self, capacity=CAPACITY, error_rate=ERROR_RATE, refresh_interval=REFRESH_INTERVAL):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_interval = refresh_interval
+        self._bloom = None
+        self._max_id = 0
+        self._refreshed_at = 0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        """加载 id 大于上次同步位置的记录"""
+        if self._bloom is None:
+            self._bloom = BloomFilter(self.capacity, self.error_rate)
+        with db_manager.session_scope() as session:
+            rows = session.query(Image.id, Image.file_size, Image.content_hash) \
+                .filter(Image.id > self._max_id, Image.content_hash.isnot(None)) \
+                .order_by(Image.id) \
+                .yield_per(10000)
+            count = 0
+            for image_id, file_size, content_hash in rows:
+                self._bloom.add(file_size, content_hash)
+                self._max_id = image_id
+                count += 1
+        self._refreshed_at = time.monotonic()
+        if count:
+            logger.debug(f"内容索引同步 {count} 条记录，max_id={self._max_id}")
+
+    def _ensure_fresh(self):
+        if self._bloom is not None and time.monotonic() - self._refreshed_at < self.refresh_interval:
+            return
+        with self._lock:
+            if self._bloom is None or time.monotonic() - self._refreshed_at >= self.refresh_interval:
+                try:
+                    self._refresh()
+                except Exception as e:
+                    logger.warning(f"内容索引同步失败: {e}")
+                    if self._bloom is None:
+                        raise
+
+    def might_contain(self, file_size, content_hash):
+        """False 表示一定不存在；True 表示可能存在，需要查询数据库确认"""
+        try:
+            self._ensure_fresh()
+        except Exception:
+            return True
+        return self._bloom.contains(file_size, content_hash)
+
+    def add(self, file_size, content_hash):
+        if self._bloom is None or not content_hash:
+            return
+        with self._lock:
+            self._bloom.add(file_size, content_hash)
+
+
+content_index = ContentIndex()
@@ -0,0 +1,309 @@
+"""
+服务器端批量导入
+把一个目录中的图片导入为指定类型，按批处理（默认每批 1000 个文件）：
+1. 哈希：进程池并行读取文件，一次遍历得到文件大小、全文件 SHA-256 和头部 MD5
+2. 查重：一次 IN 查询对比已有的 (file_size, content_hash)，没有全文件哈希的历史记录按 (file_size, md5_hash) 对比，
+   批次内内容相同的文件只保留第一个；重复的文件不再解码
+3. 落盘：同一文件系统上用硬链接放入 {type_id}_{type_name}/{content_hash}.{ext}，跨文件系统时复制
+4. 解码：进程池并行生成缩略图、WebP/AVIF 兄弟文件并计算尺寸和感知哈希，无法解码的文件不导入
+5. 入库：整批一次 flush（批量 INSERT），同一事务内建立搜索索引、更新统计
+每批入库后把已处理到的文件名写入检查点文件，中断后再次运行会从检查点之后继续。
+
+导入目录（在项目根目录下）:
+    python -m app.blueprints.image_service.image_bulk_import <目录> --type-id 10 [--tags movie_douban]
+"""
+import argparse
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
+from loguru import logger
+
+from .image_db import db_manager, Image, ThumbnailJob
+from .image_db_helper import ImageDBHelper
+from .image_db_utils import allowed_file
+from .image_type_registry import image_type_registry
+from .image_transcode import transcode_settings
+from .thumbnail_jobs import generate_thumbnail
+from . import image_search, image_stats
+
+BATCH_SIZE = 1000
+HEAD_SIZE = 512 * 1024  # 与 md5_hash 字段一致，只计算头部
+CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    """在子进程中执行：一次读取得到 (file_size, content_hash, head_md5)"""
+    content_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        head = f.read(HEAD_SIZE)
+        content_hash.update(head)
+        size = len(head)
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            content_hash.update(chunk)
+            size += len(chunk)
+    return size, content_hash.hexdigest(), hashlib.md5(head).hexdigest()
+
+
+def _decode_job(image_path, thumbnail_dir, size, transcode_formats, transcode_quality):
+    """在子进程中执行，失败时返回错误信息而不是抛出，避免一张坏图中断整批"""
+    try:
+        width, height, _, phash = generate_thumbnail(image_path, thumbnail_dir, size,
+                                                     transcode_formats, transcode_quality)
+        return width, height, phash, None
+    except Exception as e:
+        return None, None, None, str(e)
+
+
+def link_or_copy(source, target, allow_link=True):
+    """
+    把 source 放到 target：同一文件系统上创建硬链接，不共享同一文件系统或不支持硬链接时复制
+    target 已存在时说明内容相同，不做任何事
+    Returns:
+        bool: 是否新建了 target
+    """
+    if os.path.exists(target):
+        return False
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if allow_link:
+        try:
+            os.link(source, target)
+            return True
+        except FileExistsError:
+            return False
+        except OSError:
+            pass  # EXDEV（跨文件系统）、EPERM 等，改为复制
+    temp_path = f"{target}.{os.getpid()}.part"
+    try:
+        shutil.copyfile(source, temp_path)
+        os.replace(temp_path, target)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return True
+
+
+def content_filename(content_hash, filename):
+    # 与上传接口 UploadIngest.content_filename 相同的命名规则
+    ext = secure_filename(os.path.splitext(filename)[1]).lower()
+    return f"{content_hash}.{ext}" if ext else content_hash
+
+
+class Checkpoint:
+    """记录已入库的最后一个文件名（按文件名排序处理），对应的目录或类型变化时不复用"""
+
+    def __init__(self, path, folder, type_id):
+        self.path = path
+        self.key = {'folder': os.path.abspath(folder), 'type_id': type_id}
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return None
+        with open(self.path, encoding='utf-8') as f:
+            data = json.load(f)
+        if {key: data.get(key) for key in self.key} != self.key:
+            logger.warning(f"检查点 {self.path} 属于其它目录或类型，忽略")
+            return None
+        return data.get('last')
+
+    def save(self, last, counters):
+        if not self.path:
+            return
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(self.key, last=last, **counters), f, ensure_ascii=False)
+        os.replace(temp_path, self.path)
+
+
+def find_existing(entries):
+    """
+    查重预处理，entries: [(file_size, content_hash, head_md5)]
+    Returns:
+        set: 已存在的 (file_size, content_hash)，以及只能按 (file_size, head_md5) 判断的历史记录
+    """
+    existing = set(ImageDBHelper.find_images_by_content(
+        [(file_size, content_hash) for file_size, content_hash, _ in entries]
+    ))
+    with db_manager.session_scope() as session:
+        legacy = session.query(Image.file_size, Image.md5_hash) \
+            .filter(Image.content_hash.is_(None),
+                    Image.md5_hash.in_({head_md5 for _, _, head_md5 in entries})) \
+            .all()
+    existing.update(('md5', file_size, md5_hash) for file_size, md5_hash in legacy)
+    return existing
+
+
+def insert_images(images):
+    """
+    整批写入，同一事务内建立搜索索引并更新统计；
+    整批失败（如并发上传了相同内容）时逐条写入，跳过重复的图片
+    Returns:
+        tuple: (写入数, 重复数)
+    """
+    try:
+        with db_manager.session_scope() as session:
+            session.add_all(images)
+            session.flush()
+            for image in images:
+                image_search.index_image(session, image, replace=False)
+            image_stats.record_uploads(session, images)
+        return len(images), 0
+    except IntegrityError as e:
+        logger.warning(f"整批写入失败，改为逐条写入: {e}")
+
+    inserted = 0
+    for image in images:
+        # 批量写入失败后原对象的状态不可用，复制出新对象
+        image = Image(**{column.name: getattr(image, column.name)
+                         for column in Image.__table__.columns if column.name != 'id'})
+        try:
+            with db_manager.session_scope() as session:
+                session.add(image)
+                session.flush()
+                image_search.index_image(session, image, replace=False)
+                image_stats.record_uploads(session, [image])
+            inserted += 1
+        except IntegrityError:
+            # 已存在相同内容的图片，链接到的文件可能正被它使用，留给存储清理任务判断
+            pass
+    return inserted, len(images) - inserted
+
+
+def scan_folder(folder, allowed_extensions, after=None):
+    """按文件名排序列出目录中允许的图片文件，after 为检查点中的最后一个文件名"""
+    names = sorted(entry.name for entry in os.scandir(folder)
+                   if entry.is_file() and allowed_file(entry.name, allowed_extensions))
+    return [name for name in names if after is None or name > after]
+
+
+def bulk_import(folder, type_id, config, tags=None, description=None, processes=None, batch_size=BATCH_SIZE,
+                checkpoint_path=None, allow_link=True):
+    """
+    导入 folder 中的图片为 type_id 类型
+    Returns:
+        dict: 各项计数 {'imported', 'duplicates', 'failed'}
+    """
+    image_type = image_type_registry.get(type_id=type_id)
+    if image_type is None:
+        raise ValueError(f"图片类型不存在: {type_id}")
+
+    upload_folder = config['IMAGE_UPLOAD_FOLDER']
+    target_dir = os.path.join(upload_folder, f"{image_type.type_id}_{image_type.type_name}")
+    thumbnail_size = tuple(config['THUMBNAIL_SIZE'])
+    transcode_formats, transcode_quality = transcode_settings(config)
+
+    checkpoint = Checkpoint(checkpoint_path, folder, image_type.type_id)
+    names = scan_folder(folder, config['ALLOWED_EXTENSIONS'], after=checkpoint.load())
+    counters = {'imported': 0, 'duplicates': 0, 'failed': 0}
+    logger.info(f"开始导入 {folder} -> {target_dir}，待处理 {len(names)} 个文件")
+
+    started_at = time.monotonic()
+    with ProcessPoolExecutor(max_workers=processes or os.cpu_count()) as executor:
+        for start in range(0, len(names), batch_size):
+            batch = names[start:start + batch_size]
+            sources = [os.path.join(folder, name) for name in batch]
+
+            # 哈希
+            hashed = []  # [(name, source, (file_size, content_hash, head_md5))]
+            for name, source, future in [(name, source, executor.submit(hash_file, source))
+                                         for name, source in zip(batch, sources)]:
+                try:
+                    hashed.append((name, source, future.result()))
+                except OSError as e:
+                    logger.error(f"读取失败 {source}: {e}")
+                    counters['failed'] += 1
+
+            # 查重
+            existing = find_existing([entry for _, _, entry in hashed])
+            pending = []  # [(name, target, created, (file_size, content_hash, head_md5))]
+            for name, source, (file_size, content_hash, head_md5) in hashed:
+                if (file_size, content_hash) in existing or ('md5', file_size, head_md5) in existing:
+                    counters['duplicates'] += 1
+                    continue
+                existing.add((file_size, content_hash))
+                target = os.path.join(target_dir, content_filename(content_hash, name))
+                created = link_or_copy(source, target, allow_link)
+                pending.append((name, target, created, (file_size, content_hash, head_md5)))
+
+            # 解码，生成缩略图
+            decoded = [executor.submit(_decode_job, target, upload_folder, thumbnail_size,
+                                       transcode_formats, transcode_quality) for _, target, _, _ in pending]
+
+            images = []
+            for (name, target, created, (file_size, content_hash, head_md5)), future in zip(pending, decoded):
+                width, height, phash, error = future.result()
+                if error:
+                    logger.error(f"无法解码，跳过 {name}: {error}")
+                    counters['failed'] += 1
+                    if created:
+                        os.remove(target)
+                    continue
+                images.append(Image(
+                    type_id=image_type.type_id,
+                    uuid_filename=os.path.basename(target),
+                    original_filename=name,
+                    file_size=file_size,
+                    md5_hash=head_md5,
+                    content_hash=content_hash,
+                    phash=phash,
+                    mime_type=mimetypes.guess_type(name)[0],
+                    width=width,
+                    height=height,
+                    tags=tags,
+                    description=description,
+                    thumbnail_status=ThumbnailJob.STATUS_DONE
+                ))
+
+            # 入库
+            if images:
+                inserted, duplicates = insert_images(images)
+                counters['imported'] += inserted
+                counters['duplicates'] += duplicates
+            checkpoint.save(batch[-1], counters)
+
+            done = start + len(batch)
+            rate = done / max(time.monotonic() - started_at, 1e-6)
+            logger.info(f"导入进度: {done}/{len(names)}，{rate:.1f} 个/秒，剩余约 {(len(names) - done) / rate:.0f} 秒，"
+                        f"新增 {counters['imported']}，重复 {counters['duplicates']}，失败 {counters['failed']}")
+
+    logger.info(f"导入完成: {counters}")
+    return counters
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量导入目录中的图片")
+    parser.add_argument('folder')
+    parser.add_argument('--type-id', type=int, required=True)
+    parser.add_argument('--tags')
+    parser.add_argument('--description')
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--checkpoint', help="检查点文件，默认 ./import-<type_id>.checkpoint.json")
+    parser.add_argument('--copy', action='store_true', help="总是复制，不创建硬链接（源文件之后可能被修改时使用）")
+    args = parser.parse_args(argv)
+
+    from app import create_app
+
+    flask_app = create_app()
+    return bulk_import(
+        args.folder, args.type_id, flask_app.config,
+        tags=args.tags,
+        description=args.description,
+        processes=args.processes or flask_app.config['THUMBNAIL_WORKER_PROCESSES'],
+        batch_size=args.batch_size,
+        checkpoint_path=args.checkpoint or f"import-{args.type_id}.checkpoint.json",
+        allow_link=not args.copy,
+    )
+
+
+if __name__ == "__main__":
+    # 要在项目根目录下运行此脚本
+    from app.blueprints.image_service import image_bulk_import
+
+    image_bulk_import.main()
@@ -0,0 +1,109 @@
+"""
+图片元数据进程内缓存
+GET /image/<path> 把请求中的文件名解析为磁盘上的位置，原来每次都要查一到两次数据库。
+这里用有上限的 TTL + LRU 缓存保存解析结果，找不到的文件名也缓存（负缓存，TTL 更短）。
+删除图片、修改图片类型和上传时由本进程主动失效；其它 worker 的缓存依靠 TTL 过期。
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from sqlalchemy.orm import joinedload
+
+from .image_db import db_manager, Image
+
+ImageMeta = namedtuple('ImageMeta', ['id', 'folder_name', 'uuid_filename', 'is_deleted',
+                                     'file_size', 'content_hash', 'md5_hash', 'updated_at'])
+
+_MISSING = object()
+
+
+class TTLCache:
+    """线程安全的 TTL + LRU 缓存，超过 max_size 时淘汰最久未使用的条目"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            if entry[0] < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[1] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ImageMetaCache:
+    """文件名（uuid_filename 或 original_filename）-> ImageMeta，不存在时缓存 None"""
+    MAX_SIZE = 10000
+    TTL = 300  # 秒
+    NEGATIVE_TTL = 30  # 秒，负缓存过期更快，避免其它 worker 新上传的图片长时间 404
+
+    def __init__(self, max_size=MAX_SIZE, ttl=TTL, negative_ttl=NEGATIVE_TTL):
+        self.negative_ttl = negative_ttl
+        self._cache = TTLCache(max_size, ttl)
+
+    @staticmethod
+    def _load(filename):
+        with db_manager.session_scope() as session:
+            query = session.query(Image).options(joinedload(Image.image_type))
+            image = query.filter_by(uuid_filename=filename).first()
+            if image is None:
+                # 尝试通过原始文件名查找-不推荐，可能有重复
+                image = query.filter_by(
+                    original_filename=filename,
+                    is_deleted=False
+                ).first()
+            if image is None:
+                return None
+            return ImageMeta(image.id, image.folder_name, image.uuid_filename, bool(image.is_deleted),
+                             image.file_size, image.content_hash, image.md5_hash, image.updated_at)
+
+    def resolve(self, filename):
+        """返回 ImageMeta；数据库中不存在时返回 None"""
+        meta = self._cache.get(filename, _MISSING)
+        if meta is not _MISSING:
+            return meta
+        meta = self._load(filename)
+        self._cache.set(filename, meta, ttl=None if meta else self.negative_ttl)
+        return meta
+
+    def invalidate(self, *filenames):
+        for filename in filenames:
+            if filename:
+                self._cache.pop(filename)
+
+    def invalidate_image(self, image):
+        self.invalidate(image.uuid_filename, image.original_filename)
+
+    def clear(self):
+        self._cache.clear()
+
+
+image_meta_cache = ImageMetaCache()
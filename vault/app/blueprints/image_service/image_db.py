@@ -1,99 +1,14 @@
-import os
 from datetime import datetime
 from functools import wraps
 
-from sqlalchemy import create_engine, Column, Integer, String, Text, ForeignKey, DateTime, Boolean
-from sqlalchemy.orm import sessionmaker, scoped_session, relationship, declarative_base
+from sqlalchemy import Column, Integer, BigInteger, String, Text, ForeignKey, DateTime, Boolean, Index
+from sqlalchemy.orm import relationship, declarative_base
 from sqlalchemy import inspect, func, text
-from sqlalchemy.pool import QueuePool
-from contextlib import contextmanager
-
-from loguru import logger
-
-class DatabaseManager:
-    def __init__(self, connection_url):
-        self.engine = create_engine(
-            connection_url,
-            # 连接池配置
-            poolclass=QueuePool,
-            pool_size=20,
-            max_overflow=30,
-            pool_pre_ping=True,
-            pool_recycle=3600,
-
-            # 性能配置
-            echo_pool=True,  # 生产环境设为 False
-            echo=True,  # 生产环境设为 False
-
-            # 连接参数
-            connect_args={
-                'connect_timeout': 10,
-                'read_timeout': 60,
-                'write_timeout': 60,
-                'charset': 'utf8mb4'
-            }
-        )
-
-        # 线程安全的会话
-        self.session_factory = sessionmaker(
-            bind=self.engine,
-            autocommit=False,
-            autoflush=False,
-            expire_on_commit=False
-        )
-        self.ScopedSession = scoped_session(self.session_factory)
-
-
-    @contextmanager
-    def session_scope(self):
-        """提供事务范围的会话上下文"""
-        session = self.ScopedSession()
-        try:
-            yield session
-            session.commit()
-        except Exception:
-            session.rollback()
-            raise
-        finally:
-            self.ScopedSession.remove()
-
-    def get_connection_stats(self):
-        """获取连接池详细状态"""
-        pool = self.engine.pool
-
-        status = {
-            "pool_class": type(pool).__name__,
-            "pool_size": pool.size(),  # 连接池配置大小
-            "checked_out": pool.checkedout(),  # 已签出的连接数
-            "available": pool.size() - pool.checkedout(),  # 可用连接数
-            "overflow": pool.overflow(),  # 当前溢出连接数
-            "max_overflow": pool._max_overflow,  # 最大溢出数
-            "total_connections": pool.size() + pool.overflow(),  # 总连接数
-        }
-
-        return status
-
-# 创建数据库引擎
-def create_engine_from_env():
-    # 从环境变量读取配置
-    db_config = {
-        'username': os.getenv('DB_USER', 'root'),
-        'password': os.getenv('DB_PASSWORD', ''),
-        'host': os.getenv('DB_HOST', 'localhost'),
-        'port': os.getenv('DB_PORT', '3306'),
-        'database': os.getenv('DB_DATABASE_IMAGE', 'image_db')
-    }
-    # 构建连接字符串
-    connection_string = (
-        f"mysql+pymysql://{db_config['username']}:{db_config['password']}"
-        f"@{db_config['host']}:{db_config['port']}/{db_config['database']}"
-    )
-
-    logger.info(f"connection_string: ${connection_string}")
 
-    return DatabaseManager(connection_string)
+from ...database import register_database, database_url_from_env
 
-db_manager = create_engine_from_env()
+# 连接池在各进程第一次使用时创建，见 app.database
+db_manager = register_database('image', database_url_from_env('DB_DATABASE_IMAGE', 'image_db'))
 
 def get_db():
     """依赖项：为每个请求提供数据库会话"""
@@ -148,9 +63,11 @@ class Image(Base):
     # 数据库字段 - 存储实际的ID值 外键：关联 image_types 表中的 type_id 存储在 images 表中
     type_id = Column(Integer, ForeignKey('image_types.type_id'))
     uuid_filename = Column(String(100), unique=True, nullable=False, index=True)
-    original_filename = Column(String(255), nullable=False)
+    original_filename = Column(String(255), nullable=False, index=True)  # get_image 按原始文件名回退查找
     file_size = Column(Integer)
-    md5_hash = Column(String(32), index=True)
+    md5_hash = Column(String(32), index=True)  # 文件前512KB的MD5，仅为兼容保留
+    content_hash = Column(String(64))  # 全文件 SHA-256，与 file_size 组成唯一索引用于查重
+    phash = Column(String(16))  # 缩略图上计算的感知哈希（dHash），用于近似重复检测
     width = Column(Integer)  # 图片宽度
     height = Column(Integer)  # 图片高度
     mime_type = Column(String(50))
@@ -160,7 +77,10 @@ class Image(Base):
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     description = Column(Text)  # 可选：图片描述
     is_deleted = Column(Boolean, default=False)  # 软删除标记
+    deleted_at = Column(DateTime)  # 软删除时间，storage_gc 按保留期物理删除
     tags = Column(String(255))  # 可选：标签，逗号分隔
+    thumbnail_status = Column(String(16), default='done')  # 缩略图状态: pending / running / done / failed
+    search_text = Column(Text)  # 文件名、描述、标签切分后的词，供 FULLTEXT 索引使用，由 image_search 维护
 
     # 建立与 ImageTypes 的关联关系
     # ORM关系 - 提供对象导航 是SQLAlchemy的ORM关系属性 存在于Python对象中，不在数据库中
@@ -172,16 +92,31 @@ class Image(Base):
     # 只定义单向关系
     # image_type = relationship("ImageType")
     # 方式1: 使用 lazy='joined' 总是预加载
-    image_type = relationship('ImageType', lazy='joined')
+    # 方式2: 默认不加载，需要 folder_name / to_dict 的查询用 options(joinedload(Image.image_type)) 一并 JOIN，
+    # 会话关闭后（请求之外的 session_scope 退出后）才访问的必须预加载，否则抛出 DetachedInstanceError
+    image_type = relationship('ImageType', lazy='select')
+
+    __table_args__ = (
+        # 内容寻址查重：相同字节的文件只保留一条记录
+        Index('ux_images_file_size_content_hash', 'file_size', 'content_hash', unique=True),
+        # 按类型的游标分页：WHERE type_id = ? AND is_deleted = 0 AND id < ? ORDER BY id DESC
+        Index('ix_images_type_id_is_deleted_id', 'type_id', 'is_deleted', 'id'),
+        # 关键词搜索（MariaDB FULLTEXT，其它数据库上为普通索引，搜索时退化为 LIKE）
+        Index('ft_images_search_text', 'search_text', mysql_prefix='FULLTEXT'),
+    )
 
     def __repr__(self):
         return f'<Image {self.uuid_filename}>'
 
-    def to_dict(self):
-        folder_name = "0_others"
+    @property
+    def folder_name(self):
+        """图片所在的目录名称"""
         if self.image_type is not None:
-            folder_name = f"{self.image_type.type_id}_{self.image_type.type_name}"
-        url_str = f"/images/{folder_name}/{self.uuid_filename}"
+            return f"{self.image_type.type_id}_{self.image_type.type_name}"
+        return "0_others"
+
+    def to_dict(self):
+        url_str = f"/images/{self.folder_name}/{self.uuid_filename}"
 
         return {
             'id': self.id,
@@ -199,7 +134,8 @@ class Image(Base):
                 'width': self.width,
                 'height': self.height
             } if self.width and self.height else None,
-            'description': self.description
+            'description': self.description,
+            'thumbnail_status': self.thumbnail_status or ThumbnailJob.STATUS_DONE
         }
 
     @staticmethod
@@ -213,30 +149,18 @@ class Image(Base):
 
     @classmethod
     def get_database_status(cls):
-        """获取数据库状态信息"""
+        """获取数据库状态信息，只读取按类型物化的统计表，不扫描 images"""
         try:
             with db_manager.session_scope() as session:
-                # 基础统计
-                total_count = session.query(func.count(cls.id)).scalar() or 0
-                active_count = session.query(func.count(cls.id)).filter_by(is_deleted=False).scalar() or 0
-                deleted_count = session.query(func.count(cls.id)).filter_by(is_deleted=True).scalar() or 0
-
-                # 存储统计
-                total_size = session.query(func.sum(cls.file_size)).filter_by(is_deleted=False).scalar() or 0
-                deleted_size = session.query(func.sum(cls.file_size)).filter_by(is_deleted=True).scalar() or 0
-
-                # 文件类型统计
-                mime_stats = session.query(
-                    cls.mime_type,
-                    func.count(cls.id).label('count')
-                ).filter_by(is_deleted=False).group_by(cls.mime_type).all()
-
-                # 最近上传
-                latest_upload = session.query(cls).filter_by(is_deleted=False).order_by(cls.upload_time.desc()).first()
-                oldest_upload = session.query(cls).filter_by(is_deleted=False).order_by(cls.upload_time.asc()).first()
+                stats_rows = session.query(ImageTypeStats).all()
+                active_count = sum(row.active_count for row in stats_rows)
+                deleted_count = sum(row.deleted_count for row in stats_rows)
+                total_size = sum(row.active_bytes for row in stats_rows)
+                deleted_size = sum(row.deleted_bytes for row in stats_rows)
+                latest_upload_at = max((row.latest_upload_at for row in stats_rows if row.latest_upload_at), default=None)
 
                 return {
-                    'total_images': total_count,
+                    'total_images': active_count + deleted_count,
                     'active_images': active_count,
                     'deleted_images': deleted_count,
                     'storage': {
@@ -245,9 +169,7 @@ class Image(Base):
                         'deleted_size': deleted_size,
                         'deleted_size_human': cls._format_size(deleted_size)
                     },
-                    'mime_types': {mime: count for mime, count in mime_stats},
-                    'latest_upload': latest_upload.upload_time.isoformat() if latest_upload else None,
-                    'oldest_upload': oldest_upload.upload_time.isoformat() if oldest_upload else None
+                    'latest_upload': latest_upload_at.isoformat() if latest_upload_at else None
                 }
         except Exception as e:
             return {
@@ -255,6 +177,23 @@ class Image(Base):
                 'status': 'error'
             }
 
+    @classmethod
+    def get_mime_type_stats(cls):
+        """
+        按 MIME 类型统计未删除的图片数，并返回最早的上传时间
+        需要扫描 images 表，只用于离线诊断，不要在接口中调用
+        """
+        with db_manager.session_scope() as session:
+            mime_stats = session.query(
+                cls.mime_type,
+                func.count(cls.id).label('count')
+            ).filter_by(is_deleted=False).group_by(cls.mime_type).all()
+            oldest_upload = session.query(func.min(cls.upload_time)).filter_by(is_deleted=False).scalar()
+            return {
+                'mime_types': {mime: count for mime, count in mime_stats},
+                'oldest_upload': oldest_upload.isoformat() if oldest_upload else None
+            }
+
     @classmethod
     def get_table_info(cls):
         """获取表结构信息"""
@@ -290,7 +229,126 @@ class Image(Base):
                 'status': 'error'
             }
 
+class ThumbnailJob(Base):
+    """缩略图生成任务队列，由 thumbnail_jobs 中的后台 worker 消费"""
+    __tablename__ = "thumbnail_jobs"
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    image_id = Column(Integer, ForeignKey('images.id'), nullable=False, index=True)
+    status = Column(String(16), nullable=False, default=STATUS_PENDING)
+    attempts = Column(Integer, nullable=False, default=0)  # 已尝试次数
+    last_error = Column(Text)
+    next_run_at = Column(DateTime, default=datetime.now)  # 失败重试时的下次执行时间
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        Index('ix_thumbnail_jobs_status_next_run_at', 'status', 'next_run_at'),
+    )
+
+    def __repr__(self):
+        return f'<ThumbnailJob {self.id} image={self.image_id} {self.status}>'
+
+class ImageTag(Base):
+    """图片标签（规范化后的小写标签），由 images.tags 同步，用于按标签筛选和标签分面统计"""
+    __tablename__ = "image_tags"
+
+    image_id = Column(Integer, ForeignKey('images.id'), primary_key=True)
+    tag = Column(String(64), primary_key=True)
+
+    __table_args__ = (
+        Index('ix_image_tags_tag_image_id', 'tag', 'image_id'),
+    )
+
+    def __repr__(self):
+        return f'<ImageTag {self.image_id} {self.tag}>'
+
+class ImageTypeStats(Base):
+    """
+    按图片类型物化的统计数据，由上传、删除、恢复路径在同一事务内增量更新，
+    可用 image_stats 的 rebuild 命令从 images 表重新计算
+    """
+    __tablename__ = "image_type_stats"
+
+    type_id = Column(Integer, primary_key=True, autoincrement=False)
+    active_count = Column(Integer, nullable=False, default=0)
+    deleted_count = Column(Integer, nullable=False, default=0)
+    active_bytes = Column(BigInteger, nullable=False, default=0)
+    deleted_bytes = Column(BigInteger, nullable=False, default=0)
+    latest_upload_at = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    def to_dict(self):
+        return {
+            'type_id': self.type_id,
+            'active_count': self.active_count,
+            'deleted_count': self.deleted_count,
+            'active_bytes': self.active_bytes,
+            'deleted_bytes': self.deleted_bytes,
+            'latest_upload': self.latest_upload_at.isoformat() if self.latest_upload_at else None
+        }
+
+    def __repr__(self):
+        return f'<ImageTypeStats {self.type_id} active={self.active_count}>'
+
+class UploadSession(Base):
+    """
+    分块上传会话：init 时创建，每个 PUT 追加一段字节到临时文件并推进 received，
+    finalize 后走与普通上传相同的入库流程；超过有效期未完成的会话由 chunked_upload.gc_upload_sessions 清理
+    """
+    __tablename__ = "upload_sessions"
+
+    STATUS_ACTIVE = 'active'
+    STATUS_FINALIZING = 'finalizing'  # 已被一个 finalize 请求领取，见 chunked_upload.claim_for_finalize
+    STATUS_FINALIZED = 'finalized'
+
+    upload_id = Column(String(32), primary_key=True)
+    type_id = Column(Integer, nullable=False)
+    original_filename = Column(String(255), nullable=False)
+    mime_type = Column(String(50))
+    total_size = Column(BigInteger, nullable=False)
+    received = Column(BigInteger, nullable=False, default=0)
+    tags = Column(String(255))
+    description = Column(Text)
+    status = Column(String(16), nullable=False, default=STATUS_ACTIVE)
+    image_id = Column(Integer)  # finalize 后对应的图片
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now, index=True)
+
+    def to_dict(self):
+        return {
+            'upload_id': self.upload_id,
+            'filename': self.original_filename,
+            'total_size': self.total_size,
+            'offset': self.received,
+            'status': self.status,
+            'image_id': self.image_id
+        }
+
+    def __repr__(self):
+        return f'<UploadSession {self.upload_id} {self.received}/{self.total_size}>'
+
+class CacheVersion(Base):
+    """
+    进程内缓存的版本号，修改被缓存的数据时在同一事务内加一，
+    各 gunicorn worker 定期读取版本号，发现变化后重新加载（如 image_type_registry）
+    """
+    __tablename__ = "cache_versions"
+
+    name = Column(String(64), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    def __repr__(self):
+        return f'<CacheVersion {self.name}={self.version}>'
+
 if __name__ == "__main__":
     # 创建所有表
     tableinof = Image.get_database_status()
-    print(tableinof)
\ No newline at end of file
+    print(tableinof)
+    print(Image.get_mime_type_stats())
\ No newline at end of file
@@ -1,17 +1,83 @@
 from PIL import Image as PILImage
 from .image_db import db_manager, Image
+from .content_index import content_index
+from .similarity_index import similarity_index
+from .image_db_utils import calculate_dhash
+from .image_cache import TTLCache
+from . import image_stats, image_serializer
+from .image_search import apply_keyword_filter
+from sqlalchemy import false, tuple_
 from sqlalchemy.orm import joinedload
+import base64
+import json
 import os
 
 class ImageDBHelper:
     IMAGE_PAGE_SIZE = 50  # 默认每页记录数
+    COUNT_CACHE_TTL = 60  # 秒，游标分页的可选总数使用缓存的计数
+    _count_cache = TTLCache(max_size=1000, ttl=COUNT_CACHE_TTL)
 
     @staticmethod
-    def check_image_duplicate(image_md5):
-        """检查文件是否重复"""
+    def find_by_content(file_size, content_hash, use_index=True):
+        """
+        按 (文件大小, 全文件 SHA-256) 查找已存在的图片，结果可能是已软删除的记录
+        use_index 为 True 时先查进程内布隆过滤器，判定一定不存在时不访问数据库
+        """
+        if use_index and not content_index.might_contain(file_size, content_hash):
+            return None
+        with db_manager.session_scope() as session:
+            return session.query(Image).options(joinedload(Image.image_type)) \
+                .filter_by(file_size=file_size, content_hash=content_hash).first()
+
+    @staticmethod
+    def find_images_by_content(content_keys):
+        """一次 IN 查询批量查重，content_keys: [(file_size, content_hash)]，返回 {(file_size, content_hash): Image}"""
+        content_keys = {key for key in content_keys if content_index.might_contain(*key)}
+        if not content_keys:
+            return {}
+        # 按 (file_size, content_hash) 整体 IN，查询走 ux_images_file_size_content_hash 唯一索引
         with db_manager.session_scope() as session:
-            existing_image = session.query(Image).filter_by(md5_hash=image_md5).first()
-            return existing_image or None
+            images = session.query(Image).options(joinedload(Image.image_type)) \
+                .filter(tuple_(Image.file_size, Image.content_hash).in_(list(content_keys))) \
+                .all()
+        return {(image.file_size, image.content_hash): image for image in images}
+
+    @staticmethod
+    def find_similar_images(phash, max_distance, limit=20, exclude_id=None):
+        """
+        在感知哈希索引中查找汉明距离 max_distance 以内、未删除的图片
+        Returns:
+            list: [(Image, distance)]，按距离升序
+        """
+        matches = [(image_id, distance) for image_id, distance in similarity_index.search(phash, max_distance)
+                   if image_id != exclude_id]
+        if not matches:
+            return []
+        # 索引中可能包含已删除的图片，多取一些再回表过滤
+        candidates = matches[:limit * 2]
+        with db_manager.session_scope() as session:
+            images = session.query(Image).options(joinedload(Image.image_type)) \
+                .filter(Image.id.in_([image_id for image_id, _ in candidates]), Image.is_deleted == False) \
+                .all()
+        images_by_id = {image.id: image for image in images}
+        return [(images_by_id[image_id], distance) for image_id, distance in candidates
+                if image_id in images_by_id][:limit]
+
+    @staticmethod
+    def find_images_by_keys(column, keys):
+        """
+        按 id 或 uuid_filename 批量查询未删除的图片，一次 IN 查询（image_type 一并 JOIN 加载）
+        Returns:
+            dict: {key: image_dict}
+        """
+        keys = set(keys)
+        if not keys:
+            return {}
+        with db_manager.session_scope() as session:
+            images = session.query(Image).options(joinedload(Image.image_type)) \
+                .filter(column.in_(keys), Image.is_deleted == False) \
+                .all()
+            return {getattr(image, column.key): image.to_dict() for image in images}
 
     # 录创建缩略图-指定目标目
     @staticmethod
@@ -35,25 +101,56 @@ class ImageDBHelper:
 
         # 创建缩略图
         with PILImage.open(image_path) as img:
-            img.thumbnail(size, PILImage.Resampling.LANCZOS)
-            try:
-                img.save(thumbnail_path, optimize=True, quality=85)
-                print(f"创建缩略图成功: {thumbnail_path}")
-            except Exception as e:
-                print(f"创建缩略图时出错: {e}")
-                return False
+            return ImageDBHelper.save_thumbnail(img, thumbnail_path, size)
+
+    @staticmethod
+    def save_thumbnail(img, thumbnail_path, size=(300, 300)):
+        """由已打开的图片生成缩略图，失败返回 False"""
+        img.thumbnail(size, PILImage.Resampling.LANCZOS)
+        try:
+            img.save(thumbnail_path, optimize=True, quality=85)
+            print(f"创建缩略图成功: {thumbnail_path}")
+        except Exception as e:
+            print(f"创建缩略图时出错: {e}")
+            return False
         return thumbnail_path
 
     @staticmethod
-    def paginate_query(query, page=1, page_size=IMAGE_PAGE_SIZE):
-        """通用的分页函数"""
+    def decode_image(image_path, thumbnail_dir, size=(300, 300)):
+        """
+        只解码一次原图，同时得到尺寸、缩略图和缩略图上的感知哈希
+        Returns:
+            tuple: (width, height, thumbnail_path, phash)
+        """
+        thumbnail_dir = os.path.join(thumbnail_dir, 'thumbnails')
+        os.makedirs(thumbnail_dir, exist_ok=True)
+        thumbnail_path = os.path.join(thumbnail_dir, os.path.basename(image_path))
+
+        with PILImage.open(image_path) as img:
+            # thumbnail() 会就地缩小图片，需先记录原始尺寸
+            width, height = img.size
+            thumbnail_path = ImageDBHelper.save_thumbnail(img, thumbnail_path, size)
+            phash = calculate_dhash(img)
+        return width, height, thumbnail_path, phash
+
+    @staticmethod
+    def calculate_image_phash(image_path, size=(300, 300)):
+        """不落盘缩略图，按与 decode_image 相同的方式计算感知哈希（用于上传时的近似查重）"""
+        with PILImage.open(image_path) as img:
+            img.thumbnail(size, PILImage.Resampling.LANCZOS)
+            return calculate_dhash(img)
+
+    @staticmethod
+    def paginate_query(query, page=1, page_size=IMAGE_PAGE_SIZE, total=None):
+        """通用的分页函数，已知总数（如来自统计表）时传入 total 以省去 COUNT(*)"""
         if page < 1:
             page = 1
 
         offset_val = (page - 1) * page_size
 
         # 获取总数
-        total = query.count()
+        if total is None:
+            total = query.count()
 
         # 获取分页数据
         items = query.offset(offset_val).limit(page_size).all()
@@ -69,31 +166,25 @@ class ImageDBHelper:
         }
 
     @staticmethod
-    def get_image_list(page=1, page_size=IMAGE_PAGE_SIZE, type_id=None, search_keyword=None):
+    def get_image_list(page=1, page_size=IMAGE_PAGE_SIZE, type_id=None, search_keyword=None, output_format=None):
         page = page if page is not None else 1
         page_size = page_size if page_size is not None else ImageDBHelper.IMAGE_PAGE_SIZE
 
-        """获取图片列表（带分页和过滤）"""
-        # 构建查询
+        """获取图片列表（带分页和过滤），只查询列表需要的列，output_format 见 image_serializer"""
         with db_manager.session_scope() as session:
-            query = session.query(Image) \
-                .options(joinedload(Image.image_type)) \
-                .order_by(Image.id.desc())
-
-        # 添加过滤条件
-        if type_id:
-            query = query.filter(Image.type_id == type_id)
+            # 构建查询
+            query = session.query(*image_serializer.LIST_COLUMNS).order_by(Image.id.desc())
 
-        if search_keyword:
-            query = query.filter(Image.original_filename.contains(search_keyword))
+            # 添加过滤条件
+            query = ImageDBHelper._filter_images(query, type_id, search_keyword)
 
-        # 分页
-        pagination_result = ImageDBHelper.paginate_query(query, page, page_size)
+            # 分页，不按关键词过滤时总数取自统计表
+            total = ImageDBHelper._stats_total(type_id) if not search_keyword else None
+            pagination_result = ImageDBHelper.paginate_query(query, page, page_size, total)
 
         # 格式化返回数据
-        formatted_items = []
-        for img in pagination_result['items']:
-            formatted_items.append(img.to_dict())
+        formatted_items = image_serializer.serialize(pagination_result['items'], image_serializer.folder_prefixes(),
+                                                     output_format)
         return {
             'data': formatted_items,
             'pagination': {
@@ -106,6 +197,104 @@ class ImageDBHelper:
             }
         }
 
+    @staticmethod
+    def _filter_images(query, type_id=None, search_keyword=None):
+        query = query.filter(Image.is_deleted == False)
+        if type_id:
+            query = query.filter(Image.type_id == type_id)
+        if search_keyword:
+            # 关键词走全文索引（search_text），没有可用查询词时返回空结果
+            keyword_query = apply_keyword_filter(query, search_keyword)
+            query = keyword_query if keyword_query is not None else query.filter(false())
+        return query
+
+    @staticmethod
+    def encode_cursor(last_id):
+        """游标对客户端不透明：base64 编码的 JSON"""
+        payload = json.dumps({'id': last_id}, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """解析游标，返回上一页最后一条记录的 id，格式错误时抛出 ValueError"""
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            last_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))['id']
+        except Exception as e:
+            raise ValueError(f"无效的分页游标: {cursor}") from e
+        if not isinstance(last_id, int):
+            raise ValueError(f"无效的分页游标: {cursor}")
+        return last_id
+
+    @staticmethod
+    def keyset_paginate(query, cursor=None, page_size=IMAGE_PAGE_SIZE):
+        """
+        按 id 倒序的游标分页：WHERE id < 上一页最后的 id ORDER BY id DESC LIMIT n，
+        不论翻到多深都只读取一页的数据，也不需要 COUNT(*)
+        """
+        if cursor:
+            query = query.filter(Image.id < ImageDBHelper.decode_cursor(cursor))
+        # 多取一条判断是否还有下一页
+        items = query.order_by(Image.id.desc()).limit(page_size + 1).all()
+        has_next = len(items) > page_size
+        items = items[:page_size]
+        return {
+            'items': items,
+            'next_cursor': ImageDBHelper.encode_cursor(items[-1].id) if has_next else None,
+            'has_next': has_next
+        }
+
+    @staticmethod
+    def _stats_total(type_id=None):
+        """从统计表读取未删除图片数量，统计表尚未初始化时返回 None"""
+        if type_id:
+            stats = image_stats.get_type_stats(type_id)
+            return stats['active_count'] if stats else (0 if image_stats.stats_initialized() else None)
+        return image_stats.get_all_stats()['active_count'] if image_stats.stats_initialized() else None
+
+    @staticmethod
+    def count_images(type_id=None, search_keyword=None):
+        """
+        未删除图片的数量：不按关键词过滤时直接读统计表；
+        按关键词过滤时执行 COUNT 并缓存 COUNT_CACHE_TTL 秒，可能略有滞后
+        """
+        if not search_keyword:
+            total = ImageDBHelper._stats_total(type_id)
+            if total is not None:
+                return total
+        key = (type_id, search_keyword)
+        total = ImageDBHelper._count_cache.get(key)
+        if total is None:
+            with db_manager.session_scope() as session:
+                total = ImageDBHelper._filter_images(session.query(Image), type_id, search_keyword).count()
+            ImageDBHelper._count_cache.set(key, total)
+        return total
+
+    @staticmethod
+    def get_image_page(cursor=None, page_size=IMAGE_PAGE_SIZE, type_id=None, search_keyword=None,
+                       include_total=False, output_format=None):
+        """获取图片列表（游标分页），include_total 为 True 时附带缓存的总数"""
+        page_size = page_size or ImageDBHelper.IMAGE_PAGE_SIZE
+        with db_manager.session_scope() as session:
+            query = ImageDBHelper._filter_images(
+                session.query(*image_serializer.LIST_COLUMNS), type_id, search_keyword
+            )
+            pagination_result = ImageDBHelper.keyset_paginate(query, cursor, page_size)
+        formatted_items = image_serializer.serialize(pagination_result['items'], image_serializer.folder_prefixes(),
+                                                     output_format)
+
+        pagination = {
+            'page_size': page_size,
+            'next_cursor': pagination_result['next_cursor'],
+            'has_next': pagination_result['has_next']
+        }
+        if include_total:
+            pagination['total'] = ImageDBHelper.count_images(type_id, search_keyword)
+        return {
+            'data': formatted_items,
+            'pagination': pagination
+        }
+
 if __name__ == "__main__":
     # ImageDBHelper.get_image_list()
     #
@@ -3,21 +3,62 @@ import os, shutil
 from werkzeug.utils import secure_filename
 import uuid
 from flask import current_app
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 
 from .image_db import db_manager, Image, Base, ImageType
 
 from .image_db_helper import ImageDBHelper
-from .image_db_utils import allowed_file, calculate_fileobject_md5, calculate_partial_md5_flexible
+from .thumbnail_jobs import enqueue_thumbnail_job
+from .image_type_registry import image_type_registry, bump_version
+from .image_db_utils import allowed_file, calculate_fileobject_md5, calculate_partial_md5_flexible, calculate_file_sha256
+from .content_index import content_index
+from . import image_stats
+from . import image_search
+from . import image_bulk_import
 
 def init_db():
     # 创建所有表
     Base.metadata.create_all(db_manager.engine)
+    # 为已存在的表补充新增的列和索引
+    upgrade_db()
+    # 统计表为空（首次部署或刚升级）时从 images 表计算一次
+    if not image_stats.stats_initialized():
+        image_stats.rebuild_stats()
+    # 为还没有搜索索引的图片补建 search_text 和 image_tags
+    image_search.reindex(only_missing=True)
 
     # 删除所有表重新创建
     # print(f"删除所有表重新创建")
     # Base.metadata.drop_all(db_manager.engine)
     # Base.metadata.create_all(db_manager.engine)
 
+def upgrade_db():
+    """create_all 不会修改已存在的表，这里为旧表补充模型中新增的列和索引"""
+    inspector = inspect(db_manager.engine)
+    with db_manager.engine.begin() as conn:
+        preparer = conn.dialect.identifier_preparer
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+
+            existing_columns = {col['name'] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=conn.dialect)
+                conn.execute(text(
+                    f"ALTER TABLE {preparer.quote(table.name)} ADD COLUMN {preparer.quote(column.name)} {column_type}"
+                ))
+                print(f"新增列: {table.name}.{column.name}")
+
+            existing_indexes = {idx['name'] for idx in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn)
+                    print(f"新增索引: {table.name}.{index.name}")
+
 
 IMAGE_TYPES = [
     ImageType(
@@ -44,7 +85,9 @@ def add_image_types():
             session.add(img_type)
             directory = os.path.join(current_app.config['IMAGE_UPLOAD_FOLDER'], f"{img_type.type_id}_{img_type.type_name}")
             os.makedirs(directory, exist_ok=True)
+        bump_version(session)
         session.commit()
+    image_type_registry.reload()
 
 def move_file_os(source_path, destination_path):
     """使用os.rename移动文件"""
@@ -73,14 +116,9 @@ def normalize_filename(filename):
     name, ext = os.path.splitext(filename)
     return name + ext.lower()
 
-def import_images_in_folder(image_type_id, folder_path):
-    """导入指定文件夹中的所有图片到数据库"""
-    allowed_extensions = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'bmp'}
-    for filename in os.listdir(folder_path):
-        normalized_name = normalize_filename(filename)
-        if any(normalized_name.endswith(ext) for ext in allowed_extensions):
-            filepath = os.path.join(folder_path, normalized_name)
-            import_image(image_type_id, normalized_name, filepath)
+def import_images_in_folder(image_type_id, folder_path, **options):
+    """导入指定文件夹中的所有图片到数据库，按批并行处理，options 见 image_bulk_import.bulk_import"""
+    return image_bulk_import.bulk_import(folder_path, image_type_id, current_app.config, **options)
 
 def import_image(image_type_id, filename, origin_filepath):
     try:
@@ -96,8 +134,15 @@ def import_image(image_type_id, filename, origin_filepath):
             print(f"导入图片时，图片类型ID未设置或是未知的类型: {image_type_id} 详见IMAGE_TYPES类型列表")
             return
 
+        # 按全文件内容查重，存储文件名由内容哈希派生
+        file_size = os.path.getsize(origin_filepath)
+        content_hash = calculate_file_sha256(origin_filepath)
+        if ImageDBHelper.find_by_content(file_size, content_hash):
+            print(f"图片已存在，跳过: {origin_filepath}")
+            return
+
         ext = os.path.splitext(secure_filename(filename))[1]
-        uuid_filename = f"{uuid.uuid4().hex}{ext}"
+        uuid_filename = f"{content_hash}{ext}"
         image_folder = f"{image_type_id}_{image_type_name}"
         # filepath = os.path.join(IMAGE_UPLOAD_FOLDER, image_folder, uuid_filename)
         filepath = os.path.join(current_app.config['IMAGE_UPLOAD_FOLDER'], image_folder, uuid_filename)
@@ -106,8 +151,7 @@ def import_image(image_type_id, filename, origin_filepath):
         move_file_os(origin_filepath, filepath)
 
         # 获取图片信息
-        file_size = os.path.getsize(filepath)
-        small_check_md5 = calculate_partial_md5_flexible(filepath, 512 * 1024)  # 前64KB
+        small_check_md5 = calculate_partial_md5_flexible(filepath, 512 * 1024)  # 前512KB，兼容 md5_hash 字段
         width, height = None, None
 
         try:
@@ -116,11 +160,13 @@ def import_image(image_type_id, filename, origin_filepath):
         except Exception as e:
             print(f"Cannot get image dimensions: {e}")
 
-        # 创建缩略图
-        try:
-            ImageDBHelper.create_thumbnail(filepath, thumbnail_dir, current_app.config['THUMBNAIL_SIZE'])
-        except Exception as e:
-            print(f"Failed to create thumbnail: {e}")
+        # 创建缩略图，异步模式下交给缩略图 worker
+        thumbnail_async = current_app.config['THUMBNAIL_ASYNC']
+        if not thumbnail_async:
+            try:
+                ImageDBHelper.create_thumbnail(filepath, thumbnail_dir, current_app.config['THUMBNAIL_SIZE'])
+            except Exception as e:
+                print(f"Failed to create thumbnail: {e}")
 
         origin_filename = os.path.basename(origin_filepath)
 
@@ -131,6 +177,7 @@ def import_image(image_type_id, filename, origin_filepath):
             original_filename=origin_filename,
             file_size=file_size,
             md5_hash=small_check_md5,
+            content_hash=content_hash,
             mime_type="image/jpeg", # image/png
             width=width,
             height=height,
@@ -140,13 +187,46 @@ def import_image(image_type_id, filename, origin_filepath):
 
         with db_manager.session_scope() as session:
             session.add(image)
+            if thumbnail_async:
+                enqueue_thumbnail_job(session, image)
+            image_search.index_image(session, image)
+            image_stats.record_uploads(session, [image])
             session.commit()
+        content_index.add(file_size, content_hash)
 
         # print(f"处理图片成功 原始名称: {origin_filename} UUID名称: {uuid_filename} 文件大小: {file_size} 宽度: {width} 高度: {height}")
 
     except Exception as e:
         print(f"处理图片失败: {e}")
 
+def backfill_content_hash(batch_size=500):
+    """为历史记录补算全文件 SHA-256；内容重复的历史记录保留为空并打印出来，需人工处理"""
+    upload_folder = current_app.config['IMAGE_UPLOAD_FOLDER']
+    last_id = 0
+    while True:
+        with db_manager.session_scope() as session:
+            images = session.query(Image).options(joinedload(Image.image_type)) \
+                .filter(Image.id > last_id, Image.content_hash.is_(None)) \
+                .order_by(Image.id) \
+                .limit(batch_size) \
+                .all()
+        if not images:
+            break
+
+        for image in images:
+            last_id = image.id
+            filepath = os.path.join(upload_folder, image.folder_name, image.uuid_filename)
+            if not os.path.exists(filepath):
+                print(f"文件不存在，跳过: {filepath}")
+                continue
+            content_hash = calculate_file_sha256(filepath)
+            try:
+                with db_manager.session_scope() as session:
+                    session.query(Image).filter_by(id=image.id).update({Image.content_hash: content_hash})
+            except IntegrityError:
+                print(f"内容重复的历史记录: id={image.id} {filepath}")
+    # 新补算的哈希需要在各 worker 重启后才会进入进程内的布隆过滤器
+
 if __name__ == "__main__":
     # 要在项目根目录下运行此脚本
 
@@ -6,6 +6,7 @@
 
 
 import unittest
+from sqlalchemy.orm import joinedload
 from .image_db import db_manager, Image
 import os
 from werkzeug.utils import secure_filename
@@ -20,14 +21,14 @@ def get_image(filename):
     # 检查数据库中是否存在且未删除
     file_on_disk_name = filename
     with db_manager.session_scope() as session:
-        image = session.query(Image).filter_by(
+        image = session.query(Image).options(joinedload(Image.image_type)).filter_by(
             uuid_filename=filename,
             is_deleted=False
         ).first()
 
         if image is None:
             # 尝试通过原始文件名查找-不推荐，可能有重复
-            image = session.query(Image).filter_by(
+            image = session.query(Image).options(joinedload(Image.image_type)).filter_by(
                 original_filename=filename,
                 is_deleted=False
             ).first()
@@ -1,5 +1,7 @@
 import hashlib
 
+from PIL import Image as PILImage
+
 def allowed_file(filename, allowed_extensions):
     """检查文件扩展名是否允许"""
     return '.' in filename and \
@@ -36,4 +38,33 @@ def calculate_fileobject_md5(file_object, chunk_size=64 * 1024):
     md5_hash.update(chunk)
     # 恢复文件指针到原来的位置（重要！）
     file_object.seek(current_position)
-    return md5_hash.hexdigest()
\ No newline at end of file
+    return md5_hash.hexdigest()
+
+def calculate_file_sha256(file_path, chunk_size=1024 * 1024):
+    """流式计算整个文件的 SHA-256"""
+    hash_sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hash_sha256.update(chunk)
+    return hash_sha256.hexdigest()
+
+
+def calculate_dhash(img, hash_size=8):
+    """
+    计算图片的差值哈希（dHash），用于近似重复检测
+    Returns:
+        str: 64 位哈希的 16 进制字符串
+    """
+    gray = img.convert('L').resize((hash_size + 1, hash_size), PILImage.Resampling.LANCZOS)
+    pixels = list(gray.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{value:0{hash_size * hash_size // 4}x}"
+
+
+def hamming_distance(hash_a, hash_b):
+    """两个 16 进制哈希之间的汉明距离"""
+    return (int(hash_a, 16) ^ int(hash_b, 16)).bit_count()
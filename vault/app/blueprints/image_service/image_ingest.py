@@ -0,0 +1,115 @@
+import hashlib
+import io
+import os
+import uuid
+
+from PIL import Image as PILImage
+from werkzeug.utils import secure_filename
+
+
+class UploadIngest:
+    """
+    上传流单次遍历处理
+    只遍历一次请求中的文件流：读取头部时计算 MD5 并嗅探图片头（格式、尺寸），
+    写盘时直接复用已读取的头部，再把剩余部分按块拷贝到目标文件，同时计算全文件 SHA-256。
+    全文件哈希用于内容寻址查重和存储路径，头部 MD5 仅为兼容历史 md5_hash 字段保留。
+    """
+    HEAD_SIZE = 512 * 1024  # 头部字节数，与历史 md5_hash 保持一致
+    CHUNK_SIZE = 64 * 1024
+    TEMP_PREFIX = '.upload-'
+    TEMP_SUFFIX = '.part'
+
+    def __init__(self, file_object, head_size=HEAD_SIZE):
+        # Flask FileStorage 使用其底层 stream，普通文件对象直接使用
+        self.stream = getattr(file_object, 'stream', file_object)
+        if self.stream.seekable():
+            self.stream.seek(0)
+
+        self.head = self.stream.read(head_size)
+        self.head_md5 = hashlib.md5(self.head).hexdigest()
+        self.image_format, self.width, self.height = sniff_image_header(self.head)
+        self.file_size = None
+        self.content_hash = None
+        self.temp_path = None
+
+    @classmethod
+    def from_file(cls, path, content_hash=None, chunk_size=CHUNK_SIZE):
+        """
+        已完整写入磁盘的文件（如分块上传的临时文件）：不再复制，commit 时直接移动 path
+        已知全文件哈希时传入 content_hash，否则读取文件计算
+        """
+        with open(path, 'rb') as f:
+            ingest = cls(f)
+            if content_hash is None:
+                hasher = hashlib.sha256(ingest.head)
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    hasher.update(chunk)
+                content_hash = hasher.hexdigest()
+        ingest.stream = None
+        ingest.file_size = os.path.getsize(path)
+        ingest.content_hash = content_hash
+        ingest.temp_path = path
+        return ingest
+
+    def save(self, filepath, chunk_size=CHUNK_SIZE):
+        """把头部和剩余的流写入 filepath，同时计算全文件 SHA-256，返回写入的字节数"""
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        content_hash = hashlib.sha256(self.head)
+        size = len(self.head)
+        with open(filepath, 'wb') as out:
+            out.write(self.head)
+            while True:
+                chunk = self.stream.read(chunk_size)
+                if not chunk:
+                    break
+                out.write(chunk)
+                content_hash.update(chunk)
+                size += len(chunk)
+        self.file_size = size
+        self.content_hash = content_hash.hexdigest()
+        return size
+
+    def save_to_temp(self, directory):
+        """先写入目标目录下的临时文件，查重之后再决定 commit 或 discard"""
+        self.temp_path = os.path.join(directory, f"{self.TEMP_PREFIX}{uuid.uuid4().hex}{self.TEMP_SUFFIX}")
+        try:
+            self.save(self.temp_path)
+        except Exception:
+            self.discard()
+            raise
+        return self.temp_path
+
+    def content_filename(self, original_filename):
+        """由内容哈希得到存储文件名，相同内容总是对应同一个文件"""
+        # 扩展名取自原始文件名：secure_filename 会去掉非 ASCII 字符，"中文.png" 会变成 "png" 而丢失扩展名
+        ext = secure_filename(os.path.splitext(original_filename)[1]).lower()
+        return f"{self.content_hash}.{ext}" if ext else self.content_hash
+
+    def commit(self, filepath):
+        """把临时文件原子地移动到最终路径；目标已存在时说明内容相同，丢弃临时文件"""
+        if os.path.exists(filepath):
+            self.discard()
+        else:
+            os.replace(self.temp_path, filepath)
+            self.temp_path = None
+        return filepath
+
+    def discard(self):
+        """删除临时文件"""
+        if self.temp_path and os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+        self.temp_path = None
+
+
+def sniff_image_header(head_bytes):
+    """
+    只解析图片头，不解码像素数据
+    Returns:
+        tuple: (format, width, height)，无法识别时为 (None, None, None)
+    """
+    try:
+        with PILImage.open(io.BytesIO(head_bytes)) as img:
+            width, height = img.size
+            return img.format, width, height
+    except Exception:
+        return None, None, None
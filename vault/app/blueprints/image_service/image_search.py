@@ -0,0 +1,215 @@
+"""
+图片关键词搜索
+- 文件名、描述、标签切分成词后写入 images.search_text，上面建 MariaDB FULLTEXT 索引
+- 中文没有空格分词，MariaDB 也没有 ngram 分词器，这里把连续的中日韩字符切成双字词再入索引
+- 查询使用 BOOLEAN MODE，每个词都必须出现，并按前缀匹配（词*），结果按相关度排序
+- 标签规范化后存入 image_tags，用于按标签筛选和统计标签分面
+- 非 MySQL 数据库（开发环境的 SQLite）上退化为对 search_text 的 LIKE 查询
+
+为已有图片建立索引（在项目根目录下）:
+    python -m app.blueprints.image_service.image_search reindex
+"""
+import os
+import re
+import sys
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.mysql import match
+from sqlalchemy.orm import joinedload
+from loguru import logger
+
+from .image_db import db_manager, Image, ImageTag
+
+# 连续的字母数字，或连续的中日韩字符
+_TOKEN_PATTERN = re.compile(r'[0-9a-z]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+')
+_TAG_SEPARATOR = re.compile(r'[,，;；]')
+MIN_TOKEN_LENGTH = 2  # 与 MariaDB 的 innodb_ft_min_token_size 一致
+MAX_TAG_LENGTH = 64
+FACET_LIMIT = 20
+
+
+def _is_cjk(token):
+    return not token[0].isascii()
+
+
+def tokenize(text):
+    """切分为小写的词，中日韩字符切成相邻的双字词"""
+    tokens = []
+    for run in _TOKEN_PATTERN.findall((text or '').lower()):
+        if _is_cjk(run) and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def normalize_tags(tags):
+    """逗号分隔的标签字符串 -> 去重后的小写标签列表，保持原有顺序"""
+    result = []
+    for tag in _TAG_SEPARATOR.split(tags or ''):
+        tag = tag.strip().lower()[:MAX_TAG_LENGTH]
+        if tag and tag not in result:
+            result.append(tag)
+    return result
+
+
+def build_search_text(image):
+    """文件名（去掉扩展名）、描述和标签的词，去重后以空格连接"""
+    name = os.path.splitext(image.original_filename or '')[0]
+    tokens = tokenize(name) + tokenize(image.description) + tokenize(' '.join(normalize_tags(image.tags)))
+    return ' '.join(dict.fromkeys(tokens))
+
+
+def index_image(session, image, replace=True):
+    """
+    更新图片的 search_text 和 image_tags，在写入图片的同一事务中调用
+    批量导入的新图片还没有标签，可传 replace=False 省去删除旧标签的 DELETE
+    """
+    image.search_text = build_search_text(image)
+    if image.id is None:
+        session.flush()  # 获取自增 id
+    if replace:
+        session.query(ImageTag).filter(ImageTag.image_id == image.id).delete(synchronize_session=False)
+    session.add_all([ImageTag(image_id=image.id, tag=tag) for tag in normalize_tags(image.tags)])
+
+
+def _is_mysql():
+    return db_manager.engine.dialect.name in ('mysql', 'mariadb')
+
+
+def _query_terms(keyword):
+    """查询词：太短的拉丁词无法命中 FULLTEXT 索引，丢弃；单个中文字符以前缀匹配双字词"""
+    return [token for token in dict.fromkeys(tokenize(keyword))
+            if len(token) >= MIN_TOKEN_LENGTH or _is_cjk(token)]
+
+
+def _match_expression(terms):
+    against = ' '.join(f'+{term}*' for term in terms)
+    return match(Image.search_text, against=against).in_boolean_mode()
+
+
+def apply_keyword_filter(query, keyword):
+    """给查询加上关键词条件，没有可用的查询词时返回 None（无结果）"""
+    terms = _query_terms(keyword)
+    if not terms:
+        return None
+    if _is_mysql():
+        return query.filter(_match_expression(terms))
+    for term in terms:
+        query = query.filter(Image.search_text.contains(term))
+    return query
+
+
+def _filter_tags(query, tags):
+    """要求图片同时带有所有指定标签"""
+    if not tags:
+        return query
+    tagged_ids = select(ImageTag.image_id) \
+        .where(ImageTag.tag.in_(tags)) \
+        .group_by(ImageTag.image_id) \
+        .having(func.count(ImageTag.tag) == len(tags))
+    return query.filter(Image.id.in_(tagged_ids))
+
+
+def search_images(keyword=None, tags=None, type_id=None, page=1, page_size=20):
+    """
+    关键词 + 标签搜索，按相关度（MariaDB）或 id 倒序排列
+    Returns:
+        dict: {'data': [...], 'facets': [{'tag', 'count'}], 'pagination': {...}}
+    """
+    page = max(1, page or 1)
+    tags = normalize_tags(','.join(tags)) if isinstance(tags, (list, tuple)) else normalize_tags(tags)
+    with db_manager.session_scope() as session:
+        query = session.query(Image).filter(Image.is_deleted == False)
+        if type_id:
+            query = query.filter(Image.type_id == type_id)
+        query = _filter_tags(query, tags)
+
+        score = None
+        if keyword:
+            query = apply_keyword_filter(query, keyword)
+            if query is None:
+                return _empty_result(page, page_size)
+            terms = _query_terms(keyword)
+            if _is_mysql():
+                score = _match_expression(terms)
+
+        total = query.order_by(None).count()
+
+        ordered = query.options(joinedload(Image.image_type))
+        if score is not None:
+            ordered = ordered.add_columns(score.label('score')).order_by(score.desc(), Image.id.desc())
+        else:
+            ordered = ordered.order_by(Image.id.desc())
+        rows = ordered.offset((page - 1) * page_size).limit(page_size).all()
+
+        data = []
+        for row in rows:
+            image, relevance = (row[0], row[1]) if score is not None else (row, None)
+            item = image.to_dict()
+            if relevance is not None:
+                item['score'] = float(relevance)
+            data.append(item)
+
+        # 标签分面：统计所有命中结果（不只是当前页）的标签数量
+        matched_ids = query.with_entities(Image.id).order_by(None)
+        count = func.count(ImageTag.image_id)
+        facets = session.query(ImageTag.tag, count) \
+            .filter(ImageTag.image_id.in_(matched_ids)) \
+            .group_by(ImageTag.tag) \
+            .order_by(count.desc(), ImageTag.tag) \
+            .limit(FACET_LIMIT) \
+            .all()
+
+    pages = (total + page_size - 1) // page_size
+    return {
+        'data': data,
+        'facets': [{'tag': tag, 'count': tag_count} for tag, tag_count in facets],
+        'pagination': {
+            'current_page': page,
+            'page_size': page_size,
+            'total': total,
+            'pages': pages,
+            'has_prev': page > 1,
+            'has_next': page < pages
+        }
+    }
+
+
+def _empty_result(page, page_size):
+    return {
+        'data': [],
+        'facets': [],
+        'pagination': {'current_page': page, 'page_size': page_size, 'total': 0, 'pages': 0,
+                       'has_prev': page > 1, 'has_next': False}
+    }
+
+
+def reindex(batch_size=500, only_missing=False):
+    """按 id 分批重建 search_text 和 image_tags"""
+    last_id = 0
+    total = 0
+    while True:
+        with db_manager.session_scope() as session:
+            query = session.query(Image).filter(Image.id > last_id)
+            if only_missing:
+                query = query.filter(Image.search_text.is_(None))
+            images = query.order_by(Image.id).limit(batch_size).all()
+            for image in images:
+                index_image(session, image)
+        if not images:
+            break
+        last_id = images[-1].id
+        total += len(images)
+        logger.info(f"搜索索引重建进度: {total} 张图片，last_id={last_id}")
+    return total
+
+
+if __name__ == "__main__":
+    # 要在项目根目录下运行此脚本
+    from app import create_app
+    from app.blueprints.image_service import image_search
+
+    flask_app = create_app()
+    if len(sys.argv) > 1 and sys.argv[1] == 'reindex':
+        image_search.reindex(only_missing='--missing' in sys.argv)
@@ -0,0 +1,112 @@
+"""
+图片列表的快速序列化
+列表接口不再加载 ORM 实体逐条调用 Image.to_dict，而是：
+- 只查询需要的列，得到元组行（LIST_COLUMNS）
+- 各类型的目录前缀取自图片类型注册表，不再逐行从 image_type 拼接
+- 文件大小用预先计算的阈值格式化，结果与 Image._format_size 一致
+- 安装了 orjson 时用它编码 JSON，否则退回标准库 json
+- format=columnar 时返回按列组织的紧凑结构 {"ids": [...], "urls": [...]}
+"""
+import json
+from datetime import datetime, timezone
+
+from flask import Response
+
+from .image_db import Image, ThumbnailJob
+from .image_type_registry import image_type_registry
+
+try:
+    import orjson
+except ImportError:  # 可选依赖
+    orjson = None
+
+FORMAT_COLUMNAR = 'columnar'
+
+# 列表接口需要的列，顺序即元组行中的顺序
+LIST_COLUMNS = (
+    Image.id,
+    Image.type_id,
+    Image.tags,
+    Image.uuid_filename,
+    Image.original_filename,
+    Image.file_size,
+    Image.md5_hash,
+    Image.mime_type,
+    Image.width,
+    Image.height,
+    Image.description,
+    Image.thumbnail_status,
+)
+
+DEFAULT_FOLDER_PREFIX = "/images/0_others/"
+THUMBNAIL_PREFIX = "/images/thumbnails/"
+
+_SIZE_UNITS = [(1024.0 ** power, unit) for power, unit in enumerate(['B', 'KB', 'MB', 'GB'])]
+
+
+def format_size(size_bytes):
+    """与 Image._format_size 结果相同：除以 1024 的幂是精确的，可以一次算出"""
+    for limit, unit in _SIZE_UNITS:
+        if size_bytes < limit * 1024.0:
+            return f"{size_bytes / limit:.2f} {unit}"
+    return f"{size_bytes / 1024.0 ** 4:.2f} TB"
+
+
+def folder_prefixes():
+    """type_id -> URL 目录前缀，如 {3: '/images/3_avatar/'}；不存在的类型使用 0_others"""
+    return {type_id: f"/images/{folder_name}/" for type_id, folder_name in image_type_registry.folder_names().items()}
+
+
+def serialize_rows(rows, prefixes):
+    """LIST_COLUMNS 元组行 -> 与 Image.to_dict 相同结构的字典列表"""
+    default_status = ThumbnailJob.STATUS_DONE
+    return [{
+        'id': image_id,
+        'type_id': type_id,
+        'tags': tags,
+        'filename': uuid_filename,
+        'original_name': original_filename,
+        'url': prefixes.get(type_id, DEFAULT_FOLDER_PREFIX) + uuid_filename,
+        'thumbnail_url': THUMBNAIL_PREFIX + uuid_filename,
+        'size': file_size,
+        'md5_hash': md5_hash,
+        'size_human': format_size(file_size),
+        'mime_type': mime_type,
+        'dimensions': {'width': width, 'height': height} if width and height else None,
+        'description': description,
+        'thumbnail_status': thumbnail_status or default_status
+    } for (image_id, type_id, tags, uuid_filename, original_filename, file_size, md5_hash,
+           mime_type, width, height, description, thumbnail_status) in rows]
+
+
+def serialize_columnar(rows, prefixes):
+    """紧凑的列式结构，只包含 id 和图片 URL"""
+    return {
+        'ids': [row[0] for row in rows],
+        'urls': [prefixes.get(row[1], DEFAULT_FOLDER_PREFIX) + row[3] for row in rows]
+    }
+
+
+def serialize(rows, prefixes, output_format=None):
+    if output_format == FORMAT_COLUMNAR:
+        return serialize_columnar(rows, prefixes)
+    return serialize_rows(rows, prefixes)
+
+
+def dumps(obj):
+    """编码为 UTF-8 JSON 字节串"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def json_success(data=None, message="操作成功", code=200):
+    """与 ApiResponse.success 相同的响应结构，使用 dumps 编码"""
+    body = dumps({
+        'success': True,
+        'message': message,
+        'data': data,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'code': code
+    })
+    return Response(body, status=code, mimetype='application/json')
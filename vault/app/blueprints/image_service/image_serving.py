@@ -0,0 +1,121 @@
+"""
+图片文件发送
+IMAGE_SERVE_MODE:
+- direct:  由 Flask 的 send_from_directory 读取文件并发送（开发环境、没有 nginx 时使用）
+- x-accel: Flask 只做查询和权限判断，返回 X-Accel-Redirect 头，由 nginx 的 internal location 发送文件，
+           慢速客户端不再占用 gunicorn 同步 worker
+
+条件请求：ETag 由数据库中的内容哈希派生（强校验），Last-Modified 取 Image.updated_at，
+If-None-Match / If-Modified-Since 命中时只凭元数据缓存返回 304，不访问磁盘。
+x-accel 模式下 nginx 默认丢弃这些上游头并按文件 mtime/大小生成自己的 ETag，internal location 中需
+etag off、if_modified_since off，并用 $upstream_http_etag / $upstream_http_last_modified 回写（见 nginx/conf.d），
+否则客户端拿到的是 nginx 的 ETag，再验证时永远不会命中 304。
+Range 请求在 direct 模式下由 send_file 处理，x-accel 模式下由 nginx 处理。
+"""
+import mimetypes
+import os
+import unicodedata
+from datetime import timezone
+from urllib.parse import quote
+
+from flask import Response, request, send_from_directory
+
+SERVE_MODE_DIRECT = 'direct'
+SERVE_MODE_X_ACCEL = 'x-accel'
+
+# 以内容哈希命名的文件内容永不改变
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# 通过原始文件名访问时，同名文件可能指向别的图片，只短期缓存
+MUTABLE_CACHE_CONTROL = 'public, max-age=3600'
+
+
+def image_etag(meta, representation=None):
+    """
+    由存储的哈希生成 ETag 值（不含引号），同一图片的不同表示（缩略图、变体、WebP/AVIF）加后缀区分
+    没有全文件哈希的历史数据用头部 MD5 加文件大小
+    """
+    base = meta.content_hash or f"{meta.md5_hash}-{meta.file_size}"
+    return f"{base}-{representation}" if representation else base
+
+
+def _last_modified(meta):
+    # updated_at 由 datetime.now 写入，是本地时间
+    return meta.updated_at.astimezone(timezone.utc) if meta.updated_at else None
+
+
+def _set_cache_headers(response, etag, meta, immutable):
+    response.set_etag(etag)
+    last_modified = _last_modified(meta)
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if immutable else MUTABLE_CACHE_CONTROL
+
+
+def not_modified(meta, representations, immutable=False, vary=None):
+    """
+    检查条件请求，命中时返回 304 响应，否则返回 None
+    representations 为当前请求可能得到的各个表示，客户端缓存了其中任意一个都视为未修改
+    """
+    if request.if_none_match:
+        matched = next((image_etag(meta, representation) for representation in representations
+                        if request.if_none_match.contains(image_etag(meta, representation))), None)
+        if matched is None:
+            return None
+    elif request.if_modified_since and meta.updated_at:
+        if _last_modified(meta).replace(microsecond=0) > request.if_modified_since:
+            return None
+        matched = image_etag(meta, representations[-1])
+    else:
+        return None
+
+    response = Response(status=304)
+    _set_cache_headers(response, matched, meta, immutable)
+    if vary:
+        response.vary.add(vary)
+    return response
+
+
+def _accel_uri(path, config):
+    """把磁盘路径映射为 nginx internal location 下的 URI，不在上传目录下时返回 None"""
+    relative_path = os.path.relpath(path, config['IMAGE_UPLOAD_FOLDER'])
+    if relative_path.startswith(os.pardir):
+        return None
+    return f"{config['IMAGE_ACCEL_PREFIX'].rstrip('/')}/{quote(relative_path.replace(os.sep, '/'))}"
+
+
+def _content_disposition(response, download_name):
+    """与 Flask send_file 相同的 Content-Disposition 写法，非 ASCII 文件名使用 filename*"""
+    try:
+        download_name.encode('ascii')
+        options = {'filename': download_name}
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+        options = {'filename': simple, 'filename*': f"UTF-8''{quote(download_name, safe='!#$&+^`|~')}"}
+    response.headers.set('Content-Disposition', 'attachment', **options)
+
+
+def send_image_file(directory, filename, config, mimetype=None, as_attachment=False, download_name=None,
+                    meta=None, representation=None, immutable=False):
+    """
+    按 IMAGE_SERVE_MODE 发送 directory/filename
+    传入 meta 时附带 ETag / Last-Modified / Cache-Control，并据此处理 If-None-Match 和 Range
+    """
+    etag = image_etag(meta, representation) if meta else None
+    path = os.path.join(directory, filename)
+    accel_uri = _accel_uri(path, config) if config['IMAGE_SERVE_MODE'] == SERVE_MODE_X_ACCEL else None
+    if accel_uri is None:
+        response = send_from_directory(directory, filename, mimetype=mimetype,
+                                       as_attachment=as_attachment, download_name=download_name,
+                                       etag=etag or True,
+                                       last_modified=_last_modified(meta) if meta else None,
+                                       conditional=True)
+    else:
+        response = Response(status=200)
+        response.headers['X-Accel-Redirect'] = accel_uri
+        response.headers['Content-Type'] = mimetype or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        if as_attachment:
+            _content_disposition(response, download_name or os.path.basename(filename))
+
+    if meta and response.status_code in (200, 206, 304):
+        _set_cache_headers(response, etag, meta, immutable)
+    return response
@@ -0,0 +1,143 @@
+"""
+按类型物化的图片统计
+上传、删除、恢复时在写 images 的同一事务内用 UPDATE ... SET x = x + n 增量维护 image_type_stats，
+/image/stats 和分页总数直接读取这张小表，不再对 images 做 COUNT(*) / SUM(file_size)。
+
+统计数据不一致时（如手工修改了 images 表）重新计算（在项目根目录下）:
+    python -m app.blueprints.image_service.image_stats rebuild
+"""
+import sys
+from datetime import datetime
+
+from sqlalchemy import case, func
+from sqlalchemy.exc import IntegrityError
+from loguru import logger
+
+from .image_db import db_manager, Image, ImageTypeStats
+
+DEFAULT_TYPE_ID = 0  # type_id 为空的图片计入 0_others
+
+
+def _apply_delta(session, type_id, active=0, deleted=0, active_bytes=0, deleted_bytes=0, upload_time=None):
+    """原子地累加一个类型的统计值，该类型还没有统计行时先插入"""
+    type_id = DEFAULT_TYPE_ID if type_id is None else type_id
+    values = {
+        ImageTypeStats.active_count: ImageTypeStats.active_count + active,
+        ImageTypeStats.deleted_count: ImageTypeStats.deleted_count + deleted,
+        ImageTypeStats.active_bytes: ImageTypeStats.active_bytes + active_bytes,
+        ImageTypeStats.deleted_bytes: ImageTypeStats.deleted_bytes + deleted_bytes,
+        ImageTypeStats.updated_at: datetime.now(),
+    }
+    if upload_time is not None:
+        values[ImageTypeStats.latest_upload_at] = case(
+            (ImageTypeStats.latest_upload_at.is_(None), upload_time),
+            (ImageTypeStats.latest_upload_at < upload_time, upload_time),
+            else_=ImageTypeStats.latest_upload_at
+        )
+
+    query = session.query(ImageTypeStats).filter(ImageTypeStats.type_id == type_id)
+    if query.update(values, synchronize_session=False):
+        return
+    try:
+        # 并发插入同一类型的统计行时，后插入的一方回滚保存点后改为更新
+        with session.begin_nested():
+            session.add(ImageTypeStats(type_id=type_id, active_count=active, deleted_count=deleted,
+                                       active_bytes=active_bytes, deleted_bytes=deleted_bytes,
+                                       latest_upload_at=upload_time))
+    except IntegrityError:
+        query.update(values, synchronize_session=False)
+
+
+def record_uploads(session, images):
+    """新图片写入 images 的同一事务中调用，按类型合并为一次更新"""
+    deltas = {}
+    for image in images:
+        count, size, latest = deltas.get(image.type_id, (0, 0, None))
+        upload_time = image.upload_time or datetime.now()
+        deltas[image.type_id] = (count + 1, size + (image.file_size or 0),
+                                 upload_time if latest is None or upload_time > latest else latest)
+    for type_id, (count, size, latest) in deltas.items():
+        _apply_delta(session, type_id, active=count, active_bytes=size, upload_time=latest)
+
+
+def record_delete(session, image):
+    """图片软删除"""
+    size = image.file_size or 0
+    _apply_delta(session, image.type_id, active=-1, deleted=1, active_bytes=-size, deleted_bytes=size)
+
+
+def record_restore(session, image):
+    """已软删除的图片被重新上传而恢复"""
+    size = image.file_size or 0
+    _apply_delta(session, image.type_id, active=1, deleted=-1, active_bytes=size, deleted_bytes=-size,
+                 upload_time=image.upload_time)
+
+
+def record_purge(session, image):
+    """已软删除的图片被物理删除"""
+    size = image.file_size or 0
+    _apply_delta(session, image.type_id, deleted=-1, deleted_bytes=-size)
+
+
+def get_type_stats(type_id):
+    """单个类型的统计，没有统计行时返回 None"""
+    with db_manager.session_scope() as session:
+        stats = session.get(ImageTypeStats, type_id)
+        return stats.to_dict() if stats else None
+
+
+def get_all_stats():
+    """所有类型的统计及合计"""
+    with db_manager.session_scope() as session:
+        rows = session.query(ImageTypeStats).order_by(ImageTypeStats.type_id).all()
+    types = [row.to_dict() for row in rows]
+    latest = max((row.latest_upload_at for row in rows if row.latest_upload_at), default=None)
+    return {
+        'active_count': sum(row.active_count for row in rows),
+        'deleted_count': sum(row.deleted_count for row in rows),
+        'active_bytes': sum(row.active_bytes for row in rows),
+        'deleted_bytes': sum(row.deleted_bytes for row in rows),
+        'latest_upload': latest.isoformat() if latest else None,
+        'types': types
+    }
+
+
+def stats_initialized():
+    with db_manager.session_scope() as session:
+        return session.query(ImageTypeStats.type_id).first() is not None
+
+
+def rebuild_stats():
+    """从 images 表重新计算全部统计（一次 GROUP BY），在同一事务内替换旧数据"""
+    type_id = func.coalesce(Image.type_id, DEFAULT_TYPE_ID)
+    with db_manager.session_scope() as session:
+        rows = session.query(
+            type_id,
+            func.sum(case((Image.is_deleted == False, 1), else_=0)),
+            func.sum(case((Image.is_deleted == True, 1), else_=0)),
+            func.sum(case((Image.is_deleted == False, Image.file_size), else_=0)),
+            func.sum(case((Image.is_deleted == True, Image.file_size), else_=0)),
+            func.max(case((Image.is_deleted == False, Image.upload_time), else_=None)),
+        ).group_by(type_id).all()
+
+        session.query(ImageTypeStats).delete(synchronize_session=False)
+        session.add_all([
+            ImageTypeStats(type_id=row_type_id, active_count=int(active or 0), deleted_count=int(deleted or 0),
+                           active_bytes=int(active_bytes or 0), deleted_bytes=int(deleted_bytes or 0),
+                           latest_upload_at=latest)
+            for row_type_id, active, deleted, active_bytes, deleted_bytes, latest in rows
+        ])
+    logger.info(f"图片统计已重建，共 {len(rows)} 个类型")
+    return len(rows)
+
+
+if __name__ == "__main__":
+    # 要在项目根目录下运行此脚本
+    from app import create_app
+    from app.blueprints.image_service import image_stats
+
+    flask_app = create_app()
+    command = sys.argv[1] if len(sys.argv) > 1 else 'show'
+    if command == 'rebuild':
+        image_stats.rebuild_stats()
+    print(image_stats.get_all_stats())
@@ -0,0 +1,193 @@
+"""
+现代格式转码与内容协商
+为原图和缩略图预先生成 WebP / AVIF 兄弟文件（{path}.webp、{path}.avif），
+请求时按 Accept 头选择客户端支持且已生成的最优格式。
+只在转码结果比原文件小时才保留，否则写一个 .skip 标记，避免回填任务重复转码。
+
+回填已有图片（在项目根目录下）:
+    python -m app.blueprints.image_service.image_transcode
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import request
+from PIL import Image as PILImage, features
+from sqlalchemy.orm import joinedload
+from loguru import logger
+
+from .image_db import db_manager, Image
+from .image_serving import send_image_file, not_modified
+
+# 按优先级排列：(扩展名, MIME 类型, Pillow 格式名)
+SIBLING_FORMATS = [
+    ('avif', 'image/avif', 'AVIF'),
+    ('webp', 'image/webp', 'WEBP'),
+]
+SKIP_SUFFIX = '.skip'
+
+
+def _pillow_supports(ext):
+    try:
+        return bool(features.check(ext))
+    except ValueError:
+        return False
+
+
+def available_formats(formats):
+    """过滤出当前 Pillow 能编码的格式，保持 SIBLING_FORMATS 中的优先级"""
+    return [entry for entry in SIBLING_FORMATS if entry[0] in formats and _pillow_supports(entry[0])]
+
+
+def transcode_settings(config):
+    """返回 (formats, quality)，未启用转码时 formats 为 None"""
+    formats = config['IMAGE_TRANSCODE_FORMATS'] if config['IMAGE_TRANSCODE_ENABLED'] else None
+    return formats, config['IMAGE_TRANSCODE_QUALITY']
+
+
+def sibling_path(path, ext):
+    return f"{path}.{ext}"
+
+
+def transcode_file(path, formats, quality=None):
+    """
+    为 path 生成兄弟文件，已生成或已标记跳过的格式不会重复转码
+    Returns:
+        list: 本次新生成的兄弟文件路径
+    """
+    quality = quality or {}
+    pending = [entry for entry in available_formats(formats)
+               if not os.path.exists(sibling_path(path, entry[0]))
+               and not os.path.exists(sibling_path(path, entry[0]) + SKIP_SUFFIX)]
+    if not pending or not os.path.exists(path):
+        return []
+
+    created = []
+    original_size = os.path.getsize(path)
+    with PILImage.open(path) as img:
+        if getattr(img, 'is_animated', False):
+            return []  # 动图保持原格式
+        if img.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+        for ext, _, pil_format in pending:
+            target = sibling_path(path, ext)
+            temp_path = f"{target}.{os.getpid()}.tmp"
+            try:
+                img.save(temp_path, format=pil_format, quality=quality.get(ext, 80))
+                if os.path.getsize(temp_path) < original_size:
+                    os.replace(temp_path, target)
+                    created.append(target)
+                else:
+                    open(target + SKIP_SUFFIX, 'wb').close()
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+    return created
+
+
+def transcode_image_files(image_path, thumbnail_path, formats, quality=None):
+    """转码原图及其缩略图，失败只记录日志，不影响上传和缩略图任务"""
+    created = []
+    for path in (image_path, thumbnail_path):
+        if not path:
+            continue
+        try:
+            created.extend(transcode_file(path, formats, quality))
+        except Exception as e:
+            logger.warning(f"转码失败 {path}: {e}")
+    return created
+
+
+def accepted_formats(accept_mimetypes, formats):
+    """
+    客户端在 Accept 头中显式列出、且已启用的兄弟格式扩展名，按优先级排列
+    只认显式列出的类型，*/* 不代表支持 WebP/AVIF
+    """
+    accepted = {mimetype for mimetype, q in accept_mimetypes if q > 0}
+    return [ext for ext, mimetype, _ in SIBLING_FORMATS if ext in formats and mimetype in accepted]
+
+
+def negotiate(path, exts):
+    """
+    选择要发送的文件：exts 中第一个已生成的兄弟文件，都没有时发送原文件
+    Returns:
+        tuple: (file_path, mimetype, ext)，发送原文件时 mimetype 和 ext 为 None
+    """
+    mimetypes = {ext: mimetype for ext, mimetype, _ in SIBLING_FORMATS}
+    for ext in exts:
+        candidate = sibling_path(path, ext)
+        if os.path.exists(candidate):
+            return candidate, mimetypes[ext], ext
+    return path, None, None
+
+
+def _representation(variant, ext):
+    return '-'.join(part for part in (variant, ext) if part) or None
+
+
+def send_negotiated(directory, filename, config, meta=None, variant=None, immutable=False):
+    """
+    对 directory/filename 做内容协商后发送，启用转码时响应带 Vary: Accept
+    传入 meta 时先检查条件请求，命中则直接返回 304，不访问磁盘；variant 用于区分缩略图等表示的 ETag
+    """
+    enabled = config['IMAGE_TRANSCODE_ENABLED']
+    exts = accepted_formats(request.accept_mimetypes, config['IMAGE_TRANSCODE_FORMATS']) if enabled else []
+    vary = 'Accept' if enabled else None
+
+    if meta:
+        representations = [_representation(variant, ext) for ext in exts] + [variant]
+        response = not_modified(meta, representations, immutable, vary)
+        if response:
+            return response
+
+    path, mimetype, ext = negotiate(os.path.join(directory, filename), exts)
+    response = send_image_file(directory, os.path.relpath(path, directory), config, mimetype=mimetype,
+                               meta=meta, representation=_representation(variant, ext), immutable=immutable)
+    if vary:
+        response.vary.add(vary)
+    return response
+
+
+def _transcode_job(image_path, thumbnail_path, formats, quality):
+    return len(transcode_image_files(image_path, thumbnail_path, formats, quality))
+
+
+def backfill_transcoded(upload_folder, formats, quality=None, processes=2, batch_size=200):
+    """为已有图片补齐兄弟文件，按 id 分批读取，用进程池并行转码"""
+    last_id = 0
+    total_images = 0
+    total_created = 0
+    thumbnail_dir = os.path.join(upload_folder, 'thumbnails')
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        while True:
+            with db_manager.session_scope() as session:
+                images = session.query(Image).options(joinedload(Image.image_type)) \
+                    .filter(Image.id > last_id, Image.is_deleted == False) \
+                    .order_by(Image.id) \
+                    .limit(batch_size) \
+                    .all()
+                paths = [(os.path.join(upload_folder, image.folder_name, image.uuid_filename),
+                          os.path.join(thumbnail_dir, image.uuid_filename)) for image in images]
+            if not images:
+                break
+            last_id = images[-1].id
+
+            futures = [executor.submit(_transcode_job, image_path, thumbnail_path, formats, quality)
+                       for image_path, thumbnail_path in paths]
+            total_created += sum(future.result() for future in futures)
+            total_images += len(images)
+            logger.info(f"转码回填进度: {total_images} 张图片，新生成 {total_created} 个文件，last_id={last_id}")
+    return total_images, total_created
+
+
+if __name__ == "__main__":
+    # 要在项目根目录下运行此脚本
+    from app import create_app
+    from app.blueprints.image_service import image_transcode
+
+    flask_app = create_app()
+    image_transcode.backfill_transcoded(
+        flask_app.config['IMAGE_UPLOAD_FOLDER'],
+        flask_app.config['IMAGE_TRANSCODE_FORMATS'],
+        flask_app.config['IMAGE_TRANSCODE_QUALITY'],
+        processes=flask_app.config['THUMBNAIL_WORKER_PROCESSES'],
+    )
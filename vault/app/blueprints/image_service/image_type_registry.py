@@ -0,0 +1,128 @@
+"""
+图片类型注册表
+image_types 只有几行且几乎不变，上传和列表接口原来每次都要按 type_id / type_name 查询一次。
+这里在每个 worker 进程内缓存全部类型，按 type_id 和 type_name 建索引。
+
+跨 worker 失效：/image/types 的 POST / PUT / DELETE 在修改类型的同一事务内给 cache_versions 中的
+image_types 版本号加一；各 worker 每 CHECK_INTERVAL 秒读取一次版本号，变化后重新加载。
+查找不到类型时提前检查一次版本号，其它 worker 刚创建的类型不用等到下次检查；
+这种提前检查最多每 MISS_CHECK_INTERVAL 秒一次，反复请求不存在的类型不会每次都访问数据库。
+"""
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import make_transient_to_detached
+from loguru import logger
+
+from .image_db import db_manager, ImageType, CacheVersion
+
+VERSION_NAME = 'image_types'
+
+_TypeRow = namedtuple('_TypeRow', ['id', 'type_id', 'type_name', 'description', 'created_time'])
+
+
+def bump_version(session):
+    """在修改 image_types 的事务中调用，通知所有 worker 重新加载"""
+    values = {CacheVersion.version: CacheVersion.version + 1, CacheVersion.updated_at: datetime.now()}
+    query = session.query(CacheVersion).filter(CacheVersion.name == VERSION_NAME)
+    if query.update(values, synchronize_session=False):
+        return
+    try:
+        with session.begin_nested():
+            session.add(CacheVersion(name=VERSION_NAME, version=1))
+    except IntegrityError:
+        query.update(values, synchronize_session=False)
+
+
+class ImageTypeRegistry:
+    """每个 worker 进程一份，首次使用时从数据库加载"""
+    CHECK_INTERVAL = 5  # 秒，检查版本号的间隔
+    MISS_CHECK_INTERVAL = 1  # 秒，查找不到类型时提前检查版本号的最小间隔
+
+    def __init__(self, check_interval=CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._by_id = {}
+        self._by_name = {}
+        self._version = None
+        self._loaded = False
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _read_version(session):
+        return session.query(CacheVersion.version).filter(CacheVersion.name == VERSION_NAME).scalar()
+
+    def _load(self, session, version):
+        rows = [_TypeRow(*row) for row in session.query(
+            ImageType.id, ImageType.type_id, ImageType.type_name, ImageType.description, ImageType.created_time
+        ).order_by(ImageType.id)]
+        by_name = {}
+        for row in rows:
+            by_name.setdefault(row.type_name, row)
+        self._by_id, self._by_name = {row.type_id: row for row in rows}, by_name
+        self._version = version
+        self._loaded = True
+        logger.debug(f"图片类型注册表已加载 {len(rows)} 个类型，version={version}")
+
+    def _ensure_fresh(self, max_age=None):
+        """距上次检查版本号超过 max_age 秒（默认 check_interval）时重新检查"""
+        max_age = self.check_interval if max_age is None else max_age
+        if self._loaded and time.monotonic() - self._checked_at < max_age:
+            return
+        with self._lock:
+            if self._loaded and time.monotonic() - self._checked_at < max_age:
+                return
+            with db_manager.session_scope() as session:
+                version = self._read_version(session)
+                if not self._loaded or version != self._version:
+                    self._load(session, version)
+            self._checked_at = time.monotonic()
+
+    def reload(self):
+        """本进程修改类型后立即重新加载"""
+        with self._lock:
+            with db_manager.session_scope() as session:
+                self._load(session, self._read_version(session))
+            self._checked_at = time.monotonic()
+
+    @staticmethod
+    def _to_model(row):
+        # 每次返回新的游离对象，调用方可以像查询结果一样把它关联到自己的会话（如 Image(image_type=...)）
+        image_type = ImageType(**row._asdict())
+        make_transient_to_detached(image_type)
+        return image_type
+
+    def _find(self, type_id, type_name):
+        if type_id is not None:
+            try:
+                row = self._by_id.get(int(type_id))
+            except (TypeError, ValueError):
+                row = None
+            if row is not None:
+                return row
+        return self._by_name.get(type_name) if type_name is not None else None
+
+    def get(self, type_id=None, type_name=None):
+        """按 type_id 或 type_name 查找（type_id 优先），不存在时返回 None"""
+        self._ensure_fresh()
+        row = self._find(type_id, type_name)
+        if row is None:
+            # 可能是其它 worker 刚创建的类型
+            self._ensure_fresh(max_age=self.MISS_CHECK_INTERVAL)
+            row = self._find(type_id, type_name)
+        return self._to_model(row) if row else None
+
+    def all(self):
+        self._ensure_fresh()
+        return [self._to_model(row) for row in sorted(self._by_id.values(), key=lambda row: row.id)]
+
+    def folder_names(self):
+        """type_id -> 目录名，如 {3: '3_avatar'}"""
+        self._ensure_fresh()
+        return {row.type_id: f"{row.type_id}_{row.type_name}" for row in self._by_id.values()}
+
+
+image_type_registry = ImageTypeRegistry()
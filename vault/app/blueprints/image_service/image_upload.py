@@ -1,7 +1,18 @@
-import requests
+import argparse
+import hashlib
+import mimetypes
 import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
+
 # 使用单个文件上传的接口，逐个上传图片
 def batch_upload_images(folder_path, upload_url):
     """批量上传目录下的所有图片"""
@@ -67,9 +78,197 @@ def batch_upload_multiple_images(folder_path, upload_url, batch_size=5):
             for file_tuple in files:
                 file_tuple[1][1].close()
 
+class UploadManifest:
+    """
+    本地 SQLite 清单，记录每个文件的哈希和上传结果，中断后再次运行时跳过已完成且未修改的文件
+    只在主线程中读写
+    """
+    STATUS_UPLOADED = 'uploaded'
+    STATUS_DUPLICATE = 'duplicate'
+    STATUS_FAILED = 'failed'
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT,
+                status TEXT,
+                image_id INTEGER,
+                url TEXT,
+                error TEXT,
+                updated_at REAL
+            )
+        """)
+        self.conn.commit()
+
+    def is_done(self, path, size, mtime_ns):
+        row = self.conn.execute("SELECT size, mtime_ns, status FROM files WHERE path = ?", (path,)).fetchone()
+        return row is not None and row[0] == size and row[1] == mtime_ns \
+            and row[2] in (self.STATUS_UPLOADED, self.STATUS_DUPLICATE)
+
+    def record(self, path, size, mtime_ns, sha256, status, image_id=None, url=None, error=None):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, sha256, status, image_id, url, error, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, size, mtime_ns, sha256, status, image_id, url, error, time.time())
+        )
+        self.conn.commit()
+
+    def summary(self):
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM files GROUP BY status").fetchall())
+
+    def close(self):
+        self.conn.close()
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """全文件 SHA-256，与服务端的 content_hash 相同；文件无法读取时返回 None"""
+    content_hash = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                content_hash.update(chunk)
+    except OSError as e:
+        print(f"读取 {path} 失败: {e}")
+        return None
+    return content_hash.hexdigest()
+
+
+class BulkUploader:
+    """
+    并发批量上传客户端
+    - 固定大小的线程池，所有请求共用一个带连接池的 requests.Session
+    - 客户端计算全文件 SHA-256，按批调用 POST /image/exists，服务端已有的文件不再上传
+    - 连接错误和 429/5xx 按指数退避重试（服务端按内容查重，重复提交上传是安全的）
+    - 每个文件只在上传它的线程中打开，传完即关闭
+    - 结果写入本地 SQLite 清单，中断后再次运行会跳过已完成的文件
+    """
+    CHECK_BATCH_SIZE = 200  # 每次查重请求包含的文件数，不超过服务端的 IMAGE_BATCH_MAX_ITEMS
+
+    def __init__(self, base_url, type_id, tags=None, concurrency=8, manifest_path='upload_manifest.sqlite3',
+                 retries=5, backoff_factor=0.5, timeout=(10, 120)):
+        self.base_url = base_url.rstrip('/')
+        self.type_id = type_id
+        self.tags = tags
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.manifest = UploadManifest(manifest_path)
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=backoff_factor,
+                      status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=frozenset({'GET', 'POST'}))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _collect(self, folder_path):
+        """列出需要处理的文件 [(path, size, mtime_ns)]，跳过清单中已完成的"""
+        pending = []
+        for file_path in sorted(Path(folder_path).iterdir()):
+            if not file_path.is_file() or file_path.suffix.lower() not in IMAGE_EXTENSIONS:
+                continue
+            stat = file_path.stat()
+            if not self.manifest.is_done(str(file_path), stat.st_size, stat.st_mtime_ns):
+                pending.append((str(file_path), stat.st_size, stat.st_mtime_ns))
+        return pending
+
+    def check_existing(self, entries):
+        """entries: [(size, sha256)]，返回与之对应的列表，已存在的为图片信息，否则为 None"""
+        response = self.session.post(f"{self.base_url}/exists", timeout=self.timeout,
+                                     json={'items': [{'size': size, 'sha256': sha256} for size, sha256 in entries]})
+        response.raise_for_status()
+        return response.json()
+
+    def upload_file(self, path):
+        with open(path, 'rb') as f:
+            files = {'file': (os.path.basename(path), f, mimetypes.guess_type(path)[0] or 'application/octet-stream')}
+            data = {'type_id': self.type_id}
+            if self.tags:
+                data['tags'] = self.tags
+            response = self.session.post(f"{self.base_url}/upload", data=data, files=files, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def run(self, folder_path):
+        pending = self._collect(folder_path)
+        print(f"待处理 {len(pending)} 个文件")
+        started_at = time.monotonic()
+        uploaded_bytes = 0
+        done = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for start in range(0, len(pending), self.CHECK_BATCH_SIZE):
+                batch = pending[start:start + self.CHECK_BATCH_SIZE]
+                hashes = list(executor.map(lambda entry: hash_file(entry[0]), batch))
+                try:
+                    existing = self.check_existing([(size, sha256 or '0' * 64)
+                                                    for (_, size, _), sha256 in zip(batch, hashes)])
+                except requests.RequestException as e:
+                    print(f"查重请求失败，全部上传: {e}")
+                    existing = [None] * len(batch)
+
+                futures = {}
+                for (path, size, mtime_ns), sha256, image in zip(batch, hashes, existing):
+                    if sha256 is None:
+                        self.manifest.record(path, size, mtime_ns, None, UploadManifest.STATUS_FAILED,
+                                             error="cannot read file")
+                        done += 1
+                        continue
+                    if image:
+                        self.manifest.record(path, size, mtime_ns, sha256, UploadManifest.STATUS_DUPLICATE,
+                                             image_id=image.get('id'), url=image.get('url'))
+                        done += 1
+                        continue
+                    futures[executor.submit(self.upload_file, path)] = (path, size, mtime_ns, sha256)
+
+                for future in as_completed(futures):
+                    path, size, mtime_ns, sha256 = futures[future]
+                    try:
+                        data = future.result().get('data') or {}
+                        self.manifest.record(path, size, mtime_ns, sha256, UploadManifest.STATUS_UPLOADED,
+                                             image_id=data.get('id'), url=data.get('url'))
+                        uploaded_bytes += size
+                    except Exception as e:
+                        self.manifest.record(path, size, mtime_ns, sha256, UploadManifest.STATUS_FAILED, error=str(e))
+                        print(f"上传 {os.path.basename(path)} 失败: {e}")
+                    done += 1
+
+                elapsed = max(time.monotonic() - started_at, 1e-6)
+                print(f"进度 {done}/{len(pending)}，{uploaded_bytes / elapsed / 1024 / 1024:.2f} MB/s")
+
+        summary = self.manifest.summary()
+        print(f"完成: {summary}")
+        return summary
+
+    def close(self):
+        self.session.close()
+        self.manifest.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="并发批量上传目录中的图片")
+    parser.add_argument('folder')
+    parser.add_argument('--url', required=True, help="图片服务地址，如 http://127.0.0.1:9090/image")
+    parser.add_argument('--type-id', type=int, required=True)
+    parser.add_argument('--tags')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--manifest', default='upload_manifest.sqlite3')
+    args = parser.parse_args(argv)
+
+    uploader = BulkUploader(args.url, args.type_id, tags=args.tags, concurrency=args.concurrency,
+                            manifest_path=args.manifest)
+    try:
+        return uploader.run(args.folder)
+    finally:
+        uploader.close()
+
 # 使用示例
 if __name__ == "__main__":
-    batch_upload_images('./to_upload_images', 'http://20.4.2.128:8090//images/upload')
+    # python image_upload.py ./to_upload_images --url http://127.0.0.1:9090/image --type-id 22
+    main()
+    # batch_upload_images('./to_upload_images', 'http://20.4.2.128:8090//images/upload')
     # batch_upload_multiple_images('./to_upload_images', 'http://127.0.0.1:5002/images/multiple_upload', 2)
 
 """
@@ -0,0 +1,151 @@
+"""
+感知哈希近似重复索引
+每个 worker 进程内维护一棵 BK 树（按汉明距离组织），回答"距离 N 以内的相似图片"。
+索引只增不删：已软删除的图片在查询结果回表时过滤。
+没有感知哈希的历史图片用 thumbnail_jobs 的 backfill-phash 补算。
+"""
+import threading
+import time
+
+from loguru import logger
+
+from .image_db import db_manager, Image
+
+
+class BKTree:
+    """以汉明距离为度量的 BK 树，节点: [hash_value, [item, ...], {distance: child}]"""
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, hash_value, item):
+        self.size += 1
+        if self.root is None:
+            self.root = [hash_value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = (node[0] ^ hash_value).bit_count()
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [hash_value, [item], {}]
+                return
+            node = child
+
+    def search(self, hash_value, max_distance):
+        """返回 [(item, distance)]"""
+        if self.root is None:
+            return []
+        results = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = (node[0] ^ hash_value).bit_count()
+            if distance <= max_distance:
+                results.extend((item, distance) for item in node[1])
+            # 三角不等式：只有 |d - distance| <= max_distance 的子树可能包含结果
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return results
+
+
+class SimilarityIndex:
+    """图片 id 的感知哈希索引，首次使用时从数据库加载，之后按 REFRESH_INTERVAL 增量同步"""
+    REFRESH_INTERVAL = 10  # 秒
+    PENDING_CHECK_LIMIT = 1000  # 每次同步最多回查的未生成哈希的图片数
+
+    def __init__(self, refresh_interval=REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._tree = None
+        self._max_id = 0
+        self._pending = set()  # 已加载但缩略图（感知哈希）尚未生成的图片 id
+        self._added_ahead = set()  # 本进程直接加入、尚未经过同步的图片 id，同步时跳过避免重复
+        self._pending_cursor = None  # 轮转回查的位置，下次从小于该 id 的图片继续
+        self._refreshed_at = 0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        if self._tree is None:
+            self._tree = BKTree()
+        with db_manager.session_scope() as session:
+            rows = session.query(Image.id, Image.phash) \
+                .filter(Image.id > self._max_id) \
+                .order_by(Image.id) \
+                .yield_per(10000)
+            for image_id, phash in rows:
+                self._max_id = image_id
+                if image_id in self._added_ahead:
+                    self._added_ahead.discard(image_id)
+                elif phash:
+                    self._tree.add(int(phash, 16), image_id)
+                else:
+                    self._pending.add(image_id)
+
+            # 缩略图由后台任务生成，回查之前还没有感知哈希的图片
+            if self._pending:
+                pending_ids = self._pending_batch()
+                rows = session.query(Image.id, Image.phash) \
+                    .filter(Image.id.in_(pending_ids), Image.phash.isnot(None)) \
+                    .all()
+                for image_id, phash in rows:
+                    self._tree.add(int(phash, 16), image_id)
+                    self._pending.discard(image_id)
+        self._refreshed_at = time.monotonic()
+
+    def _pending_batch(self):
+        """
+        本次回查的未生成哈希的图片：一半取最新的（刚上传、缩略图任务正在处理），
+        另一半从游标处按 id 从大到小轮转，超过上限时也能逐步回查到所有图片
+        """
+        pending_ids = sorted(self._pending, reverse=True)
+        if len(pending_ids) <= self.PENDING_CHECK_LIMIT:
+            return pending_ids
+        newest_count = self.PENDING_CHECK_LIMIT // 2
+        rotate_count = self.PENDING_CHECK_LIMIT - newest_count
+        newest, rest = pending_ids[:newest_count], pending_ids[newest_count:]
+        cursor = self._pending_cursor
+        window = [image_id for image_id in rest if cursor is None or image_id < cursor][:rotate_count]
+        if len(window) < rotate_count:
+            # 到达最小的 id 后从头开始
+            window += rest[:rotate_count - len(window)]
+        self._pending_cursor = window[-1]
+        return newest + window
+
+    def _ensure_fresh(self):
+        if self._tree is not None and time.monotonic() - self._refreshed_at < self.refresh_interval:
+            return
+        with self._lock:
+            if self._tree is None or time.monotonic() - self._refreshed_at >= self.refresh_interval:
+                try:
+                    self._refresh()
+                except Exception as e:
+                    logger.warning(f"相似图片索引同步失败: {e}")
+                    if self._tree is None:
+                        raise
+
+    def search(self, phash, max_distance):
+        """返回距离 max_distance 以内的 [(image_id, distance)]，按距离升序"""
+        self._ensure_fresh()
+        results = self._tree.search(int(phash, 16), max_distance)
+        results.sort(key=lambda result: result[1])
+        return results
+
+    def add(self, image_id, phash):
+        if self._tree is None or not phash:
+            return
+        with self._lock:
+            if image_id in self._pending:
+                self._pending.discard(image_id)
+            elif image_id > self._max_id:
+                self._added_ahead.add(image_id)
+            else:
+                return
+            self._tree.add(int(phash, 16), image_id)
+
+
+similarity_index = SimilarityIndex()
@@ -0,0 +1,323 @@
+"""
+存储清理
+delete_image 只做软删除，文件一直占用磁盘。这里的清理任务：
+1. purge：软删除超过保留期（STORAGE_GC_RETENTION_DAYS）的图片，删除原图、缩略图、WebP/AVIF 兄弟文件、
+   跳过标记和尺寸变体，再删除记录并更新统计。按 id 分批处理，每批之间暂停 STORAGE_GC_BATCH_INTERVAL 秒
+2. scan：把各类型目录和缩略图目录的文件名排序后，与排序后的记录文件名做一次归并，
+   找出没有记录的孤儿文件（默认只报告，--delete-orphans 时删除足够旧的）和文件丢失的记录
+3. temp：删除遗留的 .part / .tmp 临时文件（中断的上传、导入、转码、变体生成）以及过期的分块上传会话
+
+在项目根目录下运行，建议在访问低谷时由 cron 调用:
+    python -m app.blueprints.image_service.storage_gc [purge|scan|temp|all] [--dry-run] [--delete-orphans]
+"""
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+from loguru import logger
+
+from .image_db import db_manager, Image, ImageTag, ThumbnailJob
+from .image_type_registry import image_type_registry
+from .image_transcode import SIBLING_FORMATS, SKIP_SUFFIX, sibling_path
+from .image_ingest import UploadIngest
+from .variant_cache import get_variant_cache
+from . import chunked_upload
+from . import image_stats
+
+THUMBNAIL_DIR_NAME = 'thumbnails'
+DEFAULT_FOLDER_NAME = '0_others'
+TEMP_SUFFIXES = (UploadIngest.TEMP_SUFFIX, '.tmp')
+REPORT_LIMIT = 100  # 每类问题最多逐条记录的数量，其余只计数
+
+_SIBLING_EXTS = {f".{ext}" for ext, _, _ in SIBLING_FORMATS}
+
+
+class Throttle:
+    """每处理 batch_size 次磁盘操作暂停 interval 秒，避免清理任务在服务时段占满磁盘 IO"""
+
+    def __init__(self, batch_size, interval):
+        self.batch_size = max(batch_size, 1)
+        self.interval = interval
+        self._count = 0
+
+    def tick(self, count=1):
+        self._count += count
+        if self._count >= self.batch_size:
+            self._count = 0
+            if self.interval:
+                time.sleep(self.interval)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['STORAGE_GC_BATCH_SIZE'], config['STORAGE_GC_BATCH_INTERVAL'])
+
+
+def _remove(path):
+    """删除文件，返回释放的字节数，文件不存在时返回 0"""
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except FileNotFoundError:
+        return 0
+
+
+def _with_siblings(path):
+    """path 以及它的兄弟文件和跳过标记"""
+    paths = [path]
+    for ext, _, _ in SIBLING_FORMATS:
+        paths.extend([sibling_path(path, ext), sibling_path(path, ext) + SKIP_SUFFIX])
+    return paths
+
+
+def image_file_paths(config, folder_name, uuid_filename):
+    """一张图片在磁盘上的所有文件"""
+    upload_folder = config['IMAGE_UPLOAD_FOLDER']
+    paths = _with_siblings(os.path.join(upload_folder, folder_name, uuid_filename))
+    paths.extend(_with_siblings(os.path.join(upload_folder, THUMBNAIL_DIR_NAME, uuid_filename)))
+    variant_cache = get_variant_cache(config)
+    paths.extend(variant_cache.variant_path(width, height, uuid_filename)
+                 for width, height in config['THUMBNAIL_VARIANT_SIZES'])
+    return paths
+
+
+def purge_deleted(config, retention_days=None, dry_run=False):
+    """
+    物理删除超过保留期的软删除图片
+    每批在锁定记录后先删除文件再删除记录：若提交失败，记录仍是软删除状态，
+    之后重新上传相同内容时按“文件已被清理”的情况恢复
+    Returns:
+        dict: {'purged', 'bytes'}
+    """
+    retention_days = config['STORAGE_GC_RETENTION_DAYS'] if retention_days is None else retention_days
+    cutoff = datetime.now() - timedelta(days=retention_days)
+    batch_size = config['STORAGE_GC_BATCH_SIZE']
+    folders = image_type_registry.folder_names()
+    counters = {'purged': 0, 'bytes': 0}
+    last_id = 0
+    while True:
+        with db_manager.session_scope() as session:
+            # 历史记录没有 deleted_at，以最后修改时间近似
+            images = session.query(Image) \
+                .filter(Image.is_deleted == True,
+                        Image.id > last_id,
+                        func.coalesce(Image.deleted_at, Image.updated_at) < cutoff) \
+                .order_by(Image.id) \
+                .limit(batch_size) \
+                .with_for_update() \
+                .all()
+            if not images:
+                break
+            last_id = images[-1].id
+
+            for image in images:
+                paths = image_file_paths(config, folders.get(image.type_id, DEFAULT_FOLDER_NAME), image.uuid_filename)
+                if dry_run:
+                    counters['bytes'] += sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+                    continue
+                counters['bytes'] += sum(_remove(path) for path in paths)
+                image_stats.record_purge(session, image)
+            counters['purged'] += len(images)
+
+            if dry_run:
+                session.rollback()
+            else:
+                ids = [image.id for image in images]
+                session.query(ImageTag).filter(ImageTag.image_id.in_(ids)).delete(synchronize_session=False)
+                session.query(ThumbnailJob).filter(ThumbnailJob.image_id.in_(ids)).delete(synchronize_session=False)
+                session.query(Image).filter(Image.id.in_(ids)).delete(synchronize_session=False)
+
+        logger.info(f"物理删除进度: {counters['purged']} 张，释放 {counters['bytes']} 字节")
+        if len(images) < batch_size:
+            break
+        time.sleep(config['STORAGE_GC_BATCH_INTERVAL'])
+
+    logger.info(f"物理删除完成{'（dry run）' if dry_run else ''}: {counters}")
+    return counters
+
+
+def owner_name(name):
+    """文件所属的原文件名：兄弟文件和跳过标记归属于原文件，如 a.png.webp、a.png.avif.skip -> a.png"""
+    if name.endswith(SKIP_SUFFIX):
+        name = name[:-len(SKIP_SUFFIX)]
+    base, ext = os.path.splitext(name)
+    # a.webp 本身是原文件，a.webp.avif 才是它的兄弟文件
+    if ext in _SIBLING_EXTS and os.path.splitext(base)[1]:
+        return base
+    return name
+
+
+def scan_directory(directory):
+    """目录中的文件 [(owner, name, path)]，按 owner、name 排序；临时文件由 clean_temp_files 处理"""
+    if not os.path.isdir(directory):
+        return []
+    entries = [(owner_name(entry.name), entry.name, entry.path) for entry in os.scandir(directory)
+               if entry.is_file() and not entry.name.endswith(TEMP_SUFFIXES)]
+    entries.sort()
+    return entries
+
+
+def merge_sorted(files, rows):
+    """
+    归并排序后的磁盘文件和记录，只遍历一次
+    Args:
+        files: scan_directory 的结果
+        rows: 按文件名排序的 [(uuid_filename, image_id, is_deleted)]
+    Yields:
+        ('orphan', (owner, name, path)) 没有对应记录的文件
+        ('missing', (uuid_filename, image_id, is_deleted)) 原文件不存在的未删除记录
+    """
+    index = 0
+    for row in rows:
+        filename = row[0]
+        while index < len(files) and files[index][0] < filename:
+            yield 'orphan', files[index]
+            index += 1
+        found = False
+        while index < len(files) and files[index][0] == filename:
+            found = found or files[index][1] == filename
+            index += 1
+        if not found and not row[2]:
+            yield 'missing', row
+    for entry in files[index:]:
+        yield 'orphan', entry
+
+
+def _load_rows():
+    """目录名 -> 按文件名排序的 [(uuid_filename, image_id, is_deleted)]，在 Python 中排序以与目录扫描的顺序一致"""
+    folders = image_type_registry.folder_names()
+    rows_by_folder = {}
+    with db_manager.session_scope() as session:
+        query = session.query(Image.type_id, Image.uuid_filename, Image.id, Image.is_deleted).yield_per(10000)
+        for type_id, uuid_filename, image_id, is_deleted in query:
+            rows_by_folder.setdefault(folders.get(type_id, DEFAULT_FOLDER_NAME), []) \
+                .append((uuid_filename, image_id, bool(is_deleted)))
+    for rows in rows_by_folder.values():
+        rows.sort()
+    return rows_by_folder
+
+
+def scan_storage(config, delete_orphans=False, dry_run=False):
+    """
+    检查各类型目录和缩略图目录，报告孤儿文件和文件丢失的记录
+    delete_orphans 时删除修改时间早于 STORAGE_GC_ORPHAN_MIN_AGE 的孤儿文件
+    Returns:
+        dict: {'orphans', 'orphan_bytes', 'orphans_removed', 'missing', 'missing_ids'}
+    """
+    upload_folder = config['IMAGE_UPLOAD_FOLDER']
+    orphan_cutoff = time.time() - config['STORAGE_GC_ORPHAN_MIN_AGE']
+    throttle = Throttle.from_config(config)
+    counters = {'orphans': 0, 'orphan_bytes': 0, 'orphans_removed': 0, 'missing': 0, 'missing_ids': []}
+
+    rows_by_folder = _load_rows()
+    folder_names = set(image_type_registry.folder_names().values()) | set(rows_by_folder) | {DEFAULT_FOLDER_NAME}
+    # 缩略图目录对应所有记录；缩略图缺失由 thumbnail_status 反映，这里只找孤儿
+    thumbnail_rows = sorted((filename, image_id, True) for rows in rows_by_folder.values()
+                            for filename, image_id, _ in rows)
+    targets = [(name, rows_by_folder.get(name, [])) for name in sorted(folder_names)]
+    targets.append((THUMBNAIL_DIR_NAME, thumbnail_rows))
+
+    for folder_name, rows in targets:
+        for kind, item in merge_sorted(scan_directory(os.path.join(upload_folder, folder_name)), rows):
+            if kind == 'missing':
+                counters['missing'] += 1
+                counters['missing_ids'].append(item[1])
+                if counters['missing'] <= REPORT_LIMIT:
+                    logger.warning(f"文件丢失: id={item[1]} {folder_name}/{item[0]}")
+                continue
+
+            _, name, path = item
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            counters['orphans'] += 1
+            counters['orphan_bytes'] += stat.st_size
+            if counters['orphans'] <= REPORT_LIMIT:
+                logger.warning(f"孤儿文件: {folder_name}/{name} ({stat.st_size} 字节)")
+            if delete_orphans and not dry_run and stat.st_mtime < orphan_cutoff:
+                _remove(path)
+                counters['orphans_removed'] += 1
+                throttle.tick()
+
+    logger.info(f"存储检查完成: 孤儿文件 {counters['orphans']} 个（{counters['orphan_bytes']} 字节，"
+                f"已删除 {counters['orphans_removed']} 个），文件丢失的记录 {counters['missing']} 条")
+    return counters
+
+
+def clean_temp_files(config, dry_run=False):
+    """
+    删除遗留的临时文件：上传目录下各子目录中的 .part（UploadIngest、分块上传、批量导入）和 .tmp（转码、变体）
+    分块上传的临时文件在会话有效期内都可能被续传，按会话有效期和 STORAGE_GC_TEMP_MAX_AGE 中较长的判断
+    Returns:
+        dict: {'removed', 'bytes', 'sessions'}
+    """
+    counters = {'removed': 0, 'bytes': 0, 'sessions': 0}
+    if not dry_run:
+        counters['sessions'] = chunked_upload.gc_upload_sessions(config)
+
+    upload_folder = config['IMAGE_UPLOAD_FOLDER']
+    directories = [entry.path for entry in os.scandir(upload_folder) if entry.is_dir()] \
+        if os.path.isdir(upload_folder) else []
+    variant_dir = get_variant_cache(config).cache_dir
+    if os.path.isdir(variant_dir):
+        directories.extend(entry.path for entry in os.scandir(variant_dir) if entry.is_dir())
+
+    now = time.time()
+    uploads_dir = chunked_upload.upload_dir(config)
+    throttle = Throttle.from_config(config)
+    for directory in directories:
+        max_age = config['STORAGE_GC_TEMP_MAX_AGE']
+        if os.path.normpath(directory) == os.path.normpath(uploads_dir):
+            max_age = max(max_age, config['CHUNKED_UPLOAD_SESSION_TTL'])
+        for entry in os.scandir(directory):
+            if not entry.is_file() or not entry.name.endswith(TEMP_SUFFIXES):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if stat.st_mtime >= now - max_age:
+                continue
+            counters['removed'] += 1
+            counters['bytes'] += stat.st_size if dry_run else _remove(entry.path)
+            throttle.tick()
+
+    logger.info(f"临时文件清理完成{'（dry run）' if dry_run else ''}: {counters}")
+    return counters
+
+
+def run(config, commands=('purge', 'temp', 'scan'), dry_run=False, delete_orphans=False, retention_days=None):
+    results = {}
+    if 'purge' in commands:
+        results['purge'] = purge_deleted(config, retention_days=retention_days, dry_run=dry_run)
+    if 'temp' in commands:
+        results['temp'] = clean_temp_files(config, dry_run=dry_run)
+    if 'scan' in commands:
+        results['scan'] = scan_storage(config, delete_orphans=delete_orphans, dry_run=dry_run)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="清理软删除图片的文件、孤儿文件和临时文件")
+    parser.add_argument('command', nargs='?', default='all', choices=['purge', 'scan', 'temp', 'all'])
+    parser.add_argument('--dry-run', action='store_true', help="只统计，不删除任何文件或记录")
+    parser.add_argument('--delete-orphans', action='store_true', help="删除没有记录的文件（默认只报告）")
+    parser.add_argument('--retention-days', type=int, help="默认取 STORAGE_GC_RETENTION_DAYS")
+    args = parser.parse_args(argv)
+
+    from app import create_app
+
+    flask_app = create_app()
+    commands = ('purge', 'temp', 'scan') if args.command == 'all' else (args.command,)
+    return run(flask_app.config, commands, dry_run=args.dry_run, delete_orphans=args.delete_orphans,
+               retention_days=args.retention_days)
+
+
+if __name__ == "__main__":
+    # 要在项目根目录下运行此脚本
+    from app.blueprints.image_service import storage_gc
+
+    storage_gc.main()
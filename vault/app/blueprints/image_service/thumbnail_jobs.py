@@ -0,0 +1,284 @@
+"""
+缩略图异步生成
+上传接口只负责保存原图并写入 Image 记录，同时在同一事务内插入一条 ThumbnailJob；
+后台 worker 轮询任务表，使用进程池生成缩略图，失败时按指数退避重试。
+子进程被杀死（如解码超大 PNG 时 OOM）导致进程池损坏时，进行中的任务按失败处理并重建进程池。
+
+运行 worker（在项目根目录下）:
+    python -m app.blueprints.image_service.thumbnail_jobs
+为没有感知哈希的历史图片补算（不重新生成缩略图）:
+    python -m app.blueprints.image_service.thumbnail_jobs backfill-phash
+"""
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+
+from loguru import logger
+from sqlalchemy.orm import joinedload
+
+from .image_db import db_manager, Image, ThumbnailJob
+from .image_db_helper import ImageDBHelper
+from .image_transcode import transcode_image_files, transcode_settings
+
+
+def enqueue_thumbnail_job(session, image):
+    """在当前事务中为图片创建缩略图任务"""
+    image.thumbnail_status = ThumbnailJob.STATUS_PENDING
+    if image.id is None:
+        session.flush()  # 获取自增 id
+    job = ThumbnailJob(image_id=image.id, status=ThumbnailJob.STATUS_PENDING)
+    session.add(job)
+    return job
+
+
+def generate_thumbnail(image_path, thumbnail_dir, size, transcode_formats=None, transcode_quality=None):
+    """
+    在子进程中执行：解码原图，生成缩略图并计算感知哈希，
+    指定 transcode_formats 时同时为原图和缩略图生成 WebP/AVIF 兄弟文件
+    Returns:
+        tuple: (width, height, thumbnail_path, phash)
+    """
+    width, height, thumbnail_path, phash = ImageDBHelper.decode_image(image_path, thumbnail_dir, size)
+    if not thumbnail_path:
+        raise RuntimeError(f"保存缩略图失败: {image_path}")
+    if transcode_formats:
+        transcode_image_files(image_path, thumbnail_path, transcode_formats, transcode_quality)
+    return width, height, thumbnail_path, phash
+
+
+class ThumbnailWorker:
+    """轮询 thumbnail_jobs 表并用进程池生成缩略图"""
+
+    def __init__(self, upload_folder, thumbnail_size=(300, 300), processes=2, batch_size=20,
+                 poll_interval=2, max_attempts=5, retry_delay=10, running_timeout=600,
+                 transcode_formats=None, transcode_quality=None):
+        self.upload_folder = upload_folder
+        self.thumbnail_size = tuple(thumbnail_size)
+        self.processes = processes
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay  # 秒，第 n 次失败后等待 retry_delay * 2^(n-1)
+        self.running_timeout = running_timeout  # 秒，超过该时间仍为 running 视为 worker 已崩溃
+        self.transcode_formats = transcode_formats
+        self.transcode_quality = transcode_quality
+
+    def claim_jobs(self):
+        """领取一批待执行的任务，返回 [(job_id, image_id, image_path)]"""
+        now = datetime.now()
+        claimed = []
+        with db_manager.session_scope() as session:
+            jobs = session.query(ThumbnailJob) \
+                .filter(ThumbnailJob.status == ThumbnailJob.STATUS_PENDING,
+                        ThumbnailJob.next_run_at <= now) \
+                .order_by(ThumbnailJob.id) \
+                .limit(self.batch_size) \
+                .with_for_update(skip_locked=True) \
+                .all()
+            if not jobs:
+                return claimed
+
+            images = session.query(Image).options(joinedload(Image.image_type)) \
+                .filter(Image.id.in_([job.image_id for job in jobs])).all()
+            images_by_id = {image.id: image for image in images}
+            for job in jobs:
+                job.status = ThumbnailJob.STATUS_RUNNING
+                job.attempts += 1
+                image = images_by_id.get(job.image_id)
+                image_path = None
+                if image is not None:
+                    image.thumbnail_status = ThumbnailJob.STATUS_RUNNING
+                    image_path = os.path.join(self.upload_folder, image.folder_name, image.uuid_filename)
+                claimed.append((job.id, job.image_id, image_path))
+        return claimed
+
+    def requeue_stale_jobs(self):
+        """
+        把长时间处于 running 状态的任务重新放回队列（每次领取时 attempts 已加一），
+        已达到最大次数的标记为 failed，避免每次都让 worker 崩溃的任务无限重试
+        """
+        deadline = datetime.now() - timedelta(seconds=self.running_timeout)
+        requeued = failed = 0
+        with db_manager.session_scope() as session:
+            jobs = session.query(ThumbnailJob) \
+                .filter(ThumbnailJob.status == ThumbnailJob.STATUS_RUNNING,
+                        ThumbnailJob.updated_at < deadline) \
+                .with_for_update(skip_locked=True) \
+                .all()
+            if not jobs:
+                return
+            images = session.query(Image).filter(Image.id.in_([job.image_id for job in jobs])).all()
+            images_by_id = {image.id: image for image in images}
+            for job in jobs:
+                job.last_error = "任务执行超时（worker 可能已崩溃）"
+                if job.attempts >= self.max_attempts:
+                    job.status = ThumbnailJob.STATUS_FAILED
+                    failed += 1
+                else:
+                    job.status = ThumbnailJob.STATUS_PENDING
+                    job.next_run_at = datetime.now() + timedelta(seconds=self.retry_delay * 2 ** (job.attempts - 1))
+                    requeued += 1
+                image = images_by_id.get(job.image_id)
+                if image is not None:
+                    image.thumbnail_status = job.status
+        if requeued:
+            logger.warning(f"重新排队超时的缩略图任务: {requeued} 个")
+        if failed:
+            logger.error(f"超时且达到最大重试次数的缩略图任务: {failed} 个")
+
+    def finish_job(self, job_id, image_id, result=None, error=None):
+        """记录任务结果，失败时按指数退避重试，超过最大次数标记为 failed"""
+        with db_manager.session_scope() as session:
+            job = session.get(ThumbnailJob, job_id)
+            image = session.get(Image, image_id)
+            if error is None:
+                width, height, _, phash = result
+                job.status = ThumbnailJob.STATUS_DONE
+                job.last_error = None
+                if image is not None:
+                    image.thumbnail_status = ThumbnailJob.STATUS_DONE
+                    image.phash = phash
+                    # 上传时未能从图片头解析出尺寸的，用解码结果补全
+                    image.width = image.width or width
+                    image.height = image.height or height
+                return
+
+            job.last_error = str(error)[:2000]
+            if job.attempts >= self.max_attempts:
+                job.status = ThumbnailJob.STATUS_FAILED
+                if image is not None:
+                    image.thumbnail_status = ThumbnailJob.STATUS_FAILED
+                logger.error(f"缩略图任务失败 job={job_id} image={image_id}: {error}")
+            else:
+                job.status = ThumbnailJob.STATUS_PENDING
+                job.next_run_at = datetime.now() + timedelta(seconds=self.retry_delay * 2 ** (job.attempts - 1))
+                if image is not None:
+                    image.thumbnail_status = ThumbnailJob.STATUS_PENDING
+                logger.warning(f"缩略图任务重试 job={job_id} image={image_id} 第{job.attempts}次: {error}")
+
+    def run_once(self, executor):
+        """
+        处理一批任务，返回本批任务数
+        进程池损坏时本批未完成的任务都按失败处理（无法区分是哪个任务导致的），然后抛出 BrokenProcessPool
+        """
+        claimed = self.claim_jobs()
+        futures = []
+        broken = None
+        for job_id, image_id, image_path in claimed:
+            if image_path is None:
+                self.finish_job(job_id, image_id, error=f"图片记录不存在: {image_id}")
+                continue
+            if broken is None:
+                try:
+                    future = executor.submit(generate_thumbnail, image_path, self.upload_folder, self.thumbnail_size,
+                                             self.transcode_formats, self.transcode_quality)
+                    futures.append((job_id, image_id, future))
+                    continue
+                except BrokenProcessPool as e:
+                    broken = e
+            self.finish_job(job_id, image_id, error=broken)
+
+        for job_id, image_id, future in futures:
+            try:
+                self.finish_job(job_id, image_id, result=future.result())
+            except BrokenProcessPool as e:
+                broken = e
+                self.finish_job(job_id, image_id, error=e)
+            except Exception as e:
+                self.finish_job(job_id, image_id, error=e)
+        if broken is not None:
+            raise broken
+        return len(claimed)
+
+    def run_forever(self):
+        logger.info(f"缩略图 worker 启动，进程数: {self.processes}")
+        executor = ProcessPoolExecutor(max_workers=self.processes)
+        try:
+            while True:
+                try:
+                    self.requeue_stale_jobs()
+                    if self.run_once(executor) == 0:
+                        time.sleep(self.poll_interval)
+                except BrokenProcessPool as e:
+                    logger.error(f"缩略图进程池已损坏（子进程可能被 OOM 杀死），重建进程池: {e}")
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    executor = ProcessPoolExecutor(max_workers=self.processes)
+                except Exception as e:
+                    logger.error(f"缩略图 worker 出错: {e}")
+                    time.sleep(self.poll_interval)
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+
+def _phash_job(image_path, size):
+    return ImageDBHelper.calculate_image_phash(image_path, size) if os.path.exists(image_path) else None
+
+
+def backfill_phash(upload_folder, thumbnail_size=(300, 300), processes=2, batch_size=200):
+    """为 phash 为空的图片补算感知哈希，按 id 分批读取，用进程池并行解码；文件不存在的跳过"""
+    last_id = 0
+    total_images = 0
+    total_updated = 0
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        while True:
+            with db_manager.session_scope() as session:
+                images = session.query(Image).options(joinedload(Image.image_type)) \
+                    .filter(Image.id > last_id, Image.phash.is_(None), Image.is_deleted == False) \
+                    .order_by(Image.id) \
+                    .limit(batch_size) \
+                    .all()
+                paths = [(image.id, os.path.join(upload_folder, image.folder_name, image.uuid_filename))
+                         for image in images]
+            if not images:
+                break
+            last_id = images[-1].id
+
+            futures = [(image_id, executor.submit(_phash_job, image_path, tuple(thumbnail_size)))
+                       for image_id, image_path in paths]
+            with db_manager.session_scope() as session:
+                for image_id, future in futures:
+                    try:
+                        phash = future.result()
+                    except Exception as e:
+                        logger.warning(f"计算感知哈希失败 image={image_id}: {e}")
+                        continue
+                    if phash:
+                        session.query(Image).filter_by(id=image_id).update({Image.phash: phash},
+                                                                           synchronize_session=False)
+                        total_updated += 1
+            total_images += len(images)
+            logger.info(f"感知哈希回填进度: {total_images} 张图片，补算 {total_updated} 个，last_id={last_id}")
+    # 各 worker 的相似图片索引在下次同步时回查到新的哈希
+    return total_images, total_updated
+
+
+def create_worker_from_config(config):
+    transcode_formats, transcode_quality = transcode_settings(config)
+    return ThumbnailWorker(
+        upload_folder=config['IMAGE_UPLOAD_FOLDER'],
+        thumbnail_size=config['THUMBNAIL_SIZE'],
+        processes=config['THUMBNAIL_WORKER_PROCESSES'],
+        poll_interval=config['THUMBNAIL_JOB_POLL_INTERVAL'],
+        max_attempts=config['THUMBNAIL_JOB_MAX_ATTEMPTS'],
+        transcode_formats=transcode_formats,
+        transcode_quality=transcode_quality,
+    )
+
+
+if __name__ == "__main__":
+    # 要在项目根目录下运行此脚本
+    from app import create_app
+    from app.blueprints.image_service import thumbnail_jobs
+
+    flask_app = create_app()
+    if sys.argv[1:] == ['backfill-phash']:
+        thumbnail_jobs.backfill_phash(
+            flask_app.config['IMAGE_UPLOAD_FOLDER'],
+            flask_app.config['THUMBNAIL_SIZE'],
+            processes=flask_app.config['THUMBNAIL_WORKER_PROCESSES'],
+        )
+    else:
+        thumbnail_jobs.create_worker_from_config(flask_app.config).run_forever()
@@ -0,0 +1,150 @@
+"""
+多尺寸缩略图变体的磁盘缓存
+变体在首次请求时按需生成，存放在 {cache_dir}/{w}x{h}/{filename}：
+- 同一个变体在多个线程/gunicorn worker 间通过文件锁单飞（single-flight），只生成一次；
+  锁文件是按 key 哈希分配的固定 LOCK_STRIPES 个，不随变体数增长（删除已 flock 的文件会让等待者锁住失效的 inode）
+- 缓存总大小有上限，超过时按最近访问时间（mtime，命中时刷新）淘汰最旧的变体
+"""
+import fcntl
+import hashlib
+import os
+import threading
+import time
+
+from PIL import Image as PILImage
+from loguru import logger
+
+
+class VariantCache:
+    TOUCH_INTERVAL = 60  # 秒，命中时刷新 mtime 的最小间隔，避免每次请求都写 inode
+    LOW_WATERMARK = 0.9  # 淘汰到上限的 90% 为止
+    LOCK_STRIPES = 256  # 锁文件个数，不同变体偶尔共用一个锁只会让它们串行生成
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock_dir = os.path.join(cache_dir, '.locks')
+        self._total_bytes = None  # 本进程估算的缓存大小，首次使用时扫描目录得到
+        self._evict_lock = threading.Lock()
+
+    def variant_path(self, width, height, filename):
+        return os.path.join(self.cache_dir, f"{width}x{height}", filename)
+
+    def get_or_create(self, width, height, filename, source_path):
+        """返回变体文件路径，不存在时由原图生成"""
+        path = self.variant_path(width, height, filename)
+        if self._hit(path):
+            return path
+
+        with self._single_flight(f"{width}x{height}/{filename}"):
+            # 拿到锁后再检查一次：其它线程/进程可能已经生成
+            if self._hit(path):
+                return path
+            size = self._generate(source_path, path, (width, height))
+
+        self._account(size)
+        return path
+
+    def _hit(self, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        if stat.st_mtime < time.time() - self.TOUCH_INTERVAL:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return True
+
+    def _single_flight(self, key):
+        os.makedirs(self.lock_dir, exist_ok=True)
+        stripe = int(hashlib.md5(key.encode('utf-8')).hexdigest(), 16) % self.LOCK_STRIPES
+        return _FileLock(os.path.join(self.lock_dir, f"{stripe:03d}.lock"))
+
+    @staticmethod
+    def _generate(source_path, path, size):
+        """生成变体：先写临时文件再原子替换，避免其它请求读到半个文件"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with PILImage.open(source_path) as img:
+                image_format = img.format
+                img.thumbnail(size, PILImage.Resampling.LANCZOS)
+                if image_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+                    img = img.convert('RGB')
+                img.save(temp_path, format=image_format, optimize=True, quality=85)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return os.path.getsize(path)
+
+    def _account(self, size):
+        with self._evict_lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(entry[2] for entry in self._scan())
+            else:
+                self._total_bytes += size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _scan(self):
+        """返回 [(mtime, path, size)]"""
+        entries = []
+        for size_dir in os.scandir(self.cache_dir):
+            if not size_dir.is_dir() or size_dir.name.startswith('.'):
+                continue
+            for entry in os.scandir(size_dir.path):
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.path, stat.st_size))
+        return entries
+
+    def _evict(self):
+        """按 mtime 从旧到新删除，直到低于水位线"""
+        entries = sorted(self._scan())
+        total = sum(size for _, _, size in entries)
+        target = self.max_bytes * self.LOW_WATERMARK
+        removed = 0
+        for _, path, size in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except FileNotFoundError:
+                pass
+        self._total_bytes = total
+        logger.info(f"缩略图变体缓存淘汰 {removed} 个文件，当前大小 {total} 字节")
+
+
+class _FileLock:
+    """基于 flock 的排它锁，对同一进程内的线程和不同进程都有效"""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def __enter__(self):
+        self._fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+
+_variant_caches = {}
+
+
+def get_variant_cache(config):
+    """每个进程按缓存目录复用同一个 VariantCache"""
+    cache_dir = config.get('THUMBNAIL_VARIANT_CACHE_DIR') or os.path.join(config['IMAGE_UPLOAD_FOLDER'], 'variants')
+    cache = _variant_caches.get(cache_dir)
+    if cache is None:
+        cache = _variant_caches.setdefault(cache_dir, VariantCache(cache_dir, config['THUMBNAIL_VARIANT_CACHE_MAX_BYTES']))
+    return cache
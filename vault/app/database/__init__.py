@@ -0,0 +1,11 @@
+from .registry import (
+    DatabaseManager,
+    after_commit,
+    database_url_from_env,
+    register_database,
+    get_database,
+    configure_pools,
+    register_database_settings,
+    reset_after_fork,
+    get_connection_stats,
+)
@@ -0,0 +1,93 @@
+"""
+SQL 语句计时
+替代 echo=True 把每条语句同步打印到标准输出的做法，通过 SQLAlchemy 的 before/after_cursor_execute 事件：
+- 按数据库和语句类型（SELECT / INSERT / ...）记录耗时直方图
+- 超过 DB_SLOW_QUERY_THRESHOLD 秒的语句计数，并记录一条日志，只包含参数的类型结构，不包含参数值
+- 统计每个 HTTP 请求执行的语句数和总耗时
+结果通过 /metrics 输出
+"""
+import time
+
+from flask import g, has_request_context, request
+from loguru import logger
+from prometheus_client import Counter, Histogram
+from sqlalchemy import event
+
+SLOW_QUERY_THRESHOLD = 0.2  # 秒，由 register_request_hooks 按配置覆盖
+STATEMENT_LOG_LENGTH = 500
+
+QUERY_DURATION = Histogram(
+    'db_query_duration_seconds', 'SQL 语句耗时', ['database', 'operation'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+SLOW_QUERIES = Counter('db_slow_queries_total', '超过阈值的 SQL 语句数', ['database', 'operation'])
+REQUEST_QUERIES = Histogram(
+    'db_queries_per_request', '每个请求执行的 SQL 语句数', ['endpoint'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+)
+REQUEST_QUERY_TIME = Histogram(
+    'db_query_seconds_per_request', '每个请求中 SQL 语句的总耗时', ['endpoint'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+
+
+def _operation(statement):
+    parts = statement.lstrip().split(None, 1)
+    return parts[0].upper() if parts else 'UNKNOWN'
+
+
+def param_shape(parameters):
+    """参数的类型结构，如 {'id_1': 'int'}；executemany 时为 '3 x {...}'"""
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return f"{len(parameters)} x {param_shape(parameters[0])}"
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+def instrument(engine, database):
+    """为 engine 注册计时事件，database 为指标中的数据库名"""
+
+    # 同一连接上同一时间只执行一条语句，开始时间只存一个值；语句出错时 after_cursor_execute 不会触发，
+    # 由 handle_error 清除，避免连接归还连接池后残留的值被下一条语句误用
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info['query_start_time'] = time.perf_counter()
+
+    @event.listens_for(engine, 'handle_error')
+    def _handle_error(exception_context):
+        if exception_context.connection is not None:
+            exception_context.connection.info.pop('query_start_time', None)
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started_at = conn.info.pop('query_start_time', None)
+        if started_at is None:
+            return
+        elapsed = time.perf_counter() - started_at
+        operation = _operation(statement)
+        QUERY_DURATION.labels(database, operation).observe(elapsed)
+
+        if elapsed >= SLOW_QUERY_THRESHOLD:
+            SLOW_QUERIES.labels(database, operation).inc()
+            logger.warning(f"慢查询 {elapsed * 1000:.1f}ms [{database}] {statement[:STATEMENT_LOG_LENGTH]} "
+                           f"参数: {param_shape(parameters)}")
+
+        if has_request_context():
+            g.db_query_count = g.get('db_query_count', 0) + 1
+            g.db_query_time = g.get('db_query_time', 0.0) + elapsed
+
+
+def _record_request(exception=None):
+    endpoint = request.endpoint or 'unknown'
+    REQUEST_QUERIES.labels(endpoint).observe(g.get('db_query_count', 0))
+    REQUEST_QUERY_TIME.labels(endpoint).observe(g.get('db_query_time', 0.0))
+
+
+def register_request_hooks(flask_app):
+    """按配置设置慢查询阈值，并在每个请求结束时记录语句数"""
+    global SLOW_QUERY_THRESHOLD
+    SLOW_QUERY_THRESHOLD = flask_app.config['DB_SLOW_QUERY_THRESHOLD']
+    flask_app.teardown_request(_record_request)
@@ -0,0 +1,330 @@
+"""
+数据库连接统一管理
+各蓝图在导入时通过 register_database 登记自己的数据库，得到一个 DatabaseManager：
+- engine 在第一次使用时才创建。gunicorn preload_app 时 master 只登记连接串，不建立连接，
+  fork 之后由每个 worker 自己创建连接池；进程号变化（fork 出的子进程）时也会重新创建，不与父进程共用连接
+- 连接池大小由全局连接预算 DB_CONNECTION_BUDGET 按 worker 数和数据库数平分，
+  worker 数由 gunicorn 的 post_fork 钩子通过 configure_pools 传入
+- 是否打印 SQL 由配置 SQLALCHEMY_ECHO 决定（默认关闭），语句耗时由 instrumentation 记录到 /metrics
+- HTTP 请求内每个数据库只使用一个会话和一个事务，第一次 session_scope 时才创建，
+  请求中查询出的对象一直关联在该会话上，可以继续访问关系属性。嵌套的 session_scope 是保存点：
+  出错时只回滚保存点，之前加载的对象不会失效。请求正常结束时在 after_request 中提交（提交失败返回 500），
+  teardown_appcontext 回滚未提交的部分并关闭会话归还连接。
+  请求之外（后台线程、命令行脚本，包括在应用上下文中运行的批量导入和回填）仍是线程会话，
+  每个 session_scope 退出时提交并移除，按批提交的任务中断后已提交的批次不会丢失
+- 进程内的索引和缓存（布隆过滤器、相似图片索引、元数据缓存）用 after_commit 登记，
+  事务真正提交之后才更新，提交失败或回滚时丢弃，不会留下数据库中不存在的记录
+- get_connection_stats 汇总所有数据库的连接池状态
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+from flask import g, has_request_context
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool
+
+from loguru import logger
+
+from . import instrumentation
+
+# 所有 worker、所有数据库合计最多占用的连接数，需小于 MariaDB 的 max_connections 并为其它客户端留出余量
+CONNECTION_BUDGET = int(os.getenv('DB_CONNECTION_BUDGET', 200))
+# 每个连接池常驻的连接数上限，预算中超出的部分作为 max_overflow
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+
+_databases = {}
+AFTER_COMMIT_KEY = 'after_commit'
+_workers = int(os.getenv('WEB_CONCURRENCY', 1))
+_echo = False
+
+
+class DatabaseManager:
+    def __init__(self, name, connection_url):
+        self.name = name
+        self.connection_url = connection_url
+        self._engine = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+        # 线程安全的会话，engine 创建后再绑定
+        self.session_factory = sessionmaker(
+            autocommit=False,
+            autoflush=False,
+            expire_on_commit=False
+        )
+        self.ScopedSession = scoped_session(self.session_factory)
+        event.listen(self.session_factory, 'after_commit', _run_after_commit)
+        event.listen(self.session_factory, 'after_rollback', _discard_after_commit)
+
+    @property
+    def engine(self):
+        if self._engine is None or self._pid != os.getpid():
+            with self._lock:
+                if self._engine is None or self._pid != os.getpid():
+                    self._create_engine()
+        return self._engine
+
+    def _create_engine(self):
+        if self._engine is not None:
+            # 从父进程继承的连接池：丢弃但不关闭，连接仍由父进程使用
+            self._engine.dispose(close=False)
+
+        pool_size, max_overflow = pool_limits()
+        options = {}
+        if make_url(self.connection_url).get_backend_name() == 'mysql':
+            # 连接参数
+            options['connect_args'] = {
+                'connect_timeout': 10,
+                'read_timeout': 60,
+                'write_timeout': 60,
+                'charset': 'utf8mb4'
+            }
+        self._engine = create_engine(
+            self.connection_url,
+            # 连接池配置
+            poolclass=QueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_pre_ping=True,
+            pool_recycle=3600,
+
+            # 同步打印每条语句的开销很大，只在调试时打开
+            echo=_echo,
+            echo_pool=_echo,
+            **options
+        )
+        instrumentation.instrument(self._engine, self.name)
+        self._pid = os.getpid()
+        self.session_factory.configure(bind=self._engine)
+        logger.info(f"数据库 {self.name} 创建连接池 (pid={self._pid}): pool_size={pool_size}, max_overflow={max_overflow}")
+
+    def reset(self):
+        """丢弃连接池，下次使用时重新创建；继承自父进程的连接不关闭，仍由父进程使用"""
+        with self._lock:
+            if self._engine is not None:
+                self._engine.dispose(close=self._pid == os.getpid())
+            self._engine = None
+            self._pid = None
+
+    @property
+    def _request_key(self):
+        return f'db_session_{self.name}'
+
+    def request_session(self):
+        """当前请求的会话，第一次调用时创建，由 after_request 提交、teardown_appcontext 关闭"""
+        session = g.get(self._request_key)
+        if session is None:
+            self.engine  # 确保当前进程的 engine 已创建并绑定
+            session = self.session_factory()
+            setattr(g, self._request_key, session)
+        return session
+
+    def commit_request_session(self):
+        session = g.get(self._request_key)
+        if session is None:
+            return
+        try:
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+    def close_request_session(self, exception=None):
+        session = g.pop(self._request_key, None)
+        if session is None:
+            return
+        try:
+            # 正常结束的请求已在 after_request 中提交，这里只剩出错时未提交的部分
+            session.rollback()
+        finally:
+            session.close()
+
+    @contextmanager
+    def _request_scope(self):
+        session = self.request_session()
+        if session.in_transaction() or len(session.identity_map):
+            transaction = session.begin_nested()
+        else:
+            # 请求中第一次使用，回滚整个事务不会让任何已加载的对象失效，省掉保存点的两次往返
+            transaction = session.begin()
+        callbacks = session.info.setdefault(AFTER_COMMIT_KEY, [])
+        registered = len(callbacks)
+        try:
+            yield session
+            if _still_open(session, transaction):
+                # 约束错误在 scope 内抛出，与线程会话退出时提交的行为一致
+                session.flush()
+        except Exception:
+            # flush 失败后事务处于失效状态，同样需要回滚；回滚到保存点时丢弃这段时间登记的回调
+            if _still_open(session, transaction):
+                transaction.rollback()
+                del callbacks[registered:]
+            raise
+        # 外层事务留到请求结束时提交；代码中显式调用 session.commit() / rollback() 时事务已结束
+        if transaction.nested and _still_open(session, transaction):
+            transaction.commit()
+
+    @contextmanager
+    def session_scope(self):
+        """
+        提供事务范围的会话上下文
+        HTTP 请求内使用请求会话：正常退出时释放保存点，异常时回滚到保存点，提交留到请求结束；
+        否则使用线程会话，正常退出时提交、异常时回滚，然后移除
+        """
+        if has_request_context():
+            with self._request_scope() as session:
+                yield session
+            return
+
+        self.engine  # 确保当前进程的 engine 已创建并绑定
+        session = self.ScopedSession()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            self.ScopedSession.remove()
+
+    def get_connection_stats(self):
+        """获取连接池详细状态，当前进程还没有创建连接池时返回 None"""
+        if self._engine is None or self._pid != os.getpid():
+            return None
+        pool = self._engine.pool
+
+        status = {
+            "pool_class": type(pool).__name__,
+            "pool_size": pool.size(),  # 连接池配置大小
+            "checked_out": pool.checkedout(),  # 已签出的连接数
+            "available": pool.size() - pool.checkedout(),  # 可用连接数
+            "overflow": pool.overflow(),  # 当前溢出连接数
+            "max_overflow": pool._max_overflow,  # 最大溢出数
+            "total_connections": pool.size() + pool.overflow(),  # 总连接数
+        }
+
+        return status
+
+
+def after_commit(session, callback):
+    """
+    session 的事务提交成功后执行 callback（更新进程内的索引和缓存），回滚时丢弃
+    请求会话中即请求结束、after_request 提交之后；回调出错只记录日志，不影响已提交的数据
+    """
+    session.info.setdefault(AFTER_COMMIT_KEY, []).append(callback)
+
+
+def _run_after_commit(session):
+    if session.in_nested_transaction():
+        return  # 释放保存点，外层事务还没有提交
+    callbacks = session.info.pop(AFTER_COMMIT_KEY, None)
+    for callback in callbacks or ():
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"事务提交后的回调执行失败: {e}")
+
+
+def _discard_after_commit(session):
+    # 保存点回滚由 _request_scope 截断，这里只处理整个事务的回滚
+    if not session.in_nested_transaction():
+        session.info.pop(AFTER_COMMIT_KEY, None)
+
+
+def _still_open(session, transaction):
+    """transaction 仍是会话当前的（保存点）事务，没有被显式的 commit / rollback 结束"""
+    current = session.get_nested_transaction() if transaction.nested else session.get_transaction()
+    return current is transaction
+
+
+def database_url_from_env(database_env, default_database):
+    """按 DB_USER / DB_PASSWORD / DB_HOST / DB_PORT 和指定的库名环境变量拼接 MariaDB 连接串"""
+    db_config = {
+        'username': os.getenv('DB_USER', 'root'),
+        'password': os.getenv('DB_PASSWORD', ''),
+        'host': os.getenv('DB_HOST', 'localhost'),
+        'port': os.getenv('DB_PORT', '3306'),
+        'database': os.getenv(database_env, default_database)
+    }
+    return (
+        f"mysql+pymysql://{db_config['username']}:{db_config['password']}"
+        f"@{db_config['host']}:{db_config['port']}/{db_config['database']}"
+    )
+
+
+def register_database(name, connection_url):
+    """登记一个数据库，同名的重复登记返回已有的 DatabaseManager"""
+    manager = _databases.get(name)
+    if manager is None:
+        logger.info(f"登记数据库 {name}: {make_url(connection_url).render_as_string(hide_password=True)}")
+        manager = _databases.setdefault(name, DatabaseManager(name, connection_url))
+    return manager
+
+
+def get_database(name):
+    return _databases[name]
+
+
+def pool_limits():
+    """
+    每个连接池的 (pool_size, max_overflow)：预算按 worker 数 × 数据库数平分，
+    其中最多 POOL_SIZE 个常驻，其余作为溢出连接；每个池至少 2 个连接
+    """
+    per_pool = max(CONNECTION_BUDGET // (max(_workers, 1) * max(len(_databases), 1)), 2)
+    pool_size = min(POOL_SIZE, per_pool)
+    return pool_size, per_pool - pool_size
+
+
+def configure_pools(workers):
+    """设置共享连接预算的进程数，只影响之后创建的连接池"""
+    global _workers
+    _workers = workers
+
+
+def _commit_request_sessions(response):
+    for manager in _databases.values():
+        manager.commit_request_session()
+    return response
+
+
+def _close_request_sessions(exception=None):
+    for manager in _databases.values():
+        manager.close_request_session(exception)
+
+
+def register_database_settings(flask_app):
+    """按应用配置设置 SQL 日志和语句计时并注册请求会话的提交和清理，需在第一次使用数据库之前调用"""
+    global _echo
+    _echo = flask_app.config['SQLALCHEMY_ECHO']
+    instrumentation.register_request_hooks(flask_app)
+    flask_app.after_request(_commit_request_sessions)
+    flask_app.teardown_appcontext(_close_request_sessions)
+
+
+def reset_after_fork(workers=None):
+    """
+    在 gunicorn 的 post_fork 钩子中调用：丢弃从 master 继承的连接池（不关闭 master 的连接），
+    当前 worker 在第一次使用时按新的预算创建自己的连接池
+    """
+    if workers is not None:
+        configure_pools(workers)
+    for manager in _databases.values():
+        manager.reset()
+
+
+def get_connection_stats():
+    """当前进程所有数据库的连接池状态及合计"""
+    databases = {name: manager.get_connection_stats() for name, manager in _databases.items()}
+    active = [stats for stats in databases.values() if stats]
+    return {
+        "pid": os.getpid(),
+        "workers": _workers,
+        "connection_budget": CONNECTION_BUDGET,
+        "databases": databases,
+        "checked_out": sum(stats["checked_out"] for stats in active),
+        "total_connections": sum(stats["total_connections"] for stats in active),
+        "max_connections": sum(stats["pool_size"] + stats["max_overflow"] for stats in active),
+    }
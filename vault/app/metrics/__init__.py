@@ -0,0 +1 @@
+from .request_metrics import register_metrics, update_pool_gauges, collect_metrics
@@ -0,0 +1,102 @@
+"""
+HTTP 请求指标
+按蓝图和 endpoint 记录请求数、耗时直方图、处理中的请求数、响应大小，以及各数据库连接池的状态，由 /metrics 输出。
+
+gunicorn 预先 fork 多个 worker，每个 worker 只能看到自己的指标：设置了 PROMETHEUS_MULTIPROC_DIR 时
+（gunicorn.config.py 中设置），prometheus_client 把每个 worker 的指标写入该目录下各自的 mmap 文件，
+/metrics 抓取时合并目录中的所有文件；worker 退出时由 child_exit 钩子清理它的 gauge。
+未设置时（开发服务器、命令行脚本）只输出当前进程的指标。
+"""
+import os
+import time
+
+from flask import Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+
+from ..database import get_connection_stats
+
+REQUESTS = Counter('http_requests_total', '请求数', ['blueprint', 'endpoint', 'method', 'status'])
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', '请求耗时', ['blueprint', 'endpoint', 'method'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+REQUESTS_IN_PROGRESS = Gauge('http_requests_in_progress', '处理中的请求数', ['blueprint', 'endpoint'],
+                             multiprocess_mode='livesum')
+RESPONSE_SIZE = Histogram(
+    'http_response_size_bytes', '响应体大小（流式响应不计）', ['blueprint', 'endpoint'],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+)
+DB_POOL_CHECKED_OUT = Gauge('db_pool_checked_out', '已签出的连接数', ['database'], multiprocess_mode='livesum')
+DB_POOL_CONNECTIONS = Gauge('db_pool_connections', '连接池中的连接数', ['database'], multiprocess_mode='livesum')
+DB_POOL_MAX_CONNECTIONS = Gauge('db_pool_max_connections', '连接池允许的最大连接数', ['database'],
+                                multiprocess_mode='livesum')
+
+
+def _labels():
+    """(blueprint, endpoint)，没有匹配到路由的请求归为 unmatched"""
+    return request.blueprint or 'app', request.endpoint or 'unmatched'
+
+
+def _before_request():
+    g.metrics_started_at = time.perf_counter()
+    g.metrics_labels = _labels()
+    REQUESTS_IN_PROGRESS.labels(*g.metrics_labels).inc()
+
+
+def _after_request(response):
+    g.metrics_status = response.status_code
+    if not response.is_streamed and response.content_length is not None:
+        RESPONSE_SIZE.labels(*g.metrics_labels).observe(response.content_length)
+    return response
+
+
+def _teardown_request(exception=None):
+    started_at = g.get('metrics_started_at')
+    if started_at is None:
+        return  # before_request 之前就失败的请求
+    blueprint, endpoint = g.metrics_labels
+    status = g.get('metrics_status', 500)
+    REQUESTS_IN_PROGRESS.labels(blueprint, endpoint).dec()
+    REQUEST_DURATION.labels(blueprint, endpoint, request.method).observe(time.perf_counter() - started_at)
+    REQUESTS.labels(blueprint, endpoint, request.method, str(status)).inc()
+    update_pool_gauges()
+
+
+def update_pool_gauges():
+    """把当前 worker 的连接池状态写入 gauge，多进程时按存活的 worker 求和"""
+    for name, stats in get_connection_stats()['databases'].items():
+        if not stats:
+            continue
+        DB_POOL_CHECKED_OUT.labels(name).set(stats['checked_out'])
+        DB_POOL_CONNECTIONS.labels(name).set(stats['total_connections'])
+        DB_POOL_MAX_CONNECTIONS.labels(name).set(stats['pool_size'] + stats['max_overflow'])
+
+
+def collect_metrics():
+    """Prometheus 文本格式的指标，多进程模式下合并所有 worker"""
+    update_pool_gauges()
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def register_metrics(flask_app):
+    """注册请求计时钩子和 /metrics"""
+    flask_app.before_request(_before_request)
+    flask_app.after_request(_after_request)
+    flask_app.teardown_request(_teardown_request)
+
+    @flask_app.get("/metrics")
+    def metrics():
+        return Response(collect_metrics(), mimetype=CONTENT_TYPE_LATEST)
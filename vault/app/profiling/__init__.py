@@ -0,0 +1,2 @@
+from .sampler import SamplingProfiler
+from .request_profiler import register_profiling, list_profiles
@@ -0,0 +1,156 @@
+"""
+按请求的采样分析，需开启 PROFILING_ENABLED，关闭时不注册任何钩子
+- 请求头 X-Profile 的值等于 PROFILING_TOKEN，或按 PROFILING_SAMPLE_RATE 随机抽中时，该请求在采样分析器下处理
+- 结果按 endpoint 分目录写入 PROFILING_DIR/{endpoint}/：.collapsed 为调用栈，同名 .json 记录路径、状态码、耗时等，
+  超过 PROFILING_MAX_FILES 时删除最旧的
+- GET /admin/profiles 按耗时从高到低列出已采集的请求（可按 endpoint 过滤），
+  GET /admin/profiles/<endpoint>/<name> 下载 collapsed 文件，两者都需要在 X-Profile 头中携带 PROFILING_TOKEN
+"""
+import glob
+import hmac
+import json
+import os
+import random
+import time
+import uuid
+from datetime import datetime
+
+from flask import current_app, g, request, send_file
+from loguru import logger
+from werkzeug.utils import secure_filename
+
+from ..response import ApiResponse, AuthorizationException, ResourceNotFoundException
+from ..utils import get_param
+from .sampler import SamplingProfiler
+
+PROFILE_HEADER = 'X-Profile'
+COLLAPSED_SUFFIX = '.collapsed'
+META_SUFFIX = '.json'
+# 不采样的 endpoint
+SKIPPED_ENDPOINTS = {'metrics', 'list_profiles_view', 'download_profile', 'static'}
+
+
+def _token_matches(config):
+    token = config['PROFILING_TOKEN']
+    return bool(token) and hmac.compare_digest(request.headers.get(PROFILE_HEADER, ''), token)
+
+
+def _should_profile(config):
+    if request.endpoint in SKIPPED_ENDPOINTS:
+        return False
+    if _token_matches(config):
+        return True
+    rate = config['PROFILING_SAMPLE_RATE']
+    return rate > 0 and random.random() < rate
+
+
+def _before_request():
+    if not _should_profile(current_app.config):
+        return
+    g.profiler = SamplingProfiler(interval=current_app.config['PROFILING_INTERVAL']).start()
+    g.profile_started_at = time.perf_counter()
+
+
+def _after_request(response):
+    if 'profiler' in g:
+        g.profile_status = response.status_code
+    return response
+
+
+def _teardown_request(exception=None):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return
+    duration = time.perf_counter() - g.profile_started_at
+    profiler.stop()
+    meta = {
+        'endpoint': request.endpoint or 'unmatched',
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'status': g.get('profile_status', 500),
+        'duration_ms': round(duration * 1000, 2),
+        'samples': profiler.samples,
+        'pid': os.getpid(),
+        'captured_at': datetime.now().isoformat(timespec='seconds'),
+    }
+    try:
+        save_profile(current_app.config, meta, profiler.collapsed())
+    except OSError as e:
+        logger.warning(f"保存请求分析结果失败: {e}")
+
+
+def save_profile(config, meta, collapsed):
+    """写入 {endpoint}/{时间}-{耗时}ms-{随机串}.collapsed 和同名 .json"""
+    endpoint_dir = os.path.join(config['PROFILING_DIR'], secure_filename(meta['endpoint']))
+    os.makedirs(endpoint_dir, exist_ok=True)
+    name = f"{datetime.now():%Y%m%d-%H%M%S}-{int(meta['duration_ms'])}ms-{uuid.uuid4().hex[:8]}"
+    base = os.path.join(endpoint_dir, name)
+    with open(base + COLLAPSED_SUFFIX, 'w', encoding='utf-8') as f:
+        f.write(collapsed)
+    with open(base + META_SUFFIX, 'w', encoding='utf-8') as f:
+        json.dump(dict(meta, name=name), f, ensure_ascii=False)
+    _prune(config['PROFILING_DIR'], config['PROFILING_MAX_FILES'])
+
+
+def _meta_files(directory):
+    return glob.glob(os.path.join(directory, '*', '*' + META_SUFFIX))
+
+
+def _prune(directory, max_files):
+    """只保留最新的 max_files 个结果"""
+    files = _meta_files(directory)
+    if len(files) <= max_files:
+        return
+    files.sort(key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0)
+    for path in files[:len(files) - max_files]:
+        for suffix_path in (path, path[:-len(META_SUFFIX)] + COLLAPSED_SUFFIX):
+            try:
+                os.remove(suffix_path)
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles(directory, limit=20, endpoint=None):
+    """按耗时从高到低排列的已采集请求"""
+    profiles = []
+    for path in _meta_files(directory):
+        try:
+            with open(path, encoding='utf-8') as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # 正在写入或已被清理
+    if endpoint:
+        profiles = [meta for meta in profiles if meta.get('endpoint') == endpoint]
+    profiles.sort(key=lambda meta: meta.get('duration_ms', 0), reverse=True)
+    return profiles[:limit]
+
+
+def _require_token():
+    if not _token_matches(current_app.config):
+        raise AuthorizationException(message=f"需要在 {PROFILE_HEADER} 请求头中提供分析令牌")
+
+
+def register_profiling(flask_app):
+    """PROFILING_ENABLED 时注册采样钩子和 /admin/profiles"""
+    if not flask_app.config.get('PROFILING_ENABLED'):
+        return
+    flask_app.before_request(_before_request)
+    flask_app.after_request(_after_request)
+    flask_app.teardown_request(_teardown_request)
+
+    @flask_app.get("/admin/profiles")
+    def list_profiles_view():
+        _require_token()
+        limit = min(get_param('limit', 20, int), 200)
+        profiles = list_profiles(current_app.config['PROFILING_DIR'], limit, request.args.get('endpoint'))
+        return ApiResponse.success(data=profiles)
+
+    @flask_app.get("/admin/profiles/<endpoint>/<name>")
+    def download_profile(endpoint, name):
+        _require_token()
+        path = os.path.join(current_app.config['PROFILING_DIR'], secure_filename(endpoint),
+                            secure_filename(name) + COLLAPSED_SUFFIX)
+        if not os.path.isfile(path):
+            raise ResourceNotFoundException(resource_type="分析结果", resource_id=name)
+        return send_file(path, mimetype='text/plain', as_attachment=True,
+                         download_name=f"{secure_filename(endpoint)}-{secure_filename(name)}{COLLAPSED_SUFFIX}")
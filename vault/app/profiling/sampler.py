@@ -0,0 +1,63 @@
+"""
+统计采样分析器
+后台线程按固定间隔读取目标线程当前的调用栈（sys._current_frames），按栈计数，
+结果为 collapsed stack 格式（"调用者;被调用者 次数"），可直接导入 speedscope 或用 flamegraph.pl 生成火焰图。
+目标线程本身不做任何插桩，开销只在采样线程。
+开始采样之后新建的线程（如请求中创建的线程池）也一并采样，调用栈以 [线程名] 开头。
+"""
+import os
+import sys
+import threading
+from collections import Counter
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    def __init__(self, thread_id=None, interval=0.005):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stopped = threading.Event()
+        self._thread = None
+        self._existing = set()
+
+    def start(self):
+        self._existing = set(sys._current_frames())
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return self
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            names = None
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (thread_id != self.thread_id and thread_id in self._existing):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.reverse()
+                if thread_id != self.thread_id:
+                    if names is None:
+                        names = {thread.ident: thread.name for thread in threading.enumerate()}
+                    stack.insert(0, f"[{names.get(thread_id, thread_id)}]")
+                self.stacks[';'.join(stack)] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        """collapsed stack 文本，按次数从多到少排列"""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
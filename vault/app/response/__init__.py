@@ -1,4 +1,4 @@
 from .error_handlers import register_global_error_handlers
-from .exceptions import ValidationException, AuthenticationException, AuthorizationException, ResourceNotFoundException, BusinessRuleException
+from .exceptions import ValidationException, AuthenticationException, AuthorizationException, ResourceNotFoundException, BusinessRuleException, ConflictException
 from .error_codes import ErrorCodes
 from .api_response import ApiResponse
\ No newline at end of file
@@ -71,4 +71,16 @@ class BusinessRuleException(APIException):
             message=message,
             details=details,
             http_code=422
-        )
\ No newline at end of file
+        )
+
+
+class ConflictException(APIException):
+    """资源状态冲突异常（如同一资源正在被另一个请求处理）"""
+
+    def __init__(self, error_code=ErrorCodes.RESOURCE_CONFLICT, message=None, details=None):
+        super().__init__(
+            error_code=error_code,
+            message=message,
+            details=details,
+            http_code=409
+        )
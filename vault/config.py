@@ -37,6 +37,10 @@ class BaseConfig:
                                 f"@{DB_HOST}:{DB_PORT}/{DB_DATABASE}"
                             )
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # 打印每条 SQL 语句及连接池事件（同步写标准输出，只在调试时打开）
+    SQLALCHEMY_ECHO = env_bool("SQLALCHEMY_ECHO", default=False)
+    # 超过该耗时（秒）的语句计入慢查询并记录日志，语句耗时统计见 /metrics
+    DB_SLOW_QUERY_THRESHOLD = float(os.getenv("DB_SLOW_QUERY_THRESHOLD", 0.2))
 
     # 目录相关
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -52,6 +56,51 @@ class BaseConfig:
     # 图片服务配置
     IMAGE_URL_PREFIX = '/image'
     THUMBNAIL_SIZE = (300, 300)
+    # 图片发送方式：direct 由 Flask 发送文件；x-accel 返回 X-Accel-Redirect，由 nginx 的 internal location 发送
+    IMAGE_SERVE_MODE = os.getenv("IMAGE_SERVE_MODE", "direct")
+    IMAGE_ACCEL_PREFIX = os.getenv("IMAGE_ACCEL_PREFIX", "/_protected/image/")
+    # 缩略图异步生成：上传只保存原图并排队，由 thumbnail_jobs worker 生成缩略图
+    # 默认关闭（上传时同步生成），只有同时运行了 worker 的部署才打开（见 docker-compose.yml）
+    THUMBNAIL_ASYNC = env_bool("THUMBNAIL_ASYNC", default=False)
+    THUMBNAIL_WORKER_PROCESSES = int(os.getenv("THUMBNAIL_WORKER_PROCESSES", 2))
+    THUMBNAIL_JOB_MAX_ATTEMPTS = 5
+    THUMBNAIL_JOB_POLL_INTERVAL = 2  # 秒
+    # 多尺寸缩略图变体：只允许白名单内的尺寸，首次请求时生成并放入有大小上限的磁盘缓存
+    THUMBNAIL_VARIANT_SIZES = [(150, 150), (300, 300), (600, 600), (1200, 1200)]
+    THUMBNAIL_VARIANT_CACHE_DIR = os.getenv("THUMBNAIL_VARIANT_CACHE_DIR")  # 默认 IMAGE_UPLOAD_FOLDER/variants
+    THUMBNAIL_VARIANT_CACHE_MAX_BYTES = int(os.getenv("THUMBNAIL_VARIANT_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+    # 为原图和缩略图生成 WebP/AVIF 兄弟文件，按 Accept 头协商返回
+    IMAGE_TRANSCODE_ENABLED = env_bool("IMAGE_TRANSCODE_ENABLED", default=True)
+    IMAGE_TRANSCODE_FORMATS = ['avif', 'webp']
+    IMAGE_TRANSCODE_QUALITY = {'avif': 60, 'webp': 80}
+    # 近似重复检测：感知哈希汉明距离阈值（64 位 dHash）
+    NEAR_DUPLICATE_DISTANCE = 6
+    SIMILAR_IMAGES_MAX_DISTANCE = 16
+    # 批量信息接口（/image/batch/info、/image/batch/resolve）单次最多查询的数量
+    IMAGE_BATCH_MAX_ITEMS = 1000
+    # 分块上传（/image/uploads）：单个文件的上限、每块的上限（需小于 MAX_CONTENT_LENGTH 和 nginx client_max_body_size）
+    # 以及会话在最后一次写入后保留的时间（秒）
+    # 分块落在没有哈希状态的 worker 上时要读取已接收的部分补算哈希，上限需保证这次读取远小于 gunicorn 的 30 秒超时
+    CHUNKED_UPLOAD_MAX_SIZE = int(os.getenv("CHUNKED_UPLOAD_MAX_SIZE", 256 * 1024 * 1024))
+    CHUNKED_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+    CHUNKED_UPLOAD_SESSION_TTL = int(os.getenv("CHUNKED_UPLOAD_SESSION_TTL", 24 * 3600))
+    # 存储清理（storage_gc）：软删除超过保留天数的图片被物理删除，按批处理，每批之间暂停以免占满磁盘 IO
+    STORAGE_GC_RETENTION_DAYS = int(os.getenv("STORAGE_GC_RETENTION_DAYS", 30))
+    STORAGE_GC_BATCH_SIZE = 200
+    STORAGE_GC_BATCH_INTERVAL = float(os.getenv("STORAGE_GC_BATCH_INTERVAL", 1.0))  # 秒
+    # 没有记录的文件、遗留的临时文件在修改时间超过这些秒数后才会被删除（上传时先落盘再写记录）
+    STORAGE_GC_ORPHAN_MIN_AGE = 24 * 3600
+    STORAGE_GC_TEMP_MAX_AGE = 6 * 3600
+    # 多文件上传时并发处理的线程数
+    UPLOAD_BATCH_WORKERS = int(os.getenv("UPLOAD_BATCH_WORKERS", 4))
+    # 请求采样分析（默认关闭）：X-Profile 请求头等于 PROFILING_TOKEN，或按 PROFILING_SAMPLE_RATE 抽中的请求
+    # 在采样分析器下处理，调用栈写入 PROFILING_DIR，GET /admin/profiles 列出最慢的请求
+    PROFILING_ENABLED = env_bool("PROFILING_ENABLED", default=False)
+    PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")
+    PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", 0))
+    PROFILING_INTERVAL = 0.005  # 秒，采样间隔
+    PROFILING_DIR = os.getenv("PROFILING_DIR", os.path.join(BASE_DIR, 'shared_data/profiles'))
+    PROFILING_MAX_FILES = 1000
 
 class DevelopmentConfig(BaseConfig):
     DEBUG = True
@@ -1,5 +1,15 @@
 import multiprocessing
 import os
+import shutil
+
+# Metrics
+# 每个 worker 把指标写入该目录下自己的 mmap 文件，/metrics 抓取时合并；必须在导入 prometheus_client 之前设置。
+# 只在第一次加载配置时清空上次运行遗留的文件（HUP 重新加载配置时 worker 的文件仍在使用）
+prometheus_multiproc_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus_multiproc')
+if not os.environ.get('PROMETHEUS_MULTIPROC_DIR_READY'):
+    shutil.rmtree(prometheus_multiproc_dir, ignore_errors=True)
+    os.makedirs(prometheus_multiproc_dir, exist_ok=True)
+    os.environ['PROMETHEUS_MULTIPROC_DIR_READY'] = '1'
 
 # Server socket
 bind = f"0.0.0.0:{os.environ.get('PORT', 9090)}"
@@ -35,4 +45,17 @@ tmp_upload_dir = None
 
 # SSL
 keyfile = None
-certfile = None
\ No newline at end of file
+certfile = None
+
+
+# Server hooks
+def post_fork(server, worker):
+    # preload_app 时 master 中只登记了数据库，每个 worker 按连接预算创建自己的连接池
+    from app.database import reset_after_fork
+    reset_after_fork(workers=server.cfg.workers)
+
+
+def child_exit(server, worker):
+    # 退出的 worker 不再计入 livesum 类型的 gauge
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,91 @@
+"""
+测试夹具
+图片服务的测试不依赖 MariaDB：每个测试使用临时目录中的一个新 SQLite 库和新的上传目录，
+并重置进程内的索引和缓存（布隆过滤器、相似图片索引、类型缓存等），测试之间互不影响。
+
+运行（在项目根目录下）:
+    python -m pytest -q
+"""
+import os
+import sqlite3
+
+import pytest
+from loguru import logger
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# config 模块导入时会检查生产环境的配置，测试中提供占位值（数据库连接由 image_db 夹具替换）
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('SECRET_KEY', 'test-secret-key')
+
+from app import create_app
+from app.blueprints.image_service import chunked_upload
+from app.blueprints.image_service.content_index import content_index
+from app.blueprints.image_service.image_cache import image_meta_cache
+from app.blueprints.image_service.image_db import db_manager, ImageType
+from app.blueprints.image_service.image_db_helper import ImageDBHelper
+from app.blueprints.image_service.image_db_initializer import init_db, IMAGE_TYPES
+from app.blueprints.image_service.image_type_registry import image_type_registry, bump_version
+from app.blueprints.image_service.similarity_index import similarity_index
+from config import TestingConfig
+
+
+@event.listens_for(Engine, 'connect')
+def _sqlite_connect(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        # pysqlite 默认到第一条写语句才 BEGIN，SAVEPOINT 会自己开启事务并在 RELEASE 时提交，
+        # 关闭它的事务管理，由下面的 begin 事件显式 BEGIN，事务和保存点的行为与 MariaDB 一致
+        dbapi_connection.isolation_level = None
+
+
+@event.listens_for(Engine, 'begin')
+def _sqlite_begin(connection):
+    if connection.dialect.name == 'sqlite':
+        connection.exec_driver_sql('BEGIN')
+
+
+@pytest.fixture(scope='session')
+def app():
+    logger.remove()
+    flask_app = create_app(TestingConfig)
+    flask_app.config['TESTING'] = True
+    return flask_app
+
+
+def _reset_process_state():
+    """进程内的索引和缓存按 worker 保存，换库后重新加载"""
+    content_index.__init__()
+    similarity_index.__init__()
+    image_type_registry.__init__()
+    image_meta_cache.clear()
+    ImageDBHelper._count_cache.clear()
+    chunked_upload._hashers.clear()
+
+
+@pytest.fixture(autouse=True)
+def image_db(app, tmp_path, monkeypatch):
+    """新的 SQLite 库和上传目录，建表并写入图片类型"""
+    upload_folder = tmp_path / 'images'
+    upload_folder.mkdir()
+    monkeypatch.setitem(app.config, 'IMAGE_UPLOAD_FOLDER', str(upload_folder))
+    monkeypatch.setattr(db_manager, 'connection_url', f"sqlite:///{tmp_path / 'image.db'}")
+    db_manager.reset()
+    _reset_process_state()
+
+    with app.app_context():
+        init_db()
+        with db_manager.session_scope() as session:
+            # IMAGE_TYPES 中的对象只能写入一次，每个库写入一份副本
+            for image_type in IMAGE_TYPES:
+                session.add(ImageType(type_id=image_type.type_id, type_name=image_type.type_name,
+                                      description=image_type.description))
+                (upload_folder / f"{image_type.type_id}_{image_type.type_name}").mkdir()
+            bump_version(session)
+        image_type_registry.reload()
+    yield upload_folder
+    db_manager.reset()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
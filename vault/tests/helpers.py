@@ -0,0 +1,21 @@
+"""测试用的图片和上传辅助函数"""
+import io
+
+from PIL import Image as PILImage
+
+TEST_TYPE_ID = 22
+
+
+def png_bytes(width=64, height=48, color=(200, 10, 10)):
+    """内存中的 PNG 图片（BytesIO），颜色不同内容即不同"""
+    buffer = io.BytesIO()
+    PILImage.new('RGB', (width, height), color).save(buffer, 'PNG')
+    buffer.seek(0)
+    return buffer
+
+
+def upload_image(client, file_object, filename='test.png', type_id=TEST_TYPE_ID, **fields):
+    """通过 /image/upload 上传一张图片，返回响应的 json"""
+    response = client.post('/image/upload', data={'type_id': str(type_id), 'file': (file_object, filename), **fields},
+                           content_type='multipart/form-data')
+    return response.get_json()
@@ -0,0 +1,63 @@
+"""批量元数据接口：按请求顺序返回，缺失或已删除为 null，一次 IN 查询，参数校验"""
+import pytest
+from sqlalchemy import event
+
+from app.blueprints.image_service.image_db import db_manager
+
+from .helpers import png_bytes, upload_image
+
+
+@pytest.fixture
+def images(client):
+    images = [upload_image(client, png_bytes(50 + index, 20), f"batch{index}.png")['data'] for index in range(3)]
+    client.delete(f"/image/{images[1]['id']}")
+    return images
+
+
+def test_batch_info_keeps_request_order_in_one_query(client, images):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('SELECT'):
+            statements.append(statement)
+
+    ids = [images[2]['id'], 999999, images[1]['id'], images[0]['id'], images[2]['id']]
+    event.listen(db_manager.engine, 'before_cursor_execute', record)
+    try:
+        data = client.post('/image/batch/info', json={'ids': ids}).get_json()
+    finally:
+        event.remove(db_manager.engine, 'before_cursor_execute', record)
+
+    assert [item and item['id'] for item in data] == [images[2]['id'], None, None, images[0]['id'], images[2]['id']]
+    assert data[0]['url'] == images[2]['url']  # 类型目录随图片一并 JOIN 加载
+    assert len(statements) == 1
+
+
+def test_batch_resolve_by_filename(client, images):
+    filenames = [images[0]['filename'], 'missing.png', images[1]['filename']]
+
+    data = client.post('/image/batch/resolve', json={'filenames': filenames}).get_json()
+
+    assert [item and item['filename'] for item in data] == [images[0]['filename'], None, None]
+
+
+@pytest.mark.parametrize('body, message', [
+    ({}, '请求体需要非空的 ids 列表'),
+    ({'ids': []}, '请求体需要非空的 ids 列表'),
+    ({'ids': [1, '2']}, 'ids 的元素类型错误'),
+    ({'ids': [True]}, 'ids 的元素类型错误'),
+])
+def test_batch_info_validates_body(client, body, message):
+    response = client.post('/image/batch/info', json=body)
+
+    assert response.status_code == 400
+    assert response.get_json()['message'] == message
+
+
+def test_batch_size_is_limited(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'IMAGE_BATCH_MAX_ITEMS', 2)
+
+    response = client.post('/image/batch/info', json={'ids': [1, 2, 3]})
+
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'ids 最多 2 个'
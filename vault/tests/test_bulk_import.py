@@ -0,0 +1,129 @@
+"""服务器端批量导入：按批提交和检查点续传、硬链接与复制、整批冲突后逐条写入"""
+import errno
+import json
+import os
+
+import pytest
+
+from app.blueprints.image_service import image_bulk_import, image_stats
+from app.blueprints.image_service.image_bulk_import import bulk_import
+from app.blueprints.image_service.image_db import db_manager, Image
+
+from .helpers import TEST_TYPE_ID, png_bytes, upload_image
+
+
+@pytest.fixture
+def folder(tmp_path):
+    folder = tmp_path / 'to_import'
+    folder.mkdir()
+    for index in range(5):
+        (folder / f"img{index}.png").write_bytes(png_bytes(30 + index, 30).getvalue())
+    (folder / 'notes.txt').write_text('不是图片')
+    return folder
+
+
+@pytest.fixture
+def run_import(app, folder, tmp_path):
+    checkpoint_path = str(tmp_path / 'import.checkpoint.json')
+
+    def run(batch_size=2, **options):
+        # 与命令行导入一样只有应用上下文，每批单独提交
+        with app.app_context():
+            return bulk_import(str(folder), TEST_TYPE_ID, app.config, processes=1, batch_size=batch_size,
+                               checkpoint_path=checkpoint_path, **options)
+
+    run.checkpoint_path = checkpoint_path
+    return run
+
+
+def _imported_names():
+    with db_manager.session_scope() as session:
+        return sorted(name for name, in session.query(Image.original_filename))
+
+
+def test_interrupted_import_resumes_after_checkpoint(run_import, monkeypatch):
+    insert_images = image_bulk_import.insert_images
+    calls = []
+
+    def interrupted(images):
+        calls.append([image.original_filename for image in images])
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        return insert_images(images)
+
+    monkeypatch.setattr(image_bulk_import, 'insert_images', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        run_import()
+
+    # 第一批已经提交，检查点停在第一批的最后一个文件
+    assert _imported_names() == ['img0.png', 'img1.png']
+    with open(run_import.checkpoint_path, encoding='utf-8') as f:
+        assert json.load(f)['last'] == 'img1.png'
+
+    monkeypatch.setattr(image_bulk_import, 'insert_images', insert_images)
+    counters = run_import()
+
+    assert counters == {'imported': 3, 'duplicates': 0, 'failed': 0}
+    assert _imported_names() == [f"img{index}.png" for index in range(5)]
+    assert image_stats.get_type_stats(TEST_TYPE_ID)['active_count'] == 5
+
+
+def test_checkpoint_of_another_type_is_ignored(run_import, folder):
+    with open(run_import.checkpoint_path, 'w', encoding='utf-8') as f:
+        json.dump({'folder': str(folder), 'type_id': 1, 'last': 'img4.png'}, f)
+
+    assert run_import()['imported'] == 5
+
+
+def test_files_are_hardlinked_on_the_same_filesystem(run_import, folder, image_db):
+    run_import()
+
+    with db_manager.session_scope() as session:
+        image = session.query(Image).filter_by(original_filename='img0.png').one()
+        stored = image_db / image.folder_name / image.uuid_filename
+    assert os.path.samefile(stored, folder / 'img0.png')
+    assert (image_db / 'thumbnails' / stored.name).exists()
+
+
+def test_copy_when_link_fails_or_is_disabled(run_import, folder, image_db, monkeypatch):
+    def cross_device_link(source, target):
+        raise OSError(errno.EXDEV, 'Invalid cross-device link')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(os, 'link', cross_device_link)
+        run_import(batch_size=10)
+
+    stored = [path for path in (image_db / f"{TEST_TYPE_ID}_GreatAutumn").iterdir() if path.suffix == '.png']
+    assert len(stored) == 5
+    assert not any(os.path.samefile(path, folder / 'img0.png') for path in stored)
+    assert sorted(path.read_bytes() for path in stored) == \
+        sorted((folder / f"img{index}.png").read_bytes() for index in range(5))
+
+    target = image_db / 'copied.png'
+    assert image_bulk_import.link_or_copy(str(folder / 'img0.png'), str(target), allow_link=False)
+    assert not os.path.samefile(target, folder / 'img0.png')
+
+
+def test_batch_conflict_falls_back_to_per_image_insert(client, run_import, folder, monkeypatch):
+    # 查重之后、入库之前有人上传了相同内容的图片
+    with open(folder / 'img2.png', 'rb') as f:
+        uploaded = upload_image(client, f, 'uploaded.png')['data']
+    monkeypatch.setattr(image_bulk_import, 'find_existing', lambda entries: set())
+
+    counters = run_import(batch_size=10)
+
+    assert counters == {'imported': 4, 'duplicates': 1, 'failed': 0}
+    assert _imported_names() == ['img0.png', 'img1.png', 'img3.png', 'img4.png', 'uploaded.png']
+    with db_manager.session_scope() as session:
+        assert session.get(Image, uploaded['id']).original_filename == 'uploaded.png'
+    assert image_stats.get_type_stats(TEST_TYPE_ID)['active_count'] == 5
+
+
+def test_undecodable_file_is_skipped_and_removed(run_import, folder, image_db):
+    (folder / 'broken.png').write_bytes(b'not a png')
+
+    counters = run_import()
+
+    assert counters == {'imported': 5, 'duplicates': 0, 'failed': 1}
+    assert 'broken.png' not in _imported_names()
+    assert len(list((image_db / f"{TEST_TYPE_ID}_GreatAutumn").glob('*.png'))) == 5
@@ -0,0 +1,115 @@
+"""并发批量上传客户端：先按内容批量查重、只上传服务端没有的文件，清单记录结果并在再次运行时跳过"""
+import os
+
+import pytest
+import requests
+
+from app.blueprints.image_service.image_upload import BulkUploader, UploadManifest
+
+from .helpers import TEST_TYPE_ID, png_bytes, upload_image
+
+
+class _Response:
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self._json = response.get_json()
+
+    def json(self):
+        return self._json
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error")
+
+
+class _FlaskSession:
+    """把 requests.Session 的 POST 转给 Flask 测试客户端，记录请求的接口"""
+
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+        self.fail = set()
+
+    def post(self, url, json=None, data=None, files=None, timeout=None):
+        path = url.removeprefix('http://vault/image')
+        self.calls.append(path)
+        if path in self.fail:
+            raise requests.ConnectionError(f"{path} unreachable")
+        if files:
+            data = dict(data, **{name: (f, filename) for name, (filename, f, _) in files.items()})
+            return _Response(self.client.post(f"/image{path}", data=data, content_type='multipart/form-data'))
+        return _Response(self.client.post(f"/image{path}", json=json))
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def folder(tmp_path):
+    folder = tmp_path / 'to_upload'
+    folder.mkdir()
+    for index in range(4):
+        (folder / f"photo{index}.png").write_bytes(png_bytes(70 + index, 30).getvalue())
+    (folder / 'readme.txt').write_text('跳过')
+    return folder
+
+
+@pytest.fixture
+def uploader_factory(client, tmp_path):
+    uploaders = []
+
+    def create():
+        # 测试库是 SQLite，单线程上传避免写锁冲突
+        uploader = BulkUploader('http://vault/image', TEST_TYPE_ID, tags='bulk', concurrency=1,
+                                manifest_path=str(tmp_path / 'manifest.sqlite3'))
+        uploader.session = _FlaskSession(client)
+        uploaders.append(uploader)
+        return uploader
+
+    yield create
+    for uploader in uploaders:
+        uploader.close()
+
+
+def test_existing_content_is_not_uploaded_again(client, folder, uploader_factory):
+    with open(folder / 'photo1.png', 'rb') as f:
+        existing = upload_image(client, f, 'already-there.png')['data']
+    uploader = uploader_factory()
+
+    summary = uploader.run(str(folder))
+
+    assert summary == {UploadManifest.STATUS_UPLOADED: 3, UploadManifest.STATUS_DUPLICATE: 1}
+    assert uploader.session.calls == ['/exists', '/upload', '/upload', '/upload']
+    row = uploader.manifest.conn.execute("SELECT image_id, status FROM files WHERE path LIKE '%photo1.png'").fetchone()
+    assert row == (existing['id'], UploadManifest.STATUS_DUPLICATE)
+
+
+def test_rerun_skips_finished_files_and_picks_up_changed_ones(folder, uploader_factory):
+    uploader_factory().run(str(folder))
+
+    again = uploader_factory()
+    again.run(str(folder))
+    assert again.session.calls == []
+
+    changed = folder / 'photo2.png'
+    changed.write_bytes(png_bytes(99, 99).getvalue())
+    os.utime(changed, ns=(changed.stat().st_atime_ns, changed.stat().st_mtime_ns + 1))
+    last = uploader_factory()
+    summary = last.run(str(folder))
+
+    assert last.session.calls == ['/exists', '/upload']
+    assert summary == {UploadManifest.STATUS_UPLOADED: 4}
+
+
+def test_failed_uploads_are_recorded_and_retried(folder, uploader_factory):
+    first = uploader_factory()
+    first.session.fail = {'/exists', '/upload'}
+
+    summary = first.run(str(folder))
+
+    # 查重失败时退回全部上传，上传失败记入清单
+    assert first.session.calls == ['/exists'] + ['/upload'] * 4
+    assert summary == {UploadManifest.STATUS_FAILED: 4}
+
+    second = uploader_factory()
+    assert second.run(str(folder)) == {UploadManifest.STATUS_UPLOADED: 4}
@@ -0,0 +1,192 @@
+"""分块上传：续传、重发、乱序、跨 worker 的增量哈希和 finalize"""
+import hashlib
+import io
+import os
+
+import pytest
+from PIL import Image as PILImage
+
+from app.blueprints.image_service import chunked_upload
+from app.blueprints.image_service.image_db import db_manager, UploadSession
+from app.blueprints.image_service.image_ingest import UploadIngest
+
+from .helpers import upload_image
+
+CHUNK_SIZE = 4096
+
+
+@pytest.fixture
+def data():
+    buffer = io.BytesIO()
+    PILImage.effect_noise((120, 120), 50).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def session(app, client, data, monkeypatch):
+    monkeypatch.setitem(app.config, 'CHUNKED_UPLOAD_CHUNK_SIZE', CHUNK_SIZE)
+    response = client.post('/image/uploads', json={'filename': 'scan.png', 'size': len(data), 'type_id': 22,
+                                                    'tags': 'scan'})
+    return response.get_json()['data']
+
+
+def _put(client, upload_id, data, start, end):
+    return client.put(f"/image/uploads/{upload_id}", data=data[start:end + 1],
+                      headers={'Content-Range': f"bytes {start}-{end}/{len(data)}"})
+
+
+def _put_from(client, upload_id, data, offset):
+    while offset < len(data):
+        end = min(offset + CHUNK_SIZE, len(data)) - 1
+        offset = _put(client, upload_id, data, offset, end).get_json()['data']['offset']
+    return offset
+
+
+def _finalize(client, upload_id):
+    return client.post(f"/image/uploads/{upload_id}/finalize").get_json()
+
+
+def test_resume_after_interruption_and_finalize(client, data, session):
+    upload_id = session['upload_id']
+    assert session['chunk_size'] == CHUNK_SIZE
+    assert _put(client, upload_id, data, 0, CHUNK_SIZE - 1).get_json()['data']['offset'] == CHUNK_SIZE
+
+    # 客户端重连后查询 offset，重发的重叠部分被跳过
+    offset = client.get(f"/image/uploads/{upload_id}").get_json()['data']['offset']
+    assert offset == CHUNK_SIZE
+    overlap = _put(client, upload_id, data, CHUNK_SIZE // 2, CHUNK_SIZE + 99)
+    assert overlap.get_json()['data']['offset'] == CHUNK_SIZE + 100
+    assert _put(client, upload_id, data, 0, 99).get_json()['data']['offset'] == CHUNK_SIZE + 100
+    _put_from(client, upload_id, data, CHUNK_SIZE + 100)
+
+    result = _finalize(client, upload_id)
+    assert result['message'] == 'Image uploaded successfully'
+    assert result['data']['filename'] == f"{hashlib.sha256(data).hexdigest()}.png"
+    assert result['data']['size'] == len(data)
+    assert result['data']['tags'] == 'scan'
+
+    again = _finalize(client, upload_id)
+    assert again['data']['id'] == result['data']['id']
+    assert client.get(f"/image/{result['data']['filename']}").data == data
+
+
+def test_chunk_beyond_offset_is_rejected(client, data, session):
+    upload_id = session['upload_id']
+    _put(client, upload_id, data, 0, 99)
+
+    response = _put(client, upload_id, data, 200, 299)
+
+    assert response.status_code == 422
+    assert '已接收 100 字节' in response.get_json()['message']
+
+
+def test_finalize_before_all_bytes_arrive(client, data, session):
+    upload_id = session['upload_id']
+    _put(client, upload_id, data, 0, 99)
+
+    response = client.post(f"/image/uploads/{upload_id}/finalize")
+
+    assert response.status_code == 422
+    assert response.get_json()['message'] == f"上传未完成，已接收 100/{len(data)} 字节"
+
+
+def test_finalize_uses_incremental_hash(client, data, session, monkeypatch):
+    known_hashes = []
+    from_file = UploadIngest.from_file.__func__
+
+    def spy(cls, path, content_hash=None, **kwargs):
+        known_hashes.append(content_hash)
+        return from_file(cls, path, content_hash=content_hash, **kwargs)
+
+    monkeypatch.setattr(UploadIngest, 'from_file', classmethod(spy))
+    _put_from(client, session['upload_id'], data, 0)
+    _finalize(client, session['upload_id'])
+
+    assert known_hashes == [hashlib.sha256(data).hexdigest()]
+
+
+def test_chunks_on_other_workers_only_hash_missing_bytes(client, data, session, monkeypatch):
+    upload_id = session['upload_id']
+    _put(client, upload_id, data, 0, CHUNK_SIZE - 1)
+    chunked_upload._hashers.clear()  # 后续分块落在没有哈希状态的 worker 上
+    _put(client, upload_id, data, CHUNK_SIZE, 2 * CHUNK_SIZE - 1)
+    stale_state = chunked_upload._hashers.get(upload_id)
+    _put_from(client, upload_id, data, 2 * CHUNK_SIZE)
+    chunked_upload._hashers.set(upload_id, stale_state)  # finalize 的 worker 只见过前两块
+
+    reads = []
+    catch_up = chunked_upload._catch_up
+
+    def spy(f, upload_id, until):
+        reads.append(until - chunked_upload._hashers.get(upload_id)[0])
+        return catch_up(f, upload_id, until)
+
+    monkeypatch.setattr(chunked_upload, '_catch_up', spy)
+    result = _finalize(client, upload_id)
+
+    assert reads == [len(data) - 2 * CHUNK_SIZE]
+    assert result['data']['filename'] == f"{hashlib.sha256(data).hexdigest()}.png"
+
+
+def test_duplicate_content_reuses_existing_image(client, data, session):
+    existing = upload_image(client, io.BytesIO(data), 'existing.png')['data']
+    _put_from(client, session['upload_id'], data, 0)
+
+    result = _finalize(client, session['upload_id'])
+
+    assert result['message'] == 'Duplicate image found'
+    assert result['data']['id'] == existing['id']
+
+
+def test_gc_removes_expired_sessions(app, client, data, session, monkeypatch):
+    _put(client, session['upload_id'], data, 0, 99)
+    path = chunked_upload.temp_path(app.config, session['upload_id'])
+    monkeypatch.setitem(app.config, 'CHUNKED_UPLOAD_SESSION_TTL', -1)
+
+    assert chunked_upload.gc_upload_sessions(app.config) == 1
+    with db_manager.session_scope() as db_session:
+        assert db_session.query(UploadSession).count() == 0
+    assert not os.path.exists(path)
+
+
+def test_concurrent_finalize_loser_gets_the_winners_image(app, client, data, session, monkeypatch):
+    upload_id = session['upload_id']
+    _put_from(client, upload_id, data, 0)
+    with app.app_context():
+        stale = chunked_upload.get_session(upload_id, app.config)  # 另一个请求在领取方提交前读到的会话
+    winner = _finalize(client, upload_id)
+
+    monkeypatch.setattr(chunked_upload, 'get_session', lambda upload_id, config: stale)
+    response = client.post(f"/image/uploads/{upload_id}/finalize")
+
+    assert response.status_code == 200
+    assert response.get_json()['data']['id'] == winner['data']['id']
+
+
+def test_finalize_of_claimed_session_returns_409(client, data, session):
+    upload_id = session['upload_id']
+    _put_from(client, upload_id, data, 0)
+    with db_manager.session_scope() as db_session:
+        db_session.get(UploadSession, upload_id).status = UploadSession.STATUS_FINALIZING
+
+    response = client.post(f"/image/uploads/{upload_id}/finalize")
+
+    assert response.status_code == 409
+    with db_manager.session_scope() as db_session:
+        assert db_session.get(UploadSession, upload_id).status == UploadSession.STATUS_FINALIZING
+
+
+def test_failed_finalize_releases_claim(client, data, session, monkeypatch):
+    upload_id = session['upload_id']
+    _put_from(client, upload_id, data, 0)
+
+    def broken(config, upload):
+        raise OSError("disk unavailable")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(chunked_upload, 'open_completed', broken)
+        assert client.post(f"/image/uploads/{upload_id}/finalize").status_code == 500
+    with db_manager.session_scope() as db_session:
+        assert db_session.get(UploadSession, upload_id).status == UploadSession.STATUS_ACTIVE
+
+    assert _finalize(client, upload_id)['message'] == 'Image uploaded successfully'
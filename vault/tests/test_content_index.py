@@ -0,0 +1,98 @@
+"""内容寻址查重：布隆过滤器及其"可能存在"（含误判）和"同步前漏判"两条路径"""
+import hashlib
+import time
+
+from sqlalchemy import event
+
+from app.blueprints.image_service.content_index import BloomFilter, content_index
+from app.blueprints.image_service.image_db import db_manager, Image
+from app.blueprints.image_service.image_db_helper import ImageDBHelper
+
+from .helpers import png_bytes, upload_image
+
+
+def _key(index):
+    return index, hashlib.sha256(str(index).encode()).hexdigest()
+
+
+def test_bloom_filter_has_no_false_negatives_and_bounded_false_positives():
+    bloom = BloomFilter(capacity=2000, error_rate=0.01)
+    for index in range(2000):
+        bloom.add(*_key(index))
+
+    assert all(bloom.contains(*_key(index)) for index in range(2000))
+    false_positives = sum(bloom.contains(*_key(index)) for index in range(2000, 22000))
+    assert false_positives / 20000 < 0.03
+
+
+def test_bloom_filter_position_depends_on_file_size():
+    bloom = BloomFilter(capacity=100)
+    file_size, content_hash = _key(1)
+    bloom.add(file_size, content_hash)
+
+    assert not bloom.contains(file_size + 1, content_hash)
+
+
+def test_definitely_new_content_skips_database(monkeypatch):
+    content_index.might_contain(*_key(0))  # 首次使用时加载
+    monkeypatch.setattr(db_manager, 'session_scope', None)  # 访问数据库会直接报错
+
+    assert ImageDBHelper.find_by_content(*_key(1)) is None
+    assert ImageDBHelper.find_images_by_content([_key(1), _key(2)]) == {}
+
+
+def test_false_positive_falls_through_to_database_and_uploads(client):
+    data = png_bytes(color=(1, 2, 3)).getvalue()
+    key = (len(data), hashlib.sha256(data).hexdigest())
+    content_index.might_contain(*key)
+    content_index.add(*key)  # 布隆过滤器判定"可能存在"，数据库中却没有
+
+    assert content_index.might_contain(*key)
+    assert ImageDBHelper.find_by_content(*key) is None
+    result = upload_image(client, png_bytes(color=(1, 2, 3)), 'first.png')
+    assert result['message'] == 'Image uploaded successfully'
+
+    again = upload_image(client, png_bytes(color=(1, 2, 3)), 'again.png')
+    assert again['message'] == 'Duplicate image found'
+    assert again['data']['id'] == result['data']['id']
+
+
+def test_row_written_by_another_worker_is_caught_by_unique_index(client):
+    data = png_bytes(color=(7, 7, 7)).getvalue()
+    content_index.might_contain(*_key(0))
+    with db_manager.session_scope() as session:
+        session.add(Image(type_id=22, uuid_filename='other-worker.png', original_filename='other.png',
+                          file_size=len(data), content_hash=hashlib.sha256(data).hexdigest()))
+    content_index._refreshed_at = time.monotonic()  # 本进程还没有同步到这条记录
+
+    result = upload_image(client, png_bytes(color=(7, 7, 7)), 'race.png')
+
+    assert result['message'] == 'Duplicate image found'
+    assert result['data']['filename'] == 'other-worker.png'
+
+
+def test_batch_lookup_filters_on_size_and_hash_together():
+    content_index.might_contain(*_key(0))
+    size, content_hash = _key(3)
+    with db_manager.session_scope() as session:
+        session.add(Image(type_id=22, uuid_filename='stored.png', original_filename='stored.png',
+                          file_size=size, content_hash=content_hash))
+    content_index.add(size, content_hash)
+    content_index.add(size + 1, content_hash)  # 哈希相同、大小不同的键也通过了布隆过滤器
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('SELECT'):
+            statements.append(statement)
+
+    event.listen(db_manager.engine, 'before_cursor_execute', record)
+    try:
+        found = ImageDBHelper.find_images_by_content([(size, content_hash), (size + 1, content_hash)])
+    finally:
+        event.remove(db_manager.engine, 'before_cursor_execute', record)
+
+    assert list(found) == [(size, content_hash)]
+    # 两列整体作为行值 IN，MariaDB 据此在 ux_images_file_size_content_hash 上做范围查找
+    statement, = statements
+    assert '(images.file_size, images.content_hash) IN' in statement
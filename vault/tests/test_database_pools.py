@@ -0,0 +1,50 @@
+"""共享的数据库注册表：连接预算按 worker 数和数据库数平分，fork 后每个 worker 重新创建自己的连接池"""
+import os
+
+import pytest
+
+from app.database import registry
+from app.database.registry import DatabaseManager, get_connection_stats, pool_limits, reset_after_fork
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    monkeypatch.setattr(registry, 'CONNECTION_BUDGET', 120)
+    monkeypatch.setattr(registry, 'POOL_SIZE', 5)
+    monkeypatch.setattr(registry, '_workers', registry._workers)
+    monkeypatch.setattr(registry, '_databases', dict(registry._databases))
+
+
+@pytest.mark.parametrize('workers, databases, expected', [
+    (1, 3, (5, 35)),  # 每个池 40 个连接，5 个常驻
+    (4, 3, (5, 5)),
+    (12, 3, (3, 0)),  # 预算不够常驻 POOL_SIZE 个时全部常驻
+    (100, 3, (2, 0)),  # 每个池至少 2 个连接
+])
+def test_budget_is_split_across_workers_and_databases(budget, workers, databases, expected):
+    registry._databases = {f"db{index}": None for index in range(databases)}
+    registry.configure_pools(workers)
+
+    assert pool_limits() == expected
+
+
+def test_engine_is_created_lazily_and_sized_after_fork(budget, tmp_path, monkeypatch):
+    manager = DatabaseManager('forked', f"sqlite:///{tmp_path / 'forked.db'}")
+    registry._databases = {name: DatabaseManager(name, 'sqlite://') for name in ('other1', 'other2')}
+    registry._databases['forked'] = manager
+    assert manager.get_connection_stats() is None  # 登记时不建立连接（gunicorn master 中 preload_app）
+
+    reset_after_fork(workers=4)  # post_fork 钩子
+    parent_engine = manager.engine
+    assert (parent_engine.pool.size(), parent_engine.pool._max_overflow) == (5, 5)
+
+    monkeypatch.setattr(os, 'getpid', lambda: -1)  # fork 出的子进程
+    assert manager.get_connection_stats() is None
+    child_engine = manager.engine
+
+    assert child_engine is not parent_engine
+    assert manager.get_connection_stats()['pool_size'] == 5
+    stats = get_connection_stats()
+    assert stats['workers'] == 4
+    assert stats['max_connections'] == 10
+    manager.reset()
@@ -0,0 +1,118 @@
+"""请求会话：同一请求共用一个会话，嵌套的 session_scope 是保存点，提交留到请求结束，提交后才执行 after_commit 回调"""
+import hashlib
+import io
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from app.blueprints.image_service.content_index import content_index
+from app.blueprints.image_service.image_db import db_manager, Image
+from app.database import after_commit
+
+from .helpers import png_bytes
+
+
+def _image(name):
+    return Image(type_id=22, uuid_filename=name, original_filename=name)
+
+
+def _stored_names():
+    """用单独的连接读取，只能看到已提交的数据"""
+    with db_manager.engine.connect() as connection:
+        return sorted(connection.scalars(select(Image.uuid_filename)))
+
+
+def test_failed_nested_scope_rolls_back_to_savepoint(app):
+    with app.test_request_context():
+        with db_manager.session_scope() as outer:
+            kept = _image('kept.png')
+            outer.add(kept)
+            outer.flush()
+            with pytest.raises(IntegrityError):
+                with db_manager.session_scope() as inner:
+                    assert inner is outer
+                    inner.add(_image('kept.png'))
+                    inner.flush()
+            # 之前加载的对象没有因回滚失效
+            assert kept.uuid_filename == 'kept.png'
+            outer.add(_image('after.png'))
+        assert _stored_names() == []  # 还没有提交
+        db_manager.commit_request_session()
+
+    assert _stored_names() == ['after.png', 'kept.png']
+
+
+def test_request_ending_with_error_rolls_back(app):
+    with app.test_request_context():
+        with db_manager.session_scope() as session:
+            session.add(_image('lost.png'))
+        app.do_teardown_appcontext(RuntimeError("handler failed"))
+
+    assert _stored_names() == []
+
+
+def test_outer_transaction_is_committed_only_at_request_end(app):
+    with app.test_request_context():
+        with db_manager.session_scope() as session:
+            session.query(Image).count()  # 请求中第一次使用只读取
+        with db_manager.session_scope() as session:
+            session.add(_image('deferred.png'))  # 保存点释放后仍未提交
+        assert _stored_names() == []
+        app.do_teardown_appcontext(RuntimeError("handler failed"))
+
+    assert _stored_names() == []
+
+
+def test_app_context_without_request_commits_each_scope(app):
+    # 批量导入、回填等在应用上下文中运行的任务按 scope 提交，中断时已完成的批次不会回滚
+    with app.app_context():
+        with db_manager.session_scope() as session:
+            session.add(_image('batch-1.png'))
+        assert _stored_names() == ['batch-1.png']
+        with pytest.raises(RuntimeError):
+            with db_manager.session_scope() as session:
+                session.add(_image('batch-2.png'))
+                raise RuntimeError("interrupted")
+
+    assert _stored_names() == ['batch-1.png']
+
+
+def test_after_commit_callbacks_run_only_for_committed_work(app):
+    called = []
+    with app.test_request_context():
+        with db_manager.session_scope() as session:
+            after_commit(session, lambda: called.append('outer'))
+            with pytest.raises(RuntimeError):
+                with db_manager.session_scope() as inner:
+                    after_commit(inner, lambda: called.append('rolled back savepoint'))
+                    raise RuntimeError("savepoint failed")
+            with db_manager.session_scope() as inner:
+                after_commit(inner, lambda: called.append('released savepoint'))
+        assert called == []
+        db_manager.commit_request_session()
+    assert called == ['outer', 'released savepoint']
+
+    with app.test_request_context():
+        with db_manager.session_scope() as session:
+            after_commit(session, lambda: called.append('failed request'))
+        app.do_teardown_appcontext(RuntimeError("handler failed"))
+    assert called == ['outer', 'released savepoint']
+
+
+def test_failed_request_commit_leaves_indexes_untouched(client, monkeypatch):
+    data = png_bytes(color=(4, 5, 6)).getvalue()
+    key = (len(data), hashlib.sha256(data).hexdigest())
+    content_index.might_contain(*key)  # 首次使用时加载
+
+    def failing_commit():
+        raise OperationalError("COMMIT", {}, Exception("connection lost"))
+
+    monkeypatch.setattr(db_manager, 'commit_request_session', failing_commit)
+    # TESTING 模式下 after_request 中的异常直接抛出（线上返回 500）
+    with pytest.raises(OperationalError):
+        client.post('/image/upload', data={'type_id': '22', 'file': (io.BytesIO(data), 'lost.png')},
+                    content_type='multipart/form-data')
+
+    assert not content_index.might_contain(*key)
+    assert _stored_names() == []
@@ -0,0 +1,92 @@
+"""单次遍历上传（UploadIngest）和 /image/upload 的存储结果"""
+import hashlib
+import io
+import os
+
+from app.blueprints.image_service.image_ingest import UploadIngest, sniff_image_header
+
+from .helpers import png_bytes, upload_image
+
+
+def test_ingest_sniffs_header_and_hashes_whole_stream(tmp_path):
+    data = png_bytes(120, 80).getvalue() + b'\0' * 200_000  # 超过头部长度，剩余部分按块拷贝
+    ingest = UploadIngest(io.BytesIO(data), head_size=1024)
+
+    assert (ingest.image_format, ingest.width, ingest.height) == ('PNG', 120, 80)
+    assert ingest.head_md5 == hashlib.md5(data[:1024]).hexdigest()
+
+    temp_path = ingest.save_to_temp(str(tmp_path))
+    assert os.path.basename(temp_path).endswith(UploadIngest.TEMP_SUFFIX)
+    assert ingest.file_size == len(data)
+    assert ingest.content_hash == hashlib.sha256(data).hexdigest()
+
+    target = tmp_path / ingest.content_filename('photo.PNG')
+    assert target.name == f"{ingest.content_hash}.png"
+    ingest.commit(str(target))
+    assert target.read_bytes() == data
+    assert not os.path.exists(temp_path)
+
+
+def test_ingest_commit_discards_temp_file_when_content_exists(tmp_path):
+    data = png_bytes().getvalue()
+    target = tmp_path / 'existing.png'
+    target.write_bytes(data)
+
+    ingest = UploadIngest(io.BytesIO(data))
+    temp_path = ingest.save_to_temp(str(tmp_path))
+    ingest.commit(str(target))
+
+    assert not os.path.exists(temp_path)
+    assert ingest.temp_path is None
+
+
+def test_ingest_from_file_reuses_known_hash(tmp_path):
+    path = tmp_path / 'upload.part'
+    path.write_bytes(png_bytes().getvalue())
+
+    ingest = UploadIngest.from_file(str(path), content_hash='known')
+    assert ingest.content_hash == 'known'
+    assert ingest.temp_path == str(path)
+
+    ingest = UploadIngest.from_file(str(path))
+    assert ingest.content_hash == hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def test_sniff_rejects_non_image():
+    assert sniff_image_header(b'not an image') == (None, None, None)
+
+
+def test_upload_stores_file_under_content_hash(client, image_db):
+    data = png_bytes(50, 40).getvalue()
+    result = upload_image(client, io.BytesIO(data), 'cover.png')
+
+    assert result['success']
+    image = result['data']
+    content_hash = hashlib.sha256(data).hexdigest()
+    assert image['filename'] == f"{content_hash}.png"
+    assert image['dimensions'] == {'width': 50, 'height': 40}
+    assert image['size'] == len(data)
+    assert image['thumbnail_status'] == 'done'
+    assert (image_db / image['url'].removeprefix('/images/')).read_bytes() == data
+    assert (image_db / 'thumbnails' / image['filename']).exists()
+    assert not list(image_db.rglob(f"*{UploadIngest.TEMP_SUFFIX}"))
+
+
+def test_multiple_upload_keeps_order_and_deduplicates_within_batch(client):
+    existing = upload_image(client, png_bytes(color=(9, 9, 9)), 'existing.png')['data']
+    files = [(png_bytes(color=(i, i, i)), f"f{i}.png") for i in range(6)]
+    files[3] = (png_bytes(color=(1, 1, 1)), 'same-as-f1.png')
+    files[4] = (io.BytesIO(b'plain text'), 'notes.txt')
+    files[5] = (png_bytes(color=(9, 9, 9)), 'same-as-existing.png')
+
+    response = client.post('/image/multiple_upload', data={'type_id': '22', 'file': files},
+                           content_type='multipart/form-data')
+
+    results = response.get_json()['data']
+    assert [result['filename'] for result in results] == [name for _, name in files]
+    assert [result.get('success') for result in results] == [True, True, True, True, None, True]
+    ids = [(result.get('data') or {}).get('id') for result in results]
+    assert len(set(ids[:3])) == 3
+    assert ids[3] == ids[1]
+    assert ids[5] == existing['id']
+    assert results[3]['message'] == results[5]['message'] == 'Duplicate image found'
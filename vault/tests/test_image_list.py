@@ -0,0 +1,59 @@
+"""GET /image/ 的游标分页（keyset）和页码分页"""
+import pytest
+
+from .helpers import png_bytes, upload_image
+
+
+@pytest.fixture
+def image_ids(client):
+    ids = [upload_image(client, png_bytes(20 + index, 20), f"p{index}.png")['data']['id'] for index in range(7)]
+    client.delete(f"/image/{ids[2]}")
+    return ids
+
+
+def _list(client, **params):
+    return client.get('/image/', query_string={'type_id': 22, **params})
+
+
+def test_cursor_pages_cover_all_images_newest_first(client, image_ids):
+    seen, cursor, pages = [], None, []
+    while True:
+        params = {'page_size': 2, 'include_total': '1'}
+        if cursor:
+            params['cursor'] = cursor
+        data = _list(client, **params).get_json()['data']
+        seen += [image['id'] for image in data['data']]
+        pages.append(data['pagination'])
+        cursor = data['pagination']['next_cursor']
+        if not cursor:
+            break
+
+    expected = [image_id for image_id in reversed(image_ids) if image_id != image_ids[2]]
+    assert seen == expected
+    assert [page['has_next'] for page in pages] == [True, True, False]
+    assert all(page['total'] == 6 for page in pages)
+
+
+def test_cursor_is_stable_when_new_images_arrive(client, image_ids):
+    first = _list(client, page_size=3).get_json()['data']
+    upload_image(client, png_bytes(99, 99), 'new.png')
+
+    second = _list(client, page_size=3, cursor=first['pagination']['next_cursor']).get_json()['data']
+
+    assert [image['id'] for image in second['data']] == [image_ids[3], image_ids[1], image_ids[0]]
+    assert 'total' not in second['pagination']
+
+
+def test_invalid_cursor_is_rejected(client, image_ids):
+    response = _list(client, cursor='not-a-cursor')
+
+    assert response.status_code == 400
+    assert response.get_json()['message'] == '无效的分页游标: not-a-cursor'
+
+
+def test_page_parameter_keeps_offset_pagination(client, image_ids):
+    data = _list(client, page=2, page_size=2).get_json()['data']
+
+    assert [image['id'] for image in data['data']] == [image_ids[4], image_ids[3]]
+    assert data['pagination']['current_page'] == 2
+    assert data['pagination']['pages'] == 3
@@ -0,0 +1,73 @@
+"""GET /image/<filename> 的元数据缓存：命中不查库、负缓存，上传/删除/修改后本进程立即失效"""
+import time
+
+import pytest
+
+from app.blueprints.image_service.image_cache import ImageMetaCache, TTLCache, image_meta_cache
+
+from .helpers import png_bytes, upload_image
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    calls = []
+    load = ImageMetaCache._load
+
+    def counting_load(filename):
+        calls.append(filename)
+        return load(filename)
+
+    monkeypatch.setattr(ImageMetaCache, '_load', staticmethod(counting_load))
+    return calls
+
+
+def test_repeated_requests_resolve_from_cache(client, loads):
+    image = upload_image(client, png_bytes(), 'cached.png')['data']
+
+    for _ in range(3):
+        assert client.get(f"/image/{image['filename']}").status_code == 200
+
+    assert loads == [image['filename']]
+
+
+def test_upload_clears_negative_entry_for_original_filename(client, loads):
+    assert client.get('/image/later.png').status_code == 404
+    assert client.get('/image/later.png').status_code == 404
+    assert loads == ['later.png']
+
+    upload_image(client, png_bytes(), 'later.png')
+
+    assert client.get('/image/later.png').status_code == 200
+
+
+def test_delete_invalidates_cached_entry(client):
+    image = upload_image(client, png_bytes(), 'gone.png')['data']
+    assert client.get(f"/image/{image['filename']}").status_code == 200
+
+    client.delete(f"/image/{image['id']}")
+
+    assert client.get(f"/image/{image['filename']}").status_code == 404
+    assert client.get('/image/gone.png').status_code == 404
+
+
+def test_update_refreshes_last_modified(client):
+    image = upload_image(client, png_bytes(), 'edited.png')['data']
+    before = image_meta_cache.resolve(image['filename'])
+
+    time.sleep(1.1)  # Last-Modified 精确到秒
+    client.put(f"/image/{image['id']}", json={'description': 'changed'})
+
+    assert image_meta_cache.resolve(image['filename']).updated_at > before.updated_at
+
+
+def test_ttl_cache_expires_and_evicts_least_recently_used():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1  # a 变为最近使用
+    cache.set('c', 3)
+    cache.set('short', 4, ttl=-1)
+
+    assert cache.get('b') is None
+    assert cache.get('short') is None
+    assert cache.get('c') == 3
@@ -0,0 +1,65 @@
+"""关键词 + 标签搜索：分词、MariaDB FULLTEXT 表达式、SQLite 上的 LIKE 退化路径和标签分面"""
+import pytest
+from sqlalchemy import select
+from sqlalchemy.dialects import mysql
+
+from app.blueprints.image_service import image_search
+from app.blueprints.image_service.image_db import Image
+
+from .helpers import png_bytes, upload_image
+
+
+@pytest.fixture
+def images(client):
+    return {
+        'cat': upload_image(client, png_bytes(20, 20), 'Sleeping_Cat.png', tags='Animal, 猫咪',
+                            description='橘猫在沙发上睡觉')['data'],
+        'dog': upload_image(client, png_bytes(21, 20), 'dog-park.png', tags='animal,outdoor')['data'],
+        'sunset': upload_image(client, png_bytes(22, 20), 'sunset.png', tags='outdoor')['data'],
+    }
+
+
+def _search(client, **params):
+    return client.get('/image/search', query_string=params).get_json()['data']
+
+
+def _ids(result):
+    return [image['id'] for image in result['data']]
+
+
+def test_tokenize_splits_cjk_into_bigrams():
+    assert image_search.tokenize('Sleeping_Cat 橘猫睡觉') == ['sleeping', 'cat', '橘猫', '猫睡', '睡觉']
+    assert image_search.normalize_tags('Animal, animal；户外,') == ['animal', '户外']
+
+
+def test_mariadb_query_uses_boolean_mode_prefix_match(monkeypatch):
+    monkeypatch.setattr(image_search, '_is_mysql', lambda: True)
+    query = image_search.apply_keyword_filter(select(Image), 'Cat 睡')
+    sql = str(query.compile(dialect=mysql.dialect(), compile_kwargs={'literal_binds': True}))
+
+    assert "MATCH (images.search_text) AGAINST ('+cat* +睡*' IN BOOLEAN MODE)" in sql
+
+
+def test_keyword_prefix_matches_filename_and_description(client, images):
+    assert _ids(_search(client, q='sleep')) == [images['cat']['id']]
+    assert _ids(_search(client, q='沙发')) == [images['cat']['id']]
+    assert _ids(_search(client, q='cat park')) == []
+    assert _search(client, q='a')['pagination']['total'] == 0  # 太短的词不可能命中索引
+
+
+def test_tags_are_required_together_and_faceted(client, images):
+    result = _search(client, tags='ANIMAL')
+
+    assert _ids(result) == [images['dog']['id'], images['cat']['id']]
+    assert result['facets'] == [{'tag': 'animal', 'count': 2}, {'tag': 'outdoor', 'count': 1},
+                                {'tag': '猫咪', 'count': 1}]
+    assert _ids(_search(client, tags='animal,outdoor')) == [images['dog']['id']]
+
+
+def test_update_and_delete_keep_index_in_sync(client, images):
+    client.put(f"/image/{images['sunset']['id']}", json={'description': 'beach evening', 'tags': ['beach']})
+    client.delete(f"/image/{images['dog']['id']}")
+
+    assert _ids(_search(client, q='beach')) == [images['sunset']['id']]
+    assert _search(client, tags='outdoor')['data'] == []
+    assert _ids(_search(client, tags='animal')) == [images['cat']['id']]
@@ -0,0 +1,51 @@
+"""列表的快速序列化：与 Image.to_dict 结果一致、列式输出、无 orjson 时的退回路径"""
+import json
+
+import pytest
+
+from app.blueprints.image_service import image_serializer
+from app.blueprints.image_service.image_db import Image
+
+from .helpers import png_bytes, upload_image
+
+
+@pytest.fixture
+def image_ids(client):
+    ids = [upload_image(client, png_bytes(60 + index, 30), f"col{index}.png", tags='a,b',
+                        description='描述')['data']['id'] for index in range(3)]
+    return list(reversed(ids))
+
+
+def _list(client, **params):
+    return client.get('/image/', query_string={'type_id': 22, **params}).get_json()['data']
+
+
+@pytest.mark.parametrize('size', [0, 1, 1023, 1024, 1536, 1024 ** 2 - 1, 1024 ** 2, 5 * 1024 ** 3, 3 * 1024 ** 4])
+def test_format_size_matches_model(size):
+    assert image_serializer.format_size(size) == Image._format_size(size)
+
+
+def test_rows_match_to_dict(client, image_ids):
+    rows = _list(client)['data']
+
+    assert [row['id'] for row in rows] == image_ids
+    for row in rows:
+        assert row == client.get(f"/image/{row['id']}/info").get_json()['data']
+
+
+def test_columnar_format_returns_ids_and_urls(client, image_ids):
+    data = _list(client, format='columnar')
+    rows = _list(client)['data']
+
+    assert data['data'] == {'ids': image_ids, 'urls': [row['url'] for row in rows]}
+    assert data['pagination']['has_next'] is False
+
+
+def test_json_fallback_without_orjson(monkeypatch):
+    payload = {'name': '图片', 'sizes': [1, 2.5], 'missing': None}
+    encoded = image_serializer.dumps(payload)
+
+    monkeypatch.setattr(image_serializer, 'orjson', None)
+
+    assert json.loads(image_serializer.dumps(payload)) == json.loads(encoded) == payload
+    assert '图片'.encode('utf-8') in image_serializer.dumps(payload)
@@ -0,0 +1,97 @@
+"""图片发送：条件请求（304）、Range 和 X-Accel-Redirect 模式"""
+import shutil
+
+import pytest
+
+from .helpers import png_bytes, upload_image
+
+
+@pytest.fixture
+def image(client):
+    return upload_image(client, png_bytes(80, 60), 'photo.png')['data']
+
+
+@pytest.fixture
+def x_accel(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'IMAGE_SERVE_MODE', 'x-accel')
+    return app.config['IMAGE_ACCEL_PREFIX'].rstrip('/')
+
+
+def test_x_accel_redirects_to_internal_location(client, image, x_accel):
+    response = client.get(f"/image/{image['filename']}")
+
+    assert response.status_code == 200
+    assert response.data == b''
+    # to_dict 的 url 为 /images/<类型目录>/<文件名>，与上传目录下的相对路径一致
+    assert response.headers['X-Accel-Redirect'] == x_accel + image['url'].removeprefix('/images')
+    assert response.headers['Content-Type'] == 'image/png'
+    # nginx 的 internal location 回写这两个头，304 才能与 direct 模式一致
+    assert response.headers['ETag'] == f"\"{image['filename'].split('.')[0]}\""
+    assert response.headers['Last-Modified']
+
+
+def test_x_accel_download_sets_attachment_name(client, image, x_accel):
+    response = client.get(f"/image/download/{image['id']}")
+
+    assert response.headers['X-Accel-Redirect'].endswith(image['filename'])
+    assert response.headers['Content-Disposition'] == 'attachment; filename=photo.png'
+
+
+def test_x_accel_answers_conditional_request_itself(client, image, x_accel):
+    etag = client.get(f"/image/{image['filename']}").headers['ETag']
+
+    response = client.get(f"/image/{image['filename']}", headers={'If-None-Match': etag})
+
+    assert response.status_code == 304
+    assert 'X-Accel-Redirect' not in response.headers
+
+
+def test_direct_response_carries_content_hash_etag(client, image):
+    response = client.get(f"/image/{image['filename']}")
+
+    assert response.status_code == 200
+    assert len(response.data) == image['size']
+    assert response.headers['ETag'] == f"\"{image['filename'].split('.')[0]}\""
+    assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+    assert 'Accept' in response.vary
+
+
+def test_if_none_match_and_if_modified_since_return_304(client, image):
+    first = client.get(f"/image/{image['filename']}")
+
+    by_etag = client.get(f"/image/{image['filename']}", headers={'If-None-Match': first.headers['ETag']})
+    by_date = client.get(f"/image/{image['filename']}", headers={'If-Modified-Since': first.headers['Last-Modified']})
+    changed = client.get(f"/image/{image['filename']}", headers={'If-None-Match': '"something-else"'})
+
+    assert (by_etag.status_code, by_etag.data) == (304, b'')
+    assert by_etag.headers['ETag'] == first.headers['ETag']
+    assert by_date.status_code == 304
+    assert changed.status_code == 200
+
+
+def test_304_does_not_touch_disk(client, image, image_db):
+    etag = client.get(f"/image/{image['filename']}").headers['ETag']
+    shutil.rmtree(image_db / image['url'].split('/')[2])
+
+    response = client.get(f"/image/{image['filename']}", headers={'If-None-Match': etag})
+
+    assert response.status_code == 304
+
+
+def test_range_request_returns_partial_content(client, image):
+    full = client.get(f"/image/{image['filename']}").data
+
+    response = client.get(f"/image/{image['filename']}", headers={'Range': 'bytes=10-59'})
+
+    assert response.status_code == 206
+    assert response.data == full[10:60]
+    assert response.headers['Content-Range'] == f"bytes 10-59/{len(full)}"
+    assert response.headers['ETag'] == client.get(f"/image/{image['filename']}").headers['ETag']
+    response.close()
+
+
+def test_range_with_stale_if_range_returns_full_body(client, image):
+    response = client.get(f"/image/{image['filename']}", headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+
+    assert response.status_code == 200
+    assert len(response.data) == image['size']
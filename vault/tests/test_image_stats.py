@@ -0,0 +1,72 @@
+"""按类型物化的统计：上传、删除、恢复时增量维护，与重新计算的结果一致，读取时不扫描 images"""
+import pytest
+from sqlalchemy import event
+
+from app.blueprints.image_service import image_stats
+from app.blueprints.image_service.image_db import db_manager, Image
+
+from .helpers import TEST_TYPE_ID, png_bytes, upload_image
+
+
+def _counts():
+    stats = image_stats.get_type_stats(TEST_TYPE_ID)
+    return stats['active_count'], stats['deleted_count'], stats['active_bytes'], stats['deleted_bytes']
+
+
+@pytest.fixture
+def images(client):
+    return [upload_image(client, png_bytes(30 + index, 30), f"s{index}.png")['data'] for index in range(3)]
+
+
+def test_upload_delete_and_restore_apply_deltas(client, images):
+    sizes = [image['size'] for image in images]
+    assert _counts() == (3, 0, sum(sizes), 0)
+
+    client.delete(f"/image/{images[0]['id']}")
+    assert _counts() == (2, 1, sizes[1] + sizes[2], sizes[0])
+
+    upload_image(client, png_bytes(30, 30), 'restored.png')  # 与已删除图片内容相同，恢复原记录
+    assert _counts() == (3, 0, sum(sizes), 0)
+
+    upload_image(client, png_bytes(31, 30), 'duplicate.png')  # 未删除的重复图片不计数
+    assert _counts() == (3, 0, sum(sizes), 0)
+
+
+def test_batch_upload_is_counted_once_per_image(client):
+    files = [(png_bytes(40 + index, 40), f"b{index}.png") for index in range(4)]
+    response = client.post('/image/multiple_upload', data={'type_id': str(TEST_TYPE_ID), 'file': files},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+
+    assert _counts()[:2] == (4, 0)
+
+
+def test_incremental_counters_match_rebuild(client, images):
+    client.delete(f"/image/{images[1]['id']}")
+    incremental = image_stats.get_all_stats()
+
+    image_stats.rebuild_stats()
+
+    assert image_stats.get_all_stats() == incremental
+
+
+def test_status_and_stats_endpoint_read_only_counters(client, images):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db_manager.engine, 'before_cursor_execute', record)
+    try:
+        status = Image.get_database_status()
+        stats = client.get('/image/stats').get_json()['data']
+    finally:
+        event.remove(db_manager.engine, 'before_cursor_execute', record)
+
+    assert status['active_images'] == stats['total_images'] == 3
+    assert status['storage']['total_size'] == stats['total_size'] == sum(image['size'] for image in images)
+    assert not [statement for statement in statements if 'FROM images' in statement]
+
+
+def test_mime_type_stats_are_offline_diagnostics(images):
+    assert Image.get_mime_type_stats()['mime_types'] == {'image/png': 3}
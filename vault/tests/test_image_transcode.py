@@ -0,0 +1,55 @@
+"""WebP/AVIF 兄弟文件：只保留比原图小的转码结果，按 Accept 头协商发送"""
+import pytest
+
+from app.blueprints.image_service.image_transcode import SKIP_SUFFIX, accepted_formats
+
+from .helpers import png_bytes, upload_image
+
+ACCEPT_MODERN = 'image/avif,image/webp,*/*;q=0.8'
+
+
+@pytest.fixture
+def image(client, image_db):
+    # 纯色小图：WebP 比 PNG 小，AVIF 的容器开销让它比 PNG 大
+    image = upload_image(client, png_bytes(), 'flat.png')['data']
+    image['path'] = image_db / image['url'].removeprefix('/images/')
+    return image
+
+
+def test_only_smaller_siblings_are_kept(image):
+    webp = image['path'].with_name(image['path'].name + '.webp')
+
+    assert webp.exists() and webp.stat().st_size < image['size']
+    assert not image['path'].with_name(image['path'].name + '.avif').exists()
+    assert image['path'].with_name(image['path'].name + '.avif' + SKIP_SUFFIX).exists()
+
+
+def test_best_accepted_sibling_is_sent(client, image):
+    modern = client.get(f"/image/{image['filename']}", headers={'Accept': ACCEPT_MODERN})
+    plain = client.get(f"/image/{image['filename']}", headers={'Accept': '*/*'})
+
+    assert modern.headers['Content-Type'] == 'image/webp'
+    assert modern.data[8:12] == b'WEBP'
+    assert plain.headers['Content-Type'] == 'image/png'
+    assert len(plain.data) == image['size']
+    assert 'Accept' in modern.vary and 'Accept' in plain.vary
+    # 不同表示的 ETag 不同，缓存不会把 WebP 发给只认 PNG 的客户端
+    assert modern.headers['ETag'] != plain.headers['ETag']
+
+
+def test_conditional_request_matches_negotiated_representation(client, image):
+    etag = client.get(f"/image/{image['filename']}", headers={'Accept': ACCEPT_MODERN}).headers['ETag']
+
+    same = client.get(f"/image/{image['filename']}", headers={'Accept': ACCEPT_MODERN, 'If-None-Match': etag})
+    other = client.get(f"/image/{image['filename']}", headers={'Accept': '*/*', 'If-None-Match': etag})
+
+    assert same.status_code == 304
+    assert other.status_code == 200
+
+
+def test_wildcard_does_not_count_as_modern_format_support(app):
+    with app.test_request_context(headers={'Accept': '*/*'}) as context:
+        assert accepted_formats(context.request.accept_mimetypes, ['avif', 'webp']) == []
+    with app.test_request_context(headers={'Accept': 'image/webp;q=0,image/avif'}) as context:
+        assert accepted_formats(context.request.accept_mimetypes, ['webp']) == []
+        assert accepted_formats(context.request.accept_mimetypes, ['avif', 'webp']) == ['avif']
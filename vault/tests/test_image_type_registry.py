@@ -0,0 +1,73 @@
+"""图片类型注册表：命中不查库，其它 worker 修改类型后按版本号重新加载，找不到类型时限频提前检查"""
+import pytest
+from sqlalchemy import event
+
+from app.blueprints.image_service.image_db import db_manager
+from app.blueprints.image_service.image_type_registry import ImageTypeRegistry
+
+from .helpers import TEST_TYPE_ID
+
+AUTH = {'AuthenticationCode': 'HappyImage2024!'}
+
+
+@pytest.fixture
+def other_worker():
+    """另一个 worker 进程中的注册表，版本号检查间隔足够长，测试中不会自然过期"""
+    registry = ImageTypeRegistry(check_interval=60)
+    registry.get(type_id=TEST_TYPE_ID)
+    return registry
+
+
+@pytest.fixture
+def queries():
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('SELECT'):
+            statements.append(statement)
+
+    event.listen(db_manager.engine, 'before_cursor_execute', record)
+    yield statements
+    event.remove(db_manager.engine, 'before_cursor_execute', record)
+
+
+def test_cached_lookups_do_not_query(other_worker, queries):
+    for _ in range(5):
+        assert other_worker.get(type_id=TEST_TYPE_ID).type_name == 'GreatAutumn'
+        assert other_worker.get(type_name='GreatAutumn').type_id == TEST_TYPE_ID
+    other_worker.folder_names()
+
+    assert queries == []
+
+
+def test_misses_check_version_at_most_once_per_interval(other_worker, queries, monkeypatch):
+    monkeypatch.setattr(other_worker, '_checked_at', 0)  # 上次检查已超过 MISS_CHECK_INTERVAL
+    for _ in range(5):
+        assert other_worker.get(type_id=9999) is None
+
+    assert len(queries) == 1
+
+
+def test_type_created_by_another_worker_is_found_on_miss(client, other_worker, monkeypatch):
+    response = client.post('/image/types', data={'type_id': '77', 'type_name': 'Winter', 'description': '冬', **AUTH})
+    assert response.status_code == 200
+    monkeypatch.setattr(ImageTypeRegistry, 'MISS_CHECK_INTERVAL', 0)
+
+    assert other_worker.get(type_id=77).type_name == 'Winter'
+
+
+def test_rename_is_picked_up_after_check_interval(client, other_worker):
+    response = client.put(f"/image/types/{TEST_TYPE_ID}", data={'type_name': 'LateAutumn', **AUTH})
+    assert response.status_code == 200
+    assert other_worker.get(type_id=TEST_TYPE_ID).type_name == 'GreatAutumn'  # 检查间隔内仍使用缓存
+
+    other_worker.check_interval = 0
+
+    assert other_worker.get(type_id=TEST_TYPE_ID).type_name == 'LateAutumn'
+    assert other_worker.folder_names()[TEST_TYPE_ID] == f"{TEST_TYPE_ID}_LateAutumn"
+
+
+def test_returned_types_are_independent_copies(other_worker):
+    other_worker.get(type_id=TEST_TYPE_ID).type_name = 'changed'
+
+    assert other_worker.get(type_id=TEST_TYPE_ID).type_name == 'GreatAutumn'
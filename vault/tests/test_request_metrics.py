@@ -0,0 +1,70 @@
+"""请求指标与 /metrics：按 endpoint 计数，多进程模式下合并各 worker 写入的指标文件"""
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from prometheus_client import multiprocess
+
+from .helpers import png_bytes, upload_image
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+# 模拟一个 gunicorn worker：处理了一个请求，另有一个请求还在处理中
+WORKER_SCRIPT = """
+import os
+from app.metrics.request_metrics import REQUESTS, REQUESTS_IN_PROGRESS
+REQUESTS.labels('image', 'image.get_image_info', 'GET', '200').inc()
+REQUESTS_IN_PROGRESS.labels('image', 'image.get_image_info').inc()
+print(os.getpid())
+"""
+
+REQUESTS_SAMPLE = ('http_requests_total{blueprint="image",endpoint="image.get_image_info",'
+                   'method="GET",status="200"}')
+IN_PROGRESS_SAMPLE = 'http_requests_in_progress{blueprint="image",endpoint="image.get_image_info"}'
+
+
+def _metrics(client):
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    return dict(line.rsplit(' ', 1) for line in response.get_data(as_text=True).splitlines()
+                if line and not line.startswith('#'))
+
+
+def _run_worker(multiproc_dir):
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(multiproc_dir))
+    result = subprocess.run([sys.executable, '-c', WORKER_SCRIPT], cwd=PROJECT_ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    return int(result.stdout.split()[-1])
+
+
+def test_requests_are_labelled_by_endpoint(client):
+    image = upload_image(client, png_bytes(), 'metrics.png')['data']
+    before = float(_metrics(client).get(REQUESTS_SAMPLE, 0))
+
+    client.get(f"/image/{image['id']}/info")
+    client.get('/no/such/route')
+
+    samples = _metrics(client)
+    assert float(samples[REQUESTS_SAMPLE]) == before + 1
+    assert 'http_requests_total{blueprint="app",endpoint="unmatched",method="GET",status="404"}' in samples
+    assert 'db_pool_max_connections{database="image"}' in samples
+
+
+def test_multiprocess_collector_merges_workers(client, tmp_path, monkeypatch):
+    # 单独的目录：收集器读取目录中所有 *.db 文件，tmp_path 中还有测试用的 SQLite 库
+    multiproc_dir = tmp_path / 'prometheus_multiproc'
+    multiproc_dir.mkdir()
+    pids = [_run_worker(multiproc_dir), _run_worker(multiproc_dir)]
+    monkeypatch.setenv('PROMETHEUS_MULTIPROC_DIR', str(multiproc_dir))
+
+    samples = _metrics(client)
+    assert float(samples[REQUESTS_SAMPLE]) == 2
+    assert float(samples[IN_PROGRESS_SAMPLE]) == 2
+
+    # gunicorn child_exit 钩子：退出的 worker 不再计入 livesum gauge，计数器保留
+    multiprocess.mark_process_dead(pids[0], str(multiproc_dir))
+
+    samples = _metrics(client)
+    assert float(samples[REQUESTS_SAMPLE]) == 2
+    assert float(samples[IN_PROGRESS_SAMPLE]) == 1
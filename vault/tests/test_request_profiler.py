@@ -0,0 +1,92 @@
+"""请求采样分析：默认关闭；开启后只分析携带令牌或按比例抽中的请求，结果按耗时列出并限制保留数量"""
+import pytest
+
+from app import create_app
+from config import TestingConfig
+
+from .helpers import png_bytes, upload_image
+
+TOKEN = 'profile-token'
+
+
+class ProfilingConfig(TestingConfig):
+    PROFILING_ENABLED = True
+    PROFILING_TOKEN = TOKEN
+    PROFILING_SAMPLE_RATE = 0
+    PROFILING_INTERVAL = 0.001
+
+
+@pytest.fixture(scope='module')
+def profiling_app():
+    flask_app = create_app(ProfilingConfig)
+    flask_app.config['TESTING'] = True
+    return flask_app
+
+
+@pytest.fixture
+def profiles_dir(profiling_app, tmp_path, image_db, monkeypatch):
+    directory = tmp_path / 'profiles'
+    monkeypatch.setitem(profiling_app.config, 'PROFILING_DIR', str(directory))
+    monkeypatch.setitem(profiling_app.config, 'IMAGE_UPLOAD_FOLDER', str(image_db))
+    return directory
+
+
+@pytest.fixture
+def profiling_client(profiling_app, profiles_dir):
+    return profiling_app.test_client()
+
+
+def _profiles(client, **params):
+    response = client.get('/admin/profiles', query_string=params, headers={'X-Profile': TOKEN})
+    assert response.status_code == 200
+    return response.get_json()['data']
+
+
+def test_profiling_is_disabled_by_default(client):
+    assert TestingConfig.PROFILING_ENABLED is False
+    assert client.get('/admin/profiles', headers={'X-Profile': 'anything'}).status_code == 404
+
+
+def test_only_requests_with_the_token_are_profiled(profiling_client, profiles_dir):
+    image = upload_image(profiling_client, png_bytes(), 'profiled.png')['data']
+
+    profiling_client.get(f"/image/{image['id']}/info", headers={'X-Profile': 'wrong'})
+    assert not profiles_dir.exists()
+
+    response = profiling_client.get(f"/image/{image['id']}/info", headers={'X-Profile': TOKEN})
+    assert response.status_code == 200
+
+    [profile] = _profiles(profiling_client)
+    assert profile['endpoint'] == 'image.get_image_info'
+    assert profile['path'] == f"/image/{image['id']}/info"
+    assert profile['status'] == 200
+    collapsed = profiles_dir / 'image.get_image_info' / f"{profile['name']}.collapsed"
+    assert collapsed.exists()
+
+    download = profiling_client.get(f"/admin/profiles/image.get_image_info/{profile['name']}",
+                                    headers={'X-Profile': TOKEN})
+    assert download.status_code == 200
+    assert download.data == collapsed.read_bytes()
+
+
+def test_profile_listing_requires_the_token(profiling_client):
+    assert profiling_client.get('/admin/profiles').status_code == 403
+    assert profiling_client.get('/admin/profiles', headers={'X-Profile': 'wrong'}).status_code == 403
+    assert profiling_client.get('/admin/profiles/image.get_image_info/x',
+                                headers={'X-Profile': TOKEN}).status_code == 404
+
+
+def test_sample_rate_profiles_without_token_and_keeps_newest(profiling_app, profiling_client, profiles_dir,
+                                                            monkeypatch):
+    monkeypatch.setitem(profiling_app.config, 'PROFILING_SAMPLE_RATE', 1.0)
+    monkeypatch.setitem(profiling_app.config, 'PROFILING_MAX_FILES', 2)
+
+    for _ in range(3):
+        profiling_client.get('/image/types')
+    profiling_client.get('/metrics')  # 不采样
+
+    profiles = _profiles(profiling_client)
+    assert len(profiles) == 2
+    assert {profile['endpoint'] for profile in profiles} == {'image.get_image_types'}
+    assert profiles[0]['duration_ms'] >= profiles[1]['duration_ms']
+    assert _profiles(profiling_client, endpoint='metrics') == []
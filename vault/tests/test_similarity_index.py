@@ -0,0 +1,102 @@
+"""感知哈希近似重复：BK 树检索和相似图片索引的增量同步"""
+import io
+import random
+
+from PIL import Image as PILImage, ImageDraw
+
+from app.blueprints.image_service.image_db import db_manager, Image
+from app.blueprints.image_service.similarity_index import BKTree, SimilarityIndex
+
+from .helpers import upload_image
+
+
+def _brute_force(items, hash_value, max_distance):
+    return sorted((item, (value ^ hash_value).bit_count()) for item, value in items
+                  if (value ^ hash_value).bit_count() <= max_distance)
+
+
+def test_bk_tree_search_matches_brute_force():
+    rng = random.Random(5)
+    base = rng.getrandbits(64)
+    # 一半是 base 的近邻，一半随机，覆盖子树剪枝的两侧
+    values = [base ^ sum(1 << rng.randrange(64) for _ in range(rng.randrange(8))) for _ in range(300)]
+    values += [rng.getrandbits(64) for _ in range(300)]
+    items = list(enumerate(values))
+    tree = BKTree()
+    for item, value in items:
+        tree.add(value, item)
+
+    assert tree.size == len(items)
+    for query in (base, values[10], rng.getrandbits(64)):
+        for max_distance in (0, 3, 10, 64):
+            assert sorted(tree.search(query, max_distance)) == _brute_force(items, query, max_distance)
+
+
+def test_bk_tree_keeps_items_with_equal_hashes():
+    tree = BKTree()
+    tree.add(0b1010, 'a')
+    tree.add(0b1010, 'b')
+    tree.add(0b1011, 'c')
+
+    assert sorted(tree.search(0b1010, 0)) == [('a', 0), ('b', 0)]
+    assert sorted(tree.search(0b1010, 1)) == [('a', 0), ('b', 0), ('c', 1)]
+    assert BKTree().search(0, 64) == []
+
+
+def _add_images(*phashes):
+    with db_manager.session_scope() as session:
+        images = [Image(type_id=22, uuid_filename=f"{index}.png", original_filename=f"{index}.png", phash=phash)
+                  for index, phash in enumerate(phashes)]
+        session.add_all(images)
+        session.flush()
+        return [image.id for image in images]
+
+
+def test_index_picks_up_hashes_generated_later():
+    first, pending = _add_images('00000000000000ff', None)
+    index = SimilarityIndex(refresh_interval=0)
+
+    assert index.search('00000000000000fe', 2) == [(first, 1)]
+    with db_manager.session_scope() as session:
+        session.get(Image, pending).phash = '00000000000000fc'
+
+    assert index.search('00000000000000fe', 2) == [(first, 1), (pending, 1)]
+    assert not index._pending
+
+
+def test_pending_checks_rotate_through_all_ids(monkeypatch):
+    monkeypatch.setattr(SimilarityIndex, 'PENDING_CHECK_LIMIT', 4)
+    index = SimilarityIndex()
+    index._pending = set(range(1, 11))
+
+    checked = [index._pending_batch() for _ in range(5)]
+
+    assert all(batch[:2] == [10, 9] for batch in checked)  # 最新的每次都回查
+    assert {image_id for batch in checked for image_id in batch} == set(range(1, 11))
+
+
+def _striped_jpeg(quality, seed=0):
+    image = PILImage.new('RGB', (400, 300), (30, 30, 30))
+    draw = ImageDraw.Draw(image)
+    for x in range(0, 400, 40):
+        draw.rectangle([x, (x * 7 + seed) % 300, x + 30, 300], fill=((x * 3 + seed) % 255, 100, 200))
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality)
+    buffer.seek(0)
+    return buffer
+
+
+def test_near_duplicate_upload_and_similar_endpoint(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'THUMBNAIL_ASYNC', False)
+    original = upload_image(client, _striped_jpeg(90), 'a.jpg')['data']
+
+    rejected = client.post('/image/upload', data={'type_id': '22', 'file': (_striped_jpeg(40), 'b.jpg'),
+                                                  'reject_near_duplicate': 'true'},
+                           content_type='multipart/form-data')
+    assert rejected.status_code == 422
+    recompressed = upload_image(client, _striped_jpeg(40), 'b.jpg')['data']
+    different = upload_image(client, _striped_jpeg(90, seed=77), 'c.jpg', reject_near_duplicate='true')['data']
+
+    similar = client.get(f"/image/{original['id']}/similar", query_string={'distance': 10}).get_json()['data']
+    assert [image['id'] for image in similar] == [recompressed['id']]
+    assert different['id'] not in (original['id'], recompressed['id'])
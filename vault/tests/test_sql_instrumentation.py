@@ -0,0 +1,66 @@
+"""SQL 语句计时：默认不打印语句，按请求统计语句数，慢查询日志只包含参数的类型结构"""
+import pytest
+from loguru import logger
+from prometheus_client import REGISTRY
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app.blueprints.image_service.image_db import db_manager
+from app.database import instrumentation
+from app.database.instrumentation import param_shape
+
+from .helpers import png_bytes, upload_image
+
+
+def _sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@pytest.fixture
+def warnings():
+    messages = []
+    sink = logger.add(messages.append, level='WARNING', format='{message}')
+    yield messages
+    logger.remove(sink)
+
+
+def test_echo_is_off_by_default():
+    assert db_manager.engine.echo is False
+
+
+def test_queries_are_counted_per_request(client):
+    image = upload_image(client, png_bytes(), 'counted.png')['data']
+    endpoint = {'endpoint': 'image.get_image_info'}
+    count, total = _sample('db_queries_per_request_count', **endpoint), _sample('db_queries_per_request_sum', **endpoint)
+
+    client.get(f"/image/{image['id']}/info")
+
+    assert _sample('db_queries_per_request_count', **endpoint) == count + 1
+    # 一条 SELECT（image_type 一并 JOIN 加载），加上测试库为 SQLite 发出的 BEGIN
+    assert _sample('db_queries_per_request_sum', **endpoint) - total == 2
+
+
+def test_slow_query_log_has_parameter_shape_not_values(warnings, monkeypatch):
+    monkeypatch.setattr(instrumentation, 'SLOW_QUERY_THRESHOLD', 0)
+    before = _sample('db_slow_queries_total', database='image', operation='SELECT')
+
+    with db_manager.session_scope() as session:
+        session.execute(text("SELECT :secret_name, :limit_value"), {'secret_name': 'p@ssw0rd', 'limit_value': 3})
+
+    assert _sample('db_slow_queries_total', database='image', operation='SELECT') > before
+    # 测试库 SQLite 使用位置参数，参数结构为类型列表
+    slow = [message for message in warnings if 'SELECT ?, ?' in message]
+    assert slow and "参数: ['str', 'int']" in slow[0]
+    assert 'p@ssw0rd' not in ''.join(warnings)
+
+
+def test_failed_statement_does_not_leak_start_time():
+    with db_manager.engine.connect() as connection:
+        with pytest.raises(OperationalError):
+            connection.execute(text("SELECT * FROM no_such_table"))
+        assert 'query_start_time' not in connection.info
+
+
+def test_param_shape_for_executemany():
+    assert param_shape([{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}]) == "2 x {'id': 'int', 'name': 'str'}"
+    assert param_shape((1, 'a', None)) == ['int', 'str', 'NoneType']
@@ -0,0 +1,141 @@
+"""存储清理：保留期、dry run、只删除没有记录引用的孤儿文件、清理后的内容可以重新上传"""
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.blueprints.image_service import image_stats, storage_gc
+from app.blueprints.image_service.image_db import db_manager, Image
+
+from .helpers import TEST_TYPE_ID, png_bytes, upload_image
+
+FOLDER = f"{TEST_TYPE_ID}_GreatAutumn"
+
+
+@pytest.fixture
+def gc_config(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'STORAGE_GC_BATCH_INTERVAL', 0)
+    monkeypatch.setitem(app.config, 'STORAGE_GC_RETENTION_DAYS', 30)
+    # 与 cron 调用一样只有应用上下文
+    with app.app_context():
+        yield app.config
+
+
+def _upload_and_delete(client, color, deleted_days_ago):
+    image = upload_image(client, png_bytes(color=color), f"{color[0]}.png")['data']
+    client.delete(f"/image/{image['id']}")
+    with db_manager.session_scope() as session:
+        session.get(Image, image['id']).deleted_at = datetime.now() - timedelta(days=deleted_days_ago)
+    return image
+
+
+def _row_exists(image_id):
+    with db_manager.session_scope() as session:
+        return session.get(Image, image_id) is not None
+
+
+def _files(image_db, image):
+    return [path for path in (image_db / FOLDER, image_db / 'thumbnails')
+            for path in path.glob(f"{image['filename']}*")]
+
+
+def test_purge_respects_retention_cutoff(client, image_db, gc_config):
+    old = _upload_and_delete(client, (1, 0, 0), deleted_days_ago=40)
+    recent = _upload_and_delete(client, (2, 0, 0), deleted_days_ago=1)
+    kept = upload_image(client, png_bytes(color=(3, 0, 0)), 'kept.png')['data']
+    old_bytes = sum(path.stat().st_size for path in _files(image_db, old))
+    assert old_bytes
+
+    counters = storage_gc.purge_deleted(gc_config)
+
+    assert counters == {'purged': 1, 'bytes': old_bytes}
+    assert not _row_exists(old['id']) and not _files(image_db, old)
+    assert _row_exists(recent['id']) and _files(image_db, recent)
+    assert _row_exists(kept['id']) and _files(image_db, kept)
+    stats = image_stats.get_type_stats(TEST_TYPE_ID)
+    assert (stats['active_count'], stats['deleted_count']) == (1, 1)
+
+
+def test_dry_run_deletes_nothing(client, image_db, gc_config):
+    old = _upload_and_delete(client, (4, 0, 0), deleted_days_ago=40)
+    files = {path: path.stat().st_size for path in _files(image_db, old)}
+    orphan = image_db / FOLDER / 'orphan.png'
+    orphan.write_bytes(b'x' * 10)
+    os.utime(orphan, (time.time() - 2 * 86400, time.time() - 2 * 86400))
+
+    purged = storage_gc.purge_deleted(gc_config, dry_run=True)
+    scanned = storage_gc.scan_storage(gc_config, delete_orphans=True, dry_run=True)
+
+    assert purged == {'purged': 1, 'bytes': sum(files.values())}
+    assert scanned['orphans'] == 1 and scanned['orphans_removed'] == 0
+    assert _row_exists(old['id'])
+    assert all(path.exists() for path in files) and orphan.exists()
+    assert image_stats.get_type_stats(TEST_TYPE_ID)['deleted_count'] == 1
+
+
+def test_orphans_are_removed_only_without_referencing_row(client, image_db, gc_config):
+    active = upload_image(client, png_bytes(color=(5, 0, 0)), 'active.png')['data']
+    deleted = _upload_and_delete(client, (6, 0, 0), deleted_days_ago=1)
+    old = time.time() - 2 * 86400
+    orphans = [image_db / FOLDER / 'orphan.png', image_db / FOLDER / 'orphan.png.webp',
+               image_db / 'thumbnails' / 'orphan.png']
+    young = image_db / FOLDER / 'young.png'
+    for path in orphans + [young]:
+        path.write_bytes(b'x' * 10)
+    for path in orphans + _files(image_db, active) + _files(image_db, deleted):
+        os.utime(path, (old, old))
+
+    counters = storage_gc.scan_storage(gc_config, delete_orphans=True)
+
+    assert counters['orphans'] == 4
+    assert counters['orphans_removed'] == 3
+    assert not any(path.exists() for path in orphans)
+    assert young.exists()  # 可能是正在写入的文件，不够旧不删除
+    # 已软删除但还在保留期内的图片仍被记录引用，文件和兄弟文件都保留
+    assert _files(image_db, deleted) and _files(image_db, active)
+    assert counters['missing'] == 0
+
+
+def test_scan_reports_rows_whose_file_is_missing(client, image_db, gc_config):
+    image = upload_image(client, png_bytes(color=(7, 0, 0)), 'lost.png')['data']
+    (image_db / FOLDER / image['filename']).unlink()
+
+    counters = storage_gc.scan_storage(gc_config)
+
+    assert counters['missing_ids'] == [image['id']]
+
+
+def test_purged_content_can_be_uploaded_again(client, image_db, gc_config):
+    old = _upload_and_delete(client, (8, 0, 0), deleted_days_ago=40)
+    storage_gc.purge_deleted(gc_config)
+
+    again = upload_image(client, png_bytes(color=(8, 0, 0)), 'again.png')
+
+    assert again['message'] == 'Image uploaded successfully'
+    assert again['data']['filename'] == old['filename']
+    assert client.get(f"/image/{old['filename']}").status_code == 200
+
+
+def test_reupload_restores_files_when_purge_commit_failed(client, image_db, gc_config, monkeypatch):
+    old = _upload_and_delete(client, (9, 0, 0), deleted_days_ago=40)
+
+    def failing_purge(session, image):
+        raise RuntimeError("connection lost")
+
+    # 文件已删除、记录的删除没有提交：记录仍是软删除状态
+    with monkeypatch.context() as patch:
+        patch.setattr(storage_gc.image_stats, 'record_purge', failing_purge)
+        with pytest.raises(RuntimeError):
+            storage_gc.purge_deleted(gc_config)
+    assert _row_exists(old['id']) and not _files(image_db, old)
+
+    again = upload_image(client, png_bytes(color=(9, 0, 0)), 'again.png')
+
+    assert again['message'] == 'Duplicate image found'
+    assert again['data']['id'] == old['id']
+    assert again['data']['thumbnail_status'] == 'done'
+    assert (image_db / FOLDER / old['filename']).exists()
+    assert (image_db / 'thumbnails' / old['filename']).exists()
+    stats = image_stats.get_type_stats(TEST_TYPE_ID)
+    assert (stats['active_count'], stats['deleted_count']) == (1, 0)
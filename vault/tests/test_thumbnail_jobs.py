@@ -0,0 +1,114 @@
+"""缩略图任务队列：领取、完成、失败重试、超时重新排队和最大次数"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.blueprints.image_service import thumbnail_jobs
+from app.blueprints.image_service.image_db import db_manager, Image, ThumbnailJob
+from app.blueprints.image_service.thumbnail_jobs import ThumbnailWorker
+from config import TestingConfig
+
+from .helpers import png_bytes, upload_image
+
+
+@pytest.fixture(autouse=True)
+def thumbnail_async(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'THUMBNAIL_ASYNC', True)
+
+
+@pytest.fixture
+def worker(image_db):
+    return ThumbnailWorker(str(image_db), max_attempts=2, retry_delay=0, running_timeout=60)
+
+
+@pytest.fixture
+def image_id(client):
+    return upload_image(client, png_bytes(), 'job.png')['data']['id']
+
+
+def _job_state(image_id):
+    with db_manager.session_scope() as session:
+        job = session.query(ThumbnailJob).filter_by(image_id=image_id).one()
+        image = session.get(Image, image_id)
+        return job.status, job.attempts, image.thumbnail_status
+
+
+def _age_running_jobs(seconds):
+    with db_manager.session_scope() as session:
+        session.query(ThumbnailJob).update({ThumbnailJob.updated_at: datetime.now() - timedelta(seconds=seconds)})
+
+
+def test_upload_enqueues_job(image_id):
+    assert _job_state(image_id) == (ThumbnailJob.STATUS_PENDING, 0, ThumbnailJob.STATUS_PENDING)
+
+
+def test_sync_mode_is_the_default(app, client, monkeypatch):
+    # 没有运行 worker 的部署保持上传时同步生成缩略图
+    assert TestingConfig.THUMBNAIL_ASYNC is False
+    monkeypatch.setitem(app.config, 'THUMBNAIL_ASYNC', TestingConfig.THUMBNAIL_ASYNC)
+    image = upload_image(client, png_bytes(color=(3, 3, 3)), 'sync.png')['data']
+
+    assert image['thumbnail_status'] == ThumbnailJob.STATUS_DONE
+    with db_manager.session_scope() as session:
+        assert session.query(ThumbnailJob).count() == 0
+
+
+def test_claim_marks_running_and_is_not_claimed_twice(worker, image_id, image_db):
+    claimed = worker.claim_jobs()
+
+    assert len(claimed) == 1
+    job_id, claimed_image_id, image_path = claimed[0]
+    assert claimed_image_id == image_id
+    assert os.path.exists(image_path)
+    assert _job_state(image_id) == (ThumbnailJob.STATUS_RUNNING, 1, ThumbnailJob.STATUS_RUNNING)
+    assert worker.claim_jobs() == []
+
+
+def test_run_once_generates_thumbnail(worker, image_id, image_db):
+    with ThreadPoolExecutor(1) as executor:
+        assert worker.run_once(executor) == 1
+
+    assert _job_state(image_id) == (ThumbnailJob.STATUS_DONE, 1, ThumbnailJob.STATUS_DONE)
+    with db_manager.session_scope() as session:
+        image = session.get(Image, image_id)
+        assert image.phash
+        assert os.path.exists(os.path.join(image_db, 'thumbnails', image.uuid_filename))
+
+
+def test_failed_job_retries_until_max_attempts(worker, image_id, monkeypatch):
+    def broken_thumbnail(*args):
+        raise RuntimeError("decode failed")
+
+    monkeypatch.setattr(thumbnail_jobs, 'generate_thumbnail', broken_thumbnail)
+    with ThreadPoolExecutor(1) as executor:
+        worker.run_once(executor)
+        assert _job_state(image_id) == (ThumbnailJob.STATUS_PENDING, 1, ThumbnailJob.STATUS_PENDING)
+        worker.run_once(executor)
+        assert _job_state(image_id) == (ThumbnailJob.STATUS_FAILED, 2, ThumbnailJob.STATUS_FAILED)
+        assert worker.run_once(executor) == 0
+
+    with db_manager.session_scope() as session:
+        assert session.query(ThumbnailJob.last_error).scalar() == "decode failed"
+
+
+def test_requeue_stale_running_job(worker, image_id):
+    worker.claim_jobs()
+    worker.requeue_stale_jobs()
+    assert _job_state(image_id)[0] == ThumbnailJob.STATUS_RUNNING  # 未超时的不动
+
+    _age_running_jobs(worker.running_timeout + 1)
+    worker.requeue_stale_jobs()
+    assert _job_state(image_id) == (ThumbnailJob.STATUS_PENDING, 1, ThumbnailJob.STATUS_PENDING)
+    assert len(worker.claim_jobs()) == 1
+
+
+def test_requeue_fails_job_at_max_attempts(worker, image_id):
+    for _ in range(worker.max_attempts):
+        worker.claim_jobs()
+        _age_running_jobs(worker.running_timeout + 1)
+        worker.requeue_stale_jobs()
+
+    assert _job_state(image_id) == (ThumbnailJob.STATUS_FAILED, 2, ThumbnailJob.STATUS_FAILED)
+    assert worker.claim_jobs() == []
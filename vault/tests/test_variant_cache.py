@@ -0,0 +1,68 @@
+"""缩略图变体缓存：单飞生成、固定数量的锁文件、按 mtime 淘汰"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.blueprints.image_service.variant_cache import VariantCache
+
+from .helpers import png_bytes
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'source.png'
+    path.write_bytes(png_bytes(400, 300).getvalue())
+    return str(path)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return VariantCache(str(tmp_path / 'variants'), max_bytes=10 * 1024 * 1024)
+
+
+def test_concurrent_requests_generate_variant_once(cache, source, monkeypatch):
+    calls = []
+    generate = VariantCache._generate
+
+    def slow_generate(source_path, path, size):
+        calls.append(threading.get_ident())
+        time.sleep(0.05)
+        return generate(source_path, path, size)
+
+    monkeypatch.setattr(VariantCache, '_generate', staticmethod(slow_generate))
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        paths = list(executor.map(lambda _: cache.get_or_create(100, 100, 'a.png', source), range(8)))
+
+    assert len(calls) == 1
+    assert set(paths) == {cache.variant_path(100, 100, 'a.png')}
+    assert os.path.getsize(paths[0]) > 0
+
+
+def test_lock_files_do_not_grow_with_variants(cache, source, monkeypatch):
+    monkeypatch.setattr(VariantCache, 'LOCK_STRIPES', 4)
+    for index in range(12):
+        cache.get_or_create(32, 32, f"{index}.png", source)
+
+    assert len(os.listdir(cache.lock_dir)) <= 4
+    assert len(os.listdir(os.path.join(cache.cache_dir, '32x32'))) == 12
+
+
+def test_eviction_removes_least_recently_used_down_to_watermark(cache, source):
+    first = cache.get_or_create(64, 64, 'old.png', source)
+    size = os.path.getsize(first)
+    cache.get_or_create(64, 64, 'used.png', source)
+    os.utime(first, (time.time() - 3600, time.time() - 3600))
+    used = cache.variant_path(64, 64, 'used.png')
+    os.utime(used, (time.time() - 7200, time.time() - 7200))
+    assert cache.get_or_create(64, 64, 'used.png', source) == used  # 命中时刷新 mtime
+
+    cache.max_bytes = int(size * 2.5)
+    cache.get_or_create(64, 64, 'new.png', source)
+
+    assert not os.path.exists(first)
+    assert os.path.exists(used)
+    assert os.path.exists(cache.variant_path(64, 64, 'new.png'))
+    assert cache._total_bytes <= cache.max_bytes * VariantCache.LOW_WATERMARK